@@ -1,13 +1,15 @@
 """Python programm to create object that enables addition of a block"""
 import time
 import datetime
-import hashlib
-import json
 
 import sqlite3
 
-from ..constants import NEWRL_DB
 from .crypto import calculate_hash
+from .checkpoints import on_block_committed
+from .db_manager import db_transaction, get_cursor
+from .encoding import canonical_hash, get_proof_hasher
+from .fs.block_store import append_block, clear_block_store, init_block_store
+from .pruning import prune_chain
 from .state_updater import update_db_states
 from .utils import get_time_ms
 
@@ -20,22 +22,21 @@ class Blockchain:
 
     def create_block(self, cur, block, block_hash):
         """Create a block and store to db"""
-        transactions_hash = self.calculate_hash(block['text']['transactions'])
+        # transactions_hash is set to the transactions Merkle root once they are added
         db_block_data = (
             block['index'],
             block['timestamp'],
             block['proof'],
             block['previous_hash'],
-            block_hash,
-            transactions_hash
+            block_hash
         )
-        cur.execute('INSERT OR IGNORE INTO blocks (block_index, timestamp, proof, previous_hash, hash, transactions_hash) VALUES (?, ?, ?, ?, ?, ?)', db_block_data)
+        cur.execute('INSERT OR IGNORE INTO blocks (block_index, timestamp, proof, previous_hash, hash) VALUES (?, ?, ?, ?, ?)', db_block_data)
         return block
 
-    def get_block(self, block_index):
-        con = sqlite3.connect(NEWRL_DB)
-        con.row_factory = sqlite3.Row
-        cur = con.cursor()
+    def get_block(self, block_index, cur=None):
+        """Build a block from the blocks and transactions tables"""
+        cur = cur.connection.cursor() if cur is not None else get_cursor()
+        cur.row_factory = sqlite3.Row
         block_cursor = cur.execute(
             'SELECT * FROM blocks where block_index=?', (block_index,)).fetchone()
         block = dict(block_cursor)
@@ -52,20 +53,19 @@ class Blockchain:
     def proof_of_work(self, block):
         """Proof of work which takes a block with proof set as 0 as input and 
            returns the proof that makes its hash start with 0000"""
+        hash_proof = get_proof_hasher(block)
         proof = 1
-        block_hash = ''
-
+        block_hash = hash_proof(proof)
         while block_hash[:4] != '0000':
-            block['proof'] = proof
-            block_hash = self.calculate_hash(block)
             proof += 1
+            block_hash = hash_proof(proof)
 
+        block['proof'] = proof
         return block_hash
 
     def calculate_hash(self, block):
         """Calculate hash of a given block using sha256"""
-        encoded_block = json.dumps(block, sort_keys=True).encode()
-        return hashlib.sha256(encoded_block).hexdigest()
+        return canonical_hash(block)
 
     def chain_valid(self, chain):
         """Validate a chain using previous hash and starting bytes"""
@@ -108,11 +108,8 @@ class Blockchain:
 
     def get_latest_ts(self, cur=None):
         """Get the timestamp of latest block"""
-        should_close_db_conn = False
         if not cur:
-            con = sqlite3.connect(NEWRL_DB)
-            cur = con.cursor()
-            should_close_db_conn = True
+            cur = get_cursor()
         last_block_cursor = cur.execute(
             'SELECT block_index, timestamp FROM blocks ORDER BY block_index DESC LIMIT 1')
         last_block = last_block_cursor.fetchone()
@@ -120,8 +117,6 @@ class Blockchain:
             ts = None
         else:
             ts = last_block[1]
-        if should_close_db_conn:
-            con.close()
         return ts
 
 
@@ -131,42 +126,61 @@ def add_block(cur, block, block_hash=None):
     block_index = block['block_index'] if 'block_index' in block else block['index']
     if not block_hash:
         block_hash = block['hash'] if 'hash' in block else ''
-    # transactions_hash = block['transactions_hash'] if 'transactions_hash' in block else ''
-    transactions_hash = calculate_hash(block['text']['transactions'])
     print('Adding block', block_index)
+    # transactions_hash is set to the transactions Merkle root once they are added
     db_block_data = (
         block_index,
         block['timestamp'],
         block['proof'],
         block['previous_hash'],
-        block_hash,
-        transactions_hash
+        block_hash
     )
-    cur.execute('INSERT OR IGNORE INTO blocks (block_index, timestamp, proof, previous_hash, hash, transactions_hash) VALUES (?, ?, ?, ?, ?, ?)', db_block_data)
+    cur.execute('INSERT OR IGNORE INTO blocks (block_index, timestamp, proof, previous_hash, hash) VALUES (?, ?, ?, ?, ?)', db_block_data)
     update_db_states(cur, block_index, block['text']['transactions'])
+    store_block(cur, block_index)
+    prune_chain(cur, block_index)
+    return block_index
+
+
+def commit_block(block, block_hash=None):
+    """Add a block in its own db transaction and run the post commit hooks"""
+    with db_transaction() as cur:
+        block_index = add_block(cur, block, block_hash)
+    on_block_committed(block_index)
+
+
+def store_block(cur, block_index):
+    """Serialize a block from the db into the block store"""
+    append_block(cur, Blockchain().get_block(block_index, cur))
+
+
+def rebuild_block_store(cur):
+    """Serialize every block again, after a migration changed what is stored for them"""
+    clear_block_store(cur)
+    init_block_store(cur)
+    for block in cur.execute('SELECT block_index FROM blocks ORDER BY block_index').fetchall():
+        store_block(cur, block[0])
 
 
 def get_last_block_index():
     """Get last block index from db"""
-    con = sqlite3.connect(NEWRL_DB)
-    cur = con.cursor()
+    cur = get_cursor()
     last_block_cursor = cur.execute(
         'SELECT block_index FROM blocks ORDER BY block_index DESC LIMIT 1'
     )
     last_block = last_block_cursor.fetchone()
-    con.close()
+    cur.close()
     return last_block[0] if last_block is not None else 0
 
 
 def get_last_block_hash():
     """Get last block hash from db"""
-    con = sqlite3.connect(NEWRL_DB)
-    cur = con.cursor()
+    cur = get_cursor()
     last_block_cursor = cur.execute(
         'SELECT block_index, hash FROM blocks ORDER BY block_index DESC LIMIT 1'
     )
     last_block = last_block_cursor.fetchone()
-    con.close()
+    cur.close()
 
     if last_block is not None:
         return {
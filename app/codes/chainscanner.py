@@ -1,15 +1,20 @@
 """Chain and state queries"""
 import sqlite3
 
-from ..constants import NEWRL_DB
 from .blockchain import Blockchain
+from .db_manager import get_connection, get_cursor
+from .db_updater import get_block_transaction_hashes
+from .fs import block_store
+from .merkle import MerkleTree
 
 
 class Chainscanner():
-    def __init__(self):
+    def __init__(self, cur=None):
         self.blockchain = Blockchain()
-        self.con = sqlite3.connect(NEWRL_DB)
-        self.cur = self.con.cursor()
+        if cur is None:
+            self.con = get_connection()
+            cur = self.con.cursor()
+        self.cur = cur
 
     def getbalancesbytoken(self, tokencode):
         """Get token balance across wallets"""
@@ -48,9 +53,8 @@ class Chainscanner():
             return row[0]
 
 
-def get_wallet_token_balance(wallet_address, token_code):
-    con = sqlite3.connect(NEWRL_DB)
-    cur = con.cursor()
+def get_wallet_token_balance(wallet_address, token_code, cur=None):
+    cur = cur.connection.cursor() if cur is not None else get_cursor()
     balance_cursor = cur.execute('SELECT balance FROM balances WHERE wallet_address = :address AND tokencode = :tokencode', {
         'address': wallet_address, 'tokencode': token_code})
     balance_row = balance_cursor.fetchone()
@@ -59,10 +63,10 @@ def get_wallet_token_balance(wallet_address, token_code):
     return balance
 
 
-def download_state():
-    con = sqlite3.connect(NEWRL_DB)
-    con.row_factory = sqlite3.Row
-    cur = con.cursor()
+def download_state(cur=None):
+    # A cursor of our own, so the caller's keeps its row type
+    cur = cur.connection.cursor() if cur is not None else get_cursor()
+    cur.row_factory = sqlite3.Row
     wallets_cursor = cur.execute('SELECT * FROM wallets').fetchall()
     wallets = [dict(ix) for ix in wallets_cursor]
 
@@ -77,35 +81,51 @@ def download_state():
         'tokens': tokens,
         'balances': balances,
     }
+    cur.close()
     return state
 
 
-def get_transaction(transaction_code):
-    con = sqlite3.connect(NEWRL_DB)
-    con.row_factory = sqlite3.Row
-    cur = con.cursor()
+def get_transaction(transaction_code, cur=None):
+    cur = cur.connection.cursor() if cur is not None else get_cursor()
+    cur.row_factory = sqlite3.Row
     transaction_cursor = cur.execute(
         'SELECT * FROM transactions where transaction_code=?', (transaction_code,)).fetchone()
+    cur.close()
     return dict(transaction_cursor)
 
 
-def download_chain():
-    con = sqlite3.connect(NEWRL_DB)
-    con.row_factory = sqlite3.Row
-    cur = con.cursor()
-    blocks_cursor = cur.execute('SELECT * FROM blocks').fetchall()
-    blocks = [dict(ix) for ix in blocks_cursor]
-    for idx, block in enumerate(blocks):
-        print(block)
-        transactions_cursor = cur.execute(
-            'SELECT * FROM transactions where block_index=' + str(block['block_index'])).fetchall()
-        transactions = [dict(ix) for ix in transactions_cursor]
-        block[idx] = {
-            'text': {
-                'transactions': transactions
-            }
-        }
-    print(blocks)
-
-    chain = blocks
+def get_transaction_proof(transaction_code, cur=None):
+    """Merkle audit path of a transaction to its block's transactions hash"""
+    if cur is None:
+        cur = get_cursor()
+    transaction = cur.execute('SELECT block_index, transaction_hash FROM transactions WHERE transaction_code = ?',
+                              (transaction_code, )).fetchone()
+    if transaction is None:
+        return None
+    block_index, transaction_hash = transaction[0], transaction[1]
+    transaction_hashes = get_block_transaction_hashes(cur, block_index)
+    transactions_hash = cur.execute('SELECT transactions_hash FROM blocks WHERE block_index = ?',
+                                    (block_index, )).fetchone()[0]
+    return {
+        'transaction_code': transaction_code,
+        'block_index': block_index,
+        'transaction_hash': transaction_hash,
+        'transactions_hash': transactions_hash,
+        'proof': MerkleTree(transaction_hashes).proof(transaction_hashes.index(transaction_hash)),
+    }
+
+
+def download_chain(cur=None):
+    """All blocks with their transactions, served from the block store"""
+    if cur is None:
+        cur = get_cursor()
+    block_indexes = [row[0] for row in cur.execute('SELECT block_index FROM blocks ORDER BY block_index')]
+    stored_blocks = block_store.get_blocks(cur, block_indexes)
+    blockchain = Blockchain()
+    chain = []
+    for block_index in block_indexes:
+        block = stored_blocks.get(block_index)
+        if block is None:
+            block = blockchain.get_block(block_index, cur)
+        chain.append(block)
     return chain
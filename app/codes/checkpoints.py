@@ -0,0 +1,194 @@
+"""Periodic state checkpoints
+
+Every STATE_CHECKPOINT_INTERVAL blocks the state tables are copied into a
+separate db file named after the block height. A revert restores the nearest
+checkpoint at or below the target height and replays only the blocks after it.
+"""
+import glob
+import json
+import os
+import sqlite3
+
+from .db_manager import get_connection, read_snapshot
+from .events import publish_block_committed
+from .fs.block_store import truncate_block_store, truncate_segments
+from .fs.mempool_manager import get_mempool
+from .signature_verifier import clear_wallet_public_keys
+from .state_updater import update_state_from_transaction
+from .state_tree import rebuild_state_tree
+from .state_view import StateView
+from .verdict_cache import apply_state_changes, clear_verdicts
+from ..constants import CHECKPOINTS_PATH, NEWRL_DB, STATE_CHECKPOINT_INTERVAL, STATE_CHECKPOINTS_TO_KEEP
+
+
+STATE_TABLES = [
+    'wallets',
+    'tokens',
+    'wallet_ids',
+    'token_ids',
+    'balances_store',
+    'transfers',
+    'contracts',
+    'kyc',
+    'person',
+    'person_wallet',
+    'trust_scores',
+    'state_tree',
+]
+
+
+def _checkpoint_path(block_index, folder=CHECKPOINTS_PATH):
+    return f'{folder}state_{block_index}.db'
+
+
+def get_checkpoint_heights(folder=CHECKPOINTS_PATH):
+    heights = []
+    for path in glob.glob(f'{folder}state_*.db'):
+        heights.append(int(os.path.basename(path)[len('state_'):-len('.db')]))
+    return sorted(heights)
+
+
+def on_block_committed(block_index):
+    """Post commit hook for a new block
+
+    Invalidates the verdicts that read balances the block changed, drops the
+    block's transactions from the mempool, whichever node made the block,
+    publishes the block's events and writes a checkpoint every
+    STATE_CHECKPOINT_INTERVAL blocks.
+    """
+    apply_state_changes(block_index)
+    with read_snapshot() as (cur, block_height):
+        transaction_codes = [row[0] for row in cur.execute(
+            'SELECT transaction_code FROM transactions WHERE block_index = ?', (block_index, ))]
+    get_mempool().remove(transaction_codes, 'included')
+    publish_block_committed(block_index)
+    if block_index % STATE_CHECKPOINT_INTERVAL == 0:
+        write_checkpoint(block_index)
+
+
+def write_checkpoint(block_index, folder=CHECKPOINTS_PATH):
+    """Copy the state tables as of block_index into a checkpoint db
+
+    The copy is read from a snapshot, so a block committed meanwhile cannot leak
+    into it. Returns False, writing nothing, if the snapshot is not at
+    block_index because another block got in first.
+    """
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    path = _checkpoint_path(block_index, folder)
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    with read_snapshot() as (cur, block_height):
+        if block_height != block_index:
+            print(f'Not writing checkpoint {block_index}, the chain is already at {block_height}')
+            return False
+        checkpoint = sqlite3.connect(tmp_path)
+        try:
+            for table in STATE_TABLES:
+                schema = cur.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                     (table, )).fetchone()
+                if schema is None:
+                    continue
+                checkpoint.execute(schema[0])
+                rows = cur.execute(f'SELECT * FROM {table}')
+                placeholders = ', '.join(['?'] * len(rows.description))
+                checkpoint.executemany(f'INSERT INTO {table} VALUES ({placeholders})', rows)
+            checkpoint.commit()
+        finally:
+            checkpoint.close()
+    os.replace(tmp_path, path)
+
+    for height in get_checkpoint_heights(folder)[:-STATE_CHECKPOINTS_TO_KEEP]:
+        os.remove(_checkpoint_path(height, folder))
+    return True
+
+
+def remove_checkpoints_after(block_index, folder=CHECKPOINTS_PATH):
+    for height in get_checkpoint_heights(folder):
+        if height > block_index:
+            os.remove(_checkpoint_path(height, folder))
+
+
+def clear_checkpoints(folder=CHECKPOINTS_PATH):
+    remove_checkpoints_after(-1, folder)
+
+
+def _restore_checkpoint(cur):
+    """Replace the state tables with the attached checkpoint's copy"""
+    for table in STATE_TABLES:
+        cur.execute(f'DELETE FROM main.{table}')
+        columns = [column[1] for column in cur.execute(f'PRAGMA checkpoint.table_info({table})')]
+        if not columns:
+            if table == 'state_tree':
+                # Checkpoint predates the state tree
+                rebuild_state_tree(cur)
+            continue
+        column_list = ', '.join(columns)
+        cur.execute(f'INSERT INTO main.{table} ({column_list}) SELECT {column_list} FROM checkpoint.{table}')
+
+
+def revert_state(block_index, folder=CHECKPOINTS_PATH):
+    """Revert the chain, state and block store index to block_index in a single transaction
+
+    The block store's segment files are cut after the commit. A crash before
+    that only leaves unindexed bytes behind, which are skipped and appended
+    after like those of a rolled back block.
+
+    Returns False, leaving the db untouched, if the blocks to replay have been pruned.
+    """
+    heights = [height for height in get_checkpoint_heights(folder) if height <= block_index]
+    checkpoint_height = heights[-1] if heights else 0
+
+    con = get_connection(NEWRL_DB)
+    cur = con.cursor()
+    pruned = cur.execute('''SELECT COUNT(*) FROM transactions
+        WHERE block_index > ? AND block_index <= ? AND specific_data IS NULL''',
+                         (checkpoint_height, block_index)).fetchone()[0]
+    if pruned:
+        cur.close()
+        return False
+
+    if checkpoint_height:
+        cur.execute('ATTACH DATABASE ? AS checkpoint', (_checkpoint_path(checkpoint_height, folder), ))
+    try:
+        cur.execute('DELETE FROM blocks WHERE block_index > ?', (block_index, ))
+        cur.execute('DELETE FROM transactions WHERE block_index > ?', (block_index, ))
+        removed_blocks = truncate_block_store(cur, block_index)
+        if checkpoint_height:
+            _restore_checkpoint(cur)
+        else:
+            for table in STATE_TABLES:
+                cur.execute(f'DELETE FROM main.{table}')
+
+        transactions_cursor = cur.execute('''SELECT transaction_code, block_index, type, timestamp, specific_data
+            FROM transactions WHERE block_index > ? ORDER BY block_index, rowid''', (checkpoint_height, )).fetchall()
+        state = StateView(cur)
+        for transaction in transactions_cursor:
+            transaction_code = transaction[0]
+            transaction_type = transaction[2]
+            timestamp = transaction[3]
+            specific_data = transaction[4]
+            while isinstance(specific_data, str):
+                specific_data = json.loads(specific_data)
+
+            update_state_from_transaction(state, transaction_type, specific_data, transaction_code, timestamp)
+
+        state.flush()
+        con.commit()
+    except Exception:
+        con.rollback()
+        raise
+    finally:
+        if checkpoint_height:
+            cur.execute('DETACH DATABASE checkpoint')
+        cur.close()
+
+    # Segment files cannot be rolled back, so only cut them once the revert is committed
+    truncate_segments(removed_blocks)
+    remove_checkpoints_after(block_index, folder)
+    # Wallets created after block_index are gone
+    clear_wallet_public_keys()
+    clear_verdicts()
+    return True
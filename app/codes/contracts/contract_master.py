@@ -9,21 +9,23 @@
 import json
 import datetime
 import time
-import sqlite3
 #import hashlib
 
-from ...constants import NEWRL_DB
+from ..db_manager import get_cursor
 from ..db_updater import *
 
 class ContractMaster():
     codehash=""    #this is the hash of the entire document excluding this line, it is same for all instances of this class
-    def __init__(self, template, version, contractaddress=None):
+    def __init__(self, template, version, contractaddress=None, cur=None):
         self.address=contractaddress    #this is for instances of this class created for tx creation and other non-chain work
+        params = False
         if contractaddress:     #as in this is an existing contract
-            con = sqlite3.connect(NEWRL_DB)
-            cur = con.cursor()
-            params = self.loadcontract(cur, contractaddress)  #this will populate the params for a given instance of the contract
-            con.close()
+            if cur is not None:     #loading inside a block update, read through the caller's state
+                params = self.loadcontract(cur, contractaddress)
+            else:
+                cur = get_cursor()
+                params = self.loadcontract(cur, contractaddress)  #this will populate the params for a given instance of the contract
+                cur.close()
         if not params or not contractaddress:   #either no contractaddress provided or new adddress not in db
             contractparams={}
             contractparams['creator']=""
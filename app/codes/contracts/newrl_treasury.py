@@ -2,10 +2,10 @@ from .contract_master import ContractMaster
 from ..db_updater import *
 
 class newrl_treasury(ContractMaster):
-    def __init__(self,contractaddress=None):
+    def __init__(self,contractaddress=None,cur=None):
         self.template= "newrl_treasury"
         self.version="1.0.0"
-        ContractMaster.__init__(self, self.template, self.version, contractaddress)
+        ContractMaster.__init__(self, self.template, self.version, contractaddress, cur)
     
     def updateondeploy(self, cur):
         return True
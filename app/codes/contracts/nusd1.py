@@ -5,10 +5,10 @@ from ..db_updater import *
 class nusd1(ContractMaster):
     codehash=""    #this is the hash of the entire document excluding this line, it is same for all instances of this class
 
-    def __init__(self,contractaddress=None):
+    def __init__(self,contractaddress=None,cur=None):
         self.template= "nusd1"
         self.version=""
-        ContractMaster.__init__(self, self.template, self.version, contractaddress)
+        ContractMaster.__init__(self, self.template, self.version, contractaddress, cur)
 
     def updateondeploy(self, cur):
         if 'legaldochash' in self.contractparams['legalparams']:
@@ -53,7 +53,7 @@ class nusd1(ContractMaster):
         tokendata={"tokencode": cspecs['tokencode'],
                    "first_owner": recipient_address,
                    "custodian": self.address,
-                   "amount_created": int(value*100),
+                   "amount_created": to_minor_units(value, 2),
                    "value_created": value,
                    "tokendecimal":2
                    }
@@ -1,21 +1,19 @@
 import base64
-import hashlib
-import json
-import ecdsa
+
+from .crypto_provider import get_crypto_provider
+from .encoding import canonical_hash, signing_encode
 
 
 def calculate_hash(block):
     """Calculate hash of a given block using sha256"""
-    encoded_block = json.dumps(block, sort_keys=True).encode()
-    return hashlib.sha256(encoded_block).hexdigest()
+    return canonical_hash(block)
 
 
 def sign_object(private_key, data):
     """Sign an object using private key"""
     pvtkeybytes = base64.b64decode(private_key)
-    msg = json.dumps(data).encode()
-    sk = ecdsa.SigningKey.from_string(pvtkeybytes, curve=ecdsa.SECP256k1)
-    msgsignbytes = sk.sign(msg)
+    msg = signing_encode(data)
+    msgsignbytes = get_crypto_provider().sign(pvtkeybytes, msg)
     msgsign = base64.b64encode(msgsignbytes).decode('utf-8')
     return msgsign
 
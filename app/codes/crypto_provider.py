@@ -0,0 +1,150 @@
+"""secp256k1 key generation, signing and verification behind one interface
+
+Every provider produces and accepts the same encodings, so nodes running
+different providers interoperate:
+
+    private key  32 raw bytes
+    public key   64 raw bytes, x then y
+    signature    64 raw bytes, r then s, over the SHA-1 digest of the message
+
+SHA-1 is python-ecdsa's default and what every signature on chain so far was
+made with. Signatures with a high s verify with every provider.
+
+The provider is chosen once per process from CRYPTO_PROVIDER. 'auto' picks
+coincurve, which wraps libsecp256k1, when it is installed and python-ecdsa
+otherwise.
+"""
+import abc
+import hashlib
+import os
+
+import ecdsa
+from ecdsa.util import sigdecode_der, sigdecode_string, sigencode_der, sigencode_string
+
+from ..constants import CRYPTO_PROVIDER
+
+try:
+    import coincurve
+except ImportError:
+    coincurve = None
+
+
+CURVE = ecdsa.SECP256k1
+
+
+class CryptoProvider(abc.ABC):
+    name = None
+
+    def generate_private_key(self):
+        return os.urandom(32)
+
+    @abc.abstractmethod
+    def get_public_key(self, private_key_bytes):
+        """Public key bytes of a private key"""
+
+    @abc.abstractmethod
+    def sign(self, private_key_bytes, message):
+        """Signature bytes over message"""
+
+    @abc.abstractmethod
+    def load_public_key(self, public_key_bytes):
+        """Parsed public key to pass to verify, raises for an invalid key"""
+
+    def precompute(self, public_key):
+        """Public key prepared for verifying many signatures"""
+        return public_key
+
+    @abc.abstractmethod
+    def verify(self, public_key, signature_bytes, message):
+        """Whether signature_bytes is a valid signature of message, never raises for a bad signature"""
+
+
+class EcdsaProvider(CryptoProvider):
+    """Pure Python, always available"""
+    name = 'ecdsa'
+
+    def get_public_key(self, private_key_bytes):
+        return ecdsa.SigningKey.from_string(private_key_bytes, curve=CURVE).verifying_key.to_string()
+
+    def sign(self, private_key_bytes, message):
+        return ecdsa.SigningKey.from_string(private_key_bytes, curve=CURVE).sign(message)
+
+    def load_public_key(self, public_key_bytes):
+        return ecdsa.VerifyingKey.from_string(public_key_bytes, curve=CURVE)
+
+    def precompute(self, public_key):
+        # Keys parsed from a string carry a point without the curve order, which the tables need
+        point = public_key.pubkey.point
+        point = ecdsa.ellipticcurve.PointJacobi(CURVE.curve, point.x(), point.y(), 1, CURVE.order, generator=True)
+        precomputed = ecdsa.VerifyingKey.from_public_point(point, curve=CURVE, validate_point=False)
+        precomputed.precompute()
+        return precomputed
+
+    def verify(self, public_key, signature_bytes, message):
+        try:
+            return public_key.verify(signature_bytes, message)
+        except ecdsa.BadSignatureError:
+            return False
+
+
+def _sha1_digest(message):
+    # libsecp256k1 takes a 32 byte hash, left padding keeps the integer ecdsa derives from the SHA-1 digest
+    return bytes(12) + hashlib.sha1(message).digest()
+
+
+class CoincurveProvider(CryptoProvider):
+    """libsecp256k1 through coincurve, several times faster than python-ecdsa"""
+    name = 'coincurve'
+
+    def get_public_key(self, private_key_bytes):
+        return coincurve.PrivateKey(private_key_bytes).public_key.format(compressed=False)[1:]
+
+    def sign(self, private_key_bytes, message):
+        signature = coincurve.PrivateKey(private_key_bytes).sign(message, hasher=_sha1_digest)
+        r, s = sigdecode_der(signature, CURVE.order)
+        return sigencode_string(r, s, CURVE.order)
+
+    def load_public_key(self, public_key_bytes):
+        if len(public_key_bytes) != 64:
+            raise ValueError('Public key must be 64 bytes')
+        return coincurve.PublicKey(b'\x04' + public_key_bytes)
+
+    def verify(self, public_key, signature_bytes, message):
+        if len(signature_bytes) != 64:
+            return False
+        r, s = sigdecode_string(signature_bytes, CURVE.order)
+        if s > CURVE.order // 2:
+            # libsecp256k1 only accepts the low s form, python-ecdsa signs with either
+            s = CURVE.order - s
+        try:
+            return public_key.verify(sigencode_der(r, s, CURVE.order), message, hasher=_sha1_digest)
+        except ValueError:
+            return False
+
+
+PROVIDERS = {
+    'ecdsa': EcdsaProvider,
+    'coincurve': CoincurveProvider,
+}
+
+_provider = None
+
+
+def get_available_providers():
+    return [name for name in PROVIDERS if name != 'coincurve' or coincurve is not None]
+
+
+def get_crypto_provider(name=None):
+    """The process wide provider, or a new one of the given name"""
+    global _provider
+    if name is not None:
+        if name not in get_available_providers():
+            raise Exception(f'Crypto provider {name} is not available')
+        return PROVIDERS[name]()
+    if _provider is None:
+        if CRYPTO_PROVIDER == 'auto':
+            _provider = get_crypto_provider('coincurve' if coincurve is not None else 'ecdsa')
+        else:
+            _provider = get_crypto_provider(CRYPTO_PROVIDER)
+        print('Using crypto provider', _provider.name)
+    return _provider
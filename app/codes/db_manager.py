@@ -0,0 +1,104 @@
+"""Shared SQLite connection management for the chain and peer databases"""
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from ..constants import DB_BUSY_TIMEOUT_MS, DB_CACHE_SIZE_KB, DB_MMAP_SIZE_BYTES, DB_SYNCHRONOUS, NEWRL_DB
+
+
+_local = threading.local()
+
+
+def _connect(db_path):
+    con = sqlite3.connect(db_path, timeout=DB_BUSY_TIMEOUT_MS / 1000)
+    con.execute('PRAGMA journal_mode=WAL')
+    con.execute(f'PRAGMA synchronous={DB_SYNCHRONOUS}')
+    con.execute(f'PRAGMA cache_size=-{DB_CACHE_SIZE_KB}')
+    con.execute(f'PRAGMA mmap_size={DB_MMAP_SIZE_BYTES}')
+    con.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}')
+    return con
+
+
+def _connect_readonly(db_path):
+    con = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True, timeout=DB_BUSY_TIMEOUT_MS / 1000)
+    con.execute('PRAGMA query_only=ON')
+    con.execute(f'PRAGMA cache_size=-{DB_CACHE_SIZE_KB}')
+    con.execute(f'PRAGMA mmap_size={DB_MMAP_SIZE_BYTES}')
+    con.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}')
+    return con
+
+
+def _get_pooled(pool_name, db_path, connect):
+    pool = getattr(_local, pool_name, None)
+    if pool is None:
+        pool = {}
+        setattr(_local, pool_name, pool)
+    con = pool.get(db_path)
+    if con is None:
+        con = connect(db_path)
+        pool[db_path] = con
+    return con
+
+
+def get_connection(db_path=NEWRL_DB):
+    """Return the calling thread's connection to db_path, opening it on first use.
+
+    Connections are owned by the pool. Callers commit or rollback but never close them.
+    """
+    return _get_pooled('connections', db_path, _connect)
+
+
+def get_read_connection(db_path=NEWRL_DB):
+    """Return the calling thread's read-only connection to db_path"""
+    return _get_pooled('read_connections', db_path, _connect_readonly)
+
+
+def get_cursor(db_path=NEWRL_DB, row_factory=None):
+    """Return a new cursor on the pooled connection"""
+    cur = get_connection(db_path).cursor()
+    if row_factory is not None:
+        cur.row_factory = row_factory
+    return cur
+
+
+@contextmanager
+def db_transaction(db_path=NEWRL_DB):
+    """Yield a cursor and commit on success, rollback on error"""
+    con = get_connection(db_path)
+    try:
+        yield con.cursor()
+        con.commit()
+    except Exception:
+        con.rollback()
+        raise
+
+
+@contextmanager
+def read_snapshot(db_path=NEWRL_DB, row_factory=None):
+    """Yield (cursor, block_height) for a consistent read of the last committed block.
+
+    The read transaction pins a WAL snapshot, so every query made with the cursor
+    sees the db as of block_height, and a block commit running at the same time
+    neither blocks the reader nor shows up half applied.
+    """
+    con = get_read_connection(db_path)
+    con.execute('BEGIN')
+    try:
+        block_height = con.execute('SELECT MAX(block_index) FROM blocks').fetchone()[0] or 0
+        cur = con.cursor()
+        if row_factory is not None:
+            cur.row_factory = row_factory
+        yield cur, block_height
+    finally:
+        con.rollback()
+
+
+def close_connections():
+    """Close every connection held by the calling thread"""
+    for pool_name in ('connections', 'read_connections'):
+        connections = getattr(_local, pool_name, None)
+        if not connections:
+            continue
+        for con in connections.values():
+            con.close()
+        connections.clear()
@@ -1,7 +1,6 @@
 import codecs
 from subprocess import call
 import uuid
-import ecdsa
 from Crypto.Hash import keccak
 import os
 import json
@@ -9,42 +8,45 @@ import datetime
 import time
 import sqlite3
 import hashlib
+from decimal import Decimal, ROUND_DOWN
 
 from ..constants import NEWRL_DB
+from .crypto import calculate_hash
+from .crypto_provider import get_crypto_provider
+from .merkle import get_merkle_root
 from .utils import get_person_id_for_wallet_address, get_time_ms
 
 
+# The state helpers below take a StateView as cur. Balances, wallet and token
+# lookups go through the view; other statements pass through to the db cursor.
+
 def is_wallet_valid(cur, address):
-    wallet_cursor = cur.execute(
-        'SELECT wallet_public FROM wallets WHERE wallet_address=?', (address, ))
-    wallet = wallet_cursor.fetchone()
-    if wallet is None:
-        return False
-    return True
+    return cur.wallet_exists(address)
 
 
 def transfer_tokens_and_update_balances(cur, sender, reciever, tokencode, amount):
+    if not amount:
+        return
     sender_balance = get_wallet_token_balance(cur, sender, tokencode)
-    print("Sender is ", sender, " and their balance is ", sender_balance)
-    reciever_balance = get_wallet_token_balance(cur, reciever, tokencode)
-    print("Receiver is ", reciever, " and their balance is ", reciever_balance)
-    sender_balance = sender_balance - amount
-    reciever_balance = reciever_balance + amount
-    print("Amount is ", amount)
-    print("Updating sender's balance with ", sender_balance)
-    print("Updating reciever's balance with ", reciever_balance)
-    update_wallet_token_balance(cur, sender, tokencode, sender_balance)
-    update_wallet_token_balance(cur, reciever, tokencode, reciever_balance)
-    sender_balance = get_wallet_token_balance(cur, sender, tokencode)
-    print("Sender is ", sender, " and their balance is ", sender_balance)
     reciever_balance = get_wallet_token_balance(cur, reciever, tokencode)
-    print("Receiver is ", reciever, " and their balance is ", reciever_balance)
+    update_wallet_token_balance(cur, sender, tokencode, sender_balance - amount)
+    update_wallet_token_balance(cur, reciever, tokencode, reciever_balance + amount)
+
+
+def to_minor_units(amount, tokendecimal=0):
+    """Convert an amount to an integer count of the token's smallest unit.
+
+    Transaction amounts are already in minor units, so tokendecimal is only
+    given when converting a value quoted in whole units (e.g. nusd1 dollars).
+    """
+    if not amount:
+        return 0
+    scaled = Decimal(str(amount)).scaleb(int(tokendecimal or 0))
+    return int(scaled.to_integral_value(rounding=ROUND_DOWN))
 
 
 def update_wallet_token_balance(cur, wallet_address, token_code, balance):
-    cur.execute(f'''INSERT OR REPLACE INTO balances
-				(wallet_address, tokencode, balance)
-				 VALUES (?, ?, ?)''', (wallet_address, token_code, balance))
+    cur.set_balance(wallet_address, token_code, balance)
 
 
 def update_trust_score(cur, personid1, personid2, new_score, tstamp):
@@ -86,6 +88,7 @@ def add_wallet_pid(cur, wallet):
     cur.execute(f'''INSERT OR IGNORE INTO wallets
             (wallet_address, wallet_public, custodian_wallet, kyc_docs, owner_type, jurisdiction, specific_data)
             VALUES (?, ?, ?, ?, ?, ?, ?)''', query_params)
+    cur.wallet_added(wallet['wallet_address'])
 
     query_params = (pid, wallet['wallet_address'])
     cur.execute(f'''INSERT OR IGNORE INTO person_wallet
@@ -98,10 +101,8 @@ def add_token(cur, token, txcode=None):
     existingflag = False
     if 'tokencode' in token:  # creating more of an existing token or tokencode provided by user
         if token['tokencode'] and token['tokencode'] != "0" and token['tokencode'] != "":
-            tid = cur.execute(
-                'SELECT tokencode FROM tokens WHERE tokencode=?', (token['tokencode'], )).fetchone()
-            if tid:  # tokencode exists, more of an existing token is being added to the first_owner
-                tid = tid[0]
+            if cur.token_exists(token['tokencode']):  # tokencode exists, more of an existing token is being added to the first_owner
+                tid = str(token['tokencode'])
                 existingflag = True
             else:
                 # if provided code does not exist, it is considered new token addition
@@ -141,17 +142,18 @@ def add_token(cur, token, txcode=None):
             (tokencode, tokenname, tokentype, first_owner, custodian, legaldochash, 
             amount_created, value_created, sc_flag, disallowed, parent_transaction_code, tokendecimal, token_attributes)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', query_params)
+        cur.token_added(tid)
         if token['amount_created']:
             update_wallet_token_balance(
-                cur, token['first_owner'], tid, token['amount_created'])
+                cur, token['first_owner'], tid, to_minor_units(token['amount_created']))
 
     # now update balance for case of more of existing created
     else:
         if token['first_owner'] and token['amount_created']:
-            added_balance = int(token['amount_created'] or 0)
+            added_balance = to_minor_units(token['amount_created'])
             current_balance = get_wallet_token_balance(
                 cur, token['first_owner'], tid)
-            balance = int(current_balance or 0) + added_balance
+            balance = current_balance + added_balance
             update_wallet_token_balance(
                 cur, token['first_owner'], tid, balance)
             update_token_amount(cur, tid, token['amount_created'])
@@ -170,11 +172,7 @@ def get_kyc_doc_hash_json(kyc_docs, kyc_doc_hashes):
 
 
 def get_wallet_token_balance(cur, wallet_address, token_code):
-    balance_cursor = cur.execute('SELECT balance FROM balances WHERE wallet_address = :address AND tokencode = :tokencode', {
-        'address': wallet_address, 'tokencode': token_code})
-    balance_row = balance_cursor.fetchone()
-    balance = balance_row[0] if balance_row is not None else 0
-    return balance
+    return cur.get_balance(wallet_address, token_code)
 
 
 def add_tx_to_block(cur, block_index, transactions):
@@ -198,15 +196,78 @@ def add_tx_to_block(cur, block_index, transactions):
         cur.execute(f'''INSERT OR IGNORE INTO transactions
             (block_index, transaction_code, timestamp, type, currency, fee, description, valid, specific_data)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', db_transaction_data)
+    set_transaction_hashes(cur, block_index)
+    set_transactions_root(cur, block_index)
+
+
+def get_included_transaction_codes(cur, transaction_codes, chunk_size=500):
+    """The subset of transaction_codes already included in a block
+
+    Codes are looked up in chunks to stay under SQLite's bound parameter limit.
+    """
+    transaction_codes = list(transaction_codes)
+    included = set()
+    for start in range(0, len(transaction_codes), chunk_size):
+        chunk = transaction_codes[start:start + chunk_size]
+        placeholders = ', '.join(['?'] * len(chunk))
+        included.update(row[0] for row in cur.execute(
+            f'SELECT transaction_code FROM transactions WHERE transaction_code IN ({placeholders})', chunk))
+    return included
+
+
+def calculate_transaction_hash(transaction):
+    """Hash of a stored transaction, as returned by /get-transaction"""
+    fields = ['transaction_code', 'timestamp', 'type', 'currency', 'fee', 'description', 'valid', 'specific_data']
+    return calculate_hash({field: transaction[field] for field in fields})
+
+
+def get_block_transaction_hashes(cur, block_index):
+    """Transaction hashes of a block in block order, the leaves of its transactions Merkle tree"""
+    return [row[0] for row in cur.execute(
+        'SELECT transaction_hash FROM transactions WHERE block_index = ? ORDER BY rowid', (block_index, ))]
+
+
+def set_transactions_root(cur, block_index):
+    """Store the Merkle root of the block's transactions as its transactions_hash"""
+    cur.execute('UPDATE blocks SET transactions_hash = ? WHERE block_index = ?',
+                (get_merkle_root(get_block_transaction_hashes(cur, block_index)), block_index))
+
+
+def set_transaction_hashes(cur, block_index=None):
+    """Hash the stored transactions of a block, or of every block, that have no hash yet
+
+    The hash covers the transaction as stored, so it can be recomputed from the
+    row and survives pruning of the transaction body.
+    """
+    query = '''SELECT transaction_code, timestamp, type, currency, fee, description, valid, specific_data
+        FROM transactions WHERE transaction_hash IS NULL'''
+    params = ()
+    if block_index is not None:
+        query += ' AND block_index = ?'
+        params = (block_index, )
+    rows = cur.execute(query, params).fetchall()
+    hashes = []
+    for row in rows:
+        transaction = {
+            'transaction_code': row[0],
+            'timestamp': row[1],
+            'type': row[2],
+            'currency': row[3],
+            'fee': row[4],
+            'description': row[5],
+            'valid': row[6],
+            'specific_data': row[7],
+        }
+        hashes.append((calculate_transaction_hash(transaction), row[0]))
+    cur.executemany('UPDATE transactions SET transaction_hash = ? WHERE transaction_code = ?', hashes)
+    return len(hashes)
 
 
 def update_token_amount(cur, tid, amt):
     if not amt:
         print("Nothing to add.")
         return True
-    tok_val = cur.execute('SELECT tokencode FROM tokens WHERE tokencode = :tokencode', {
-        'tokencode': tid}).fetchone()
-    if not tok_val:
+    if not cur.token_exists(tid):
         print("Tokencode ", tid, " does not exist.")
         return False
     balance_cursor = cur.execute('SELECT amount_created FROM tokens WHERE tokencode = :tokencode', {
@@ -249,10 +310,8 @@ def get_pid_from_wallet(cur, walletaddinput):
 
 
 def create_contract_address():
-    private_key_bytes = os.urandom(32)
-    key = ecdsa.SigningKey.from_string(
-        private_key_bytes, curve=ecdsa.SECP256k1).verifying_key
-    key_bytes = key.to_string()
+    provider = get_crypto_provider()
+    key_bytes = provider.get_public_key(provider.generate_private_key())
     public_key = codecs.encode(key_bytes, 'hex')
     public_key_bytes = codecs.decode(public_key, 'hex')
     hash = keccak.new(digest_bits=256)
@@ -0,0 +1,54 @@
+"""Byte encodings that hashes and signatures are computed over
+
+Hashes of blocks, receipts and stored transactions are taken over the
+canonical encoding, JSON with sorted keys, so they do not depend on the order
+a dict was built in.
+
+Signatures and transaction codes are taken over the transaction JSON in field
+order. Wallets and older nodes sign that encoding, so it cannot change without
+invalidating every signature on chain. Transactionmanager keeps the fields in
+a fixed order, which keeps the encoding stable in practice.
+"""
+import hashlib
+import json
+
+
+def canonical_encode(data):
+    return json.dumps(data, sort_keys=True).encode()
+
+
+def signing_encode(data):
+    return json.dumps(data).encode()
+
+
+def canonical_hash(data):
+    """Hex sha256 of the canonical encoding"""
+    return hashlib.sha256(canonical_encode(data)).hexdigest()
+
+
+def get_proof_hasher(block):
+    """Function of proof returning the canonical hash of block with that proof
+
+    The block is encoded once. The encoding before the proof is hashed once
+    and its sha256 state copied for every proof tried, the rest is appended
+    as bytes.
+    """
+    keys = sorted(block)
+    proof_position = keys.index('proof')
+
+    def encode_items(item_keys):
+        return ', '.join(f'{json.dumps(key)}: {json.dumps(block[key], sort_keys=True)}' for key in item_keys)
+
+    prefix = '{' + encode_items(keys[:proof_position]) + (', ' if proof_position else '') + '"proof": '
+    after = keys[proof_position + 1:]
+    suffix = ((', ' + encode_items(after)) if after else '') + '}'
+    midstate = hashlib.sha256(prefix.encode())
+    suffix = suffix.encode()
+
+    def hash_proof(proof):
+        state = midstate.copy()
+        state.update(json.dumps(proof).encode())
+        state.update(suffix)
+        return state.hexdigest()
+
+    return hash_proof
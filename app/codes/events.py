@@ -0,0 +1,135 @@
+"""In process event bus feeding the SSE and WebSocket event streams
+
+Events are published from the mempool, the updater and the block receive path,
+which run in worker threads, and handed to subscribers living on the server's
+event loop. A subscriber that falls more than EVENT_QUEUE_SIZE events behind is
+dropped rather than slowing the publishers down.
+
+Event types:
+    mempool_admission  a transaction entered the mempool
+    mempool_removal    a transaction left the mempool, with the reason
+    block              a block was committed
+    balance            a balance changed in a committed block
+"""
+import asyncio
+import threading
+
+from .db_manager import get_cursor
+from ..constants import EVENT_QUEUE_SIZE
+
+
+EVENT_TYPES = ['mempool_admission', 'mempool_removal', 'block', 'balance']
+
+_subscriptions = set()
+_subscriptions_lock = threading.Lock()
+_staged_balances = {}
+_staged_balances_lock = threading.Lock()
+
+
+class Subscription:
+    """Events of the chosen types, and only those touching the chosen addresses if any are given"""
+
+    def __init__(self, types=None, addresses=None):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.overflowed = False
+        self.set_filter(types, addresses)
+
+    def set_filter(self, types=None, addresses=None):
+        self.types = set(types) if types else None
+        self.addresses = set(addresses) if addresses else None
+
+    def matches(self, event):
+        if self.types is not None and event['type'] not in self.types:
+            return False
+        if self.addresses is not None and event['addresses'] is not None:
+            return not self.addresses.isdisjoint(event['addresses'])
+        return True
+
+    def _deliver(self, event):
+        if self.queue.qsize() >= EVENT_QUEUE_SIZE:
+            self.overflowed = True
+            unsubscribe(self)
+            self.queue.put_nowait(None)
+            return
+        self.queue.put_nowait(event)
+
+    async def get(self):
+        """Next event, or None once the subscription was dropped for falling behind"""
+        return await self.queue.get()
+
+
+def subscribe(types=None, addresses=None):
+    """Subscribe from a coroutine running on the server's event loop"""
+    subscription = Subscription(types, addresses)
+    with _subscriptions_lock:
+        _subscriptions.add(subscription)
+    return subscription
+
+
+def unsubscribe(subscription):
+    with _subscriptions_lock:
+        _subscriptions.discard(subscription)
+
+
+def publish(event_type, data, addresses=None):
+    """Hand an event to every matching subscriber, safe to call from any thread
+
+    addresses are the wallets the event concerns, None if it concerns everyone.
+    """
+    if not _subscriptions:
+        return
+    event = {'type': event_type, 'data': data, 'addresses': addresses}
+    with _subscriptions_lock:
+        subscriptions = [subscription for subscription in _subscriptions if subscription.matches(event)]
+    for subscription in subscriptions:
+        try:
+            subscription.loop.call_soon_threadsafe(subscription._deliver, event)
+        except RuntimeError:
+            # The subscriber's loop is closed
+            unsubscribe(subscription)
+
+
+def stage_balance_changes(block_index, balances):
+    """Hold {(wallet_address, tokencode): balance} changed by a block until the block is committed"""
+    if not _subscriptions:
+        return
+    with _staged_balances_lock:
+        _staged_balances[block_index] = dict(balances)
+
+
+def publish_block_committed(block_index):
+    """Publish a committed block and the balance changes staged for it
+
+    Changes staged for earlier indexes, by blocks that were rolled back, are dropped.
+    """
+    with _staged_balances_lock:
+        balances = {}
+        for staged_index in [index for index in _staged_balances if index <= block_index]:
+            staged = _staged_balances.pop(staged_index)
+            if staged_index == block_index:
+                balances = staged
+    if not _subscriptions:
+        return
+    cur = get_cursor()
+    block = cur.execute('SELECT hash, timestamp, state_root FROM blocks WHERE block_index = ?',
+                        (block_index, )).fetchone()
+    transaction_count = cur.execute('SELECT COUNT(*) FROM transactions WHERE block_index = ?',
+                                    (block_index, )).fetchone()[0]
+    cur.close()
+    if block is None:
+        return
+    publish('block', {
+        'block_index': block_index,
+        'hash': block[0],
+        'timestamp': block[1],
+        'state_root': block[2],
+        'transaction_count': transaction_count,
+    })
+    for (wallet_address, tokencode), balance in balances.items():
+        publish('balance', {
+            'block_index': block_index,
+            'wallet_address': wallet_address,
+            'tokencode': tokencode,
+            'balance': balance,
+        }, [wallet_address])
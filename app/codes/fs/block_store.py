@@ -0,0 +1,168 @@
+"""Append-only segment file store for committed blocks
+
+Each block is serialized once when it is committed and appended to the current
+segment file. The block_store_index table maps a block index to the segment,
+offset and length of its record. The index row is written in the same db
+transaction as the block, so a block is only visible once both are committed.
+Bytes left behind by a rolled back transaction are never indexed and simply
+skipped.
+"""
+
+import glob
+import json
+import mmap
+import os
+import threading
+
+from ...constants import BLOCK_SEGMENT_MAX_BYTES, BLOCK_STORE_PATH
+
+
+_maps = {}
+_maps_lock = threading.Lock()
+
+
+def _segment_path(segment, folder=BLOCK_STORE_PATH):
+    return f'{folder}segment_{segment:06d}.dat'
+
+
+def _close_map(path):
+    with _maps_lock:
+        mapped = _maps.pop(path, None)
+    if mapped is not None:
+        mapped.close()
+
+
+def _read(segment, offset, length, folder=BLOCK_STORE_PATH):
+    path = _segment_path(segment, folder)
+    with _maps_lock:
+        mapped = _maps.get(path)
+        if mapped is None or offset + length > len(mapped):
+            # The active segment grows, remap it once a record lies past the end
+            if mapped is not None:
+                mapped.close()
+            with open(path, 'rb') as _file:
+                mapped = mmap.mmap(_file.fileno(), 0, access=mmap.ACCESS_READ)
+            _maps[path] = mapped
+        return mapped[offset:offset + length]
+
+
+def _path_segment(path):
+    return int(os.path.basename(path)[len('segment_'):-len('.dat')])
+
+
+def _last_segment(cur, folder=BLOCK_STORE_PATH):
+    """Segment that blocks are appended to"""
+    last = cur.execute(
+        'SELECT segment FROM block_store_index ORDER BY block_index DESC LIMIT 1').fetchone()
+    if last is not None:
+        return last[0]
+    # Everything indexed was pruned, keep appending to the newest segment
+    segments = [_path_segment(path) for path in glob.glob(f'{folder}segment_*.dat')]
+    return max(segments, default=0)
+
+
+def init_block_store(cur):
+    cur.execute('''
+                    CREATE TABLE IF NOT EXISTS block_store_index
+                    (block_index integer PRIMARY KEY,
+                    segment integer NOT NULL,
+                    offset integer NOT NULL,
+                    length integer NOT NULL)
+                    ''')
+
+
+def append_block(cur, block, folder=BLOCK_STORE_PATH):
+    """Append a committed block to the store and index it in the caller's transaction"""
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    data = json.dumps(block).encode()
+    segment = _last_segment(cur, folder)
+    path = _segment_path(segment, folder)
+    if os.path.exists(path) and os.path.getsize(path) + len(data) > BLOCK_SEGMENT_MAX_BYTES:
+        segment += 1
+        path = _segment_path(segment, folder)
+
+    with open(path, 'ab') as _file:
+        offset = _file.tell()
+        _file.write(data)
+        _file.flush()
+        os.fsync(_file.fileno())
+
+    cur.execute('INSERT OR REPLACE INTO block_store_index (block_index, segment, offset, length) VALUES (?, ?, ?, ?)',
+                (block['block_index'], segment, offset, len(data)))
+
+
+def get_blocks(cur, block_indexes, folder=BLOCK_STORE_PATH):
+    """Return {block_index: block} for the requested blocks found in the store"""
+    block_indexes = [int(block_index) for block_index in block_indexes]
+    if not block_indexes:
+        return {}
+    placeholders = ', '.join(['?'] * len(block_indexes))
+    rows = cur.execute(f'''SELECT block_index, segment, offset, length FROM block_store_index
+        WHERE block_index IN ({placeholders}) ORDER BY segment, offset''', block_indexes).fetchall()
+    return {row[0]: json.loads(_read(row[1], row[2], row[3], folder)) for row in rows}
+
+
+def get_block(cur, block_index, folder=BLOCK_STORE_PATH):
+    """Return a block from the store or None if it is not stored"""
+    return get_blocks(cur, [block_index], folder).get(int(block_index))
+
+
+def get_stored_block_indexes(cur):
+    return [row[0] for row in cur.execute('SELECT block_index FROM block_store_index ORDER BY block_index')]
+
+
+def truncate_block_store(cur, block_index):
+    """Unindex every block after block_index in the caller's transaction
+
+    Returns where the removed records start, to pass to truncate_segments once
+    the transaction is committed, or None if no block was removed. Until then
+    the records are unindexed bytes, skipped like those of a rolled back
+    transaction, so a crash in between leaves a consistent store.
+    """
+    first_removed = cur.execute('''SELECT segment, offset FROM block_store_index WHERE block_index > ?
+        ORDER BY segment, offset LIMIT 1''', (block_index, )).fetchone()
+    cur.execute('DELETE FROM block_store_index WHERE block_index > ?', (block_index, ))
+    return first_removed
+
+
+def truncate_segments(position, folder=BLOCK_STORE_PATH):
+    """Cut the segment files at position, a (segment, offset) from truncate_block_store"""
+    if position is None:
+        return
+    segment, offset = position
+    for path in glob.glob(f'{folder}segment_*.dat'):
+        path_segment = _path_segment(path)
+        if path_segment < segment:
+            continue
+        _close_map(path)
+        if path_segment == segment:
+            with open(path, 'r+b') as _file:
+                _file.truncate(offset)
+        else:
+            os.remove(path)
+
+
+def drop_segments_before(cur, block_index, folder=BLOCK_STORE_PATH):
+    """Unindex the blocks up to block_index and remove the segments that only held them
+
+    An unindexed block is read from the db instead, in its pruned form. The
+    active segment, and any segment still holding a later block, is exempt:
+    the pruned records stay in it, unreachable, until all of its blocks have
+    been pruned and a newer segment is active.
+    """
+    active = _last_segment(cur, folder)
+    cur.execute('DELETE FROM block_store_index WHERE block_index <= ?', (block_index, ))
+    retained = cur.execute('SELECT MIN(segment) FROM block_store_index').fetchone()[0]
+    keep_from = retained if retained is not None else active
+    for path in glob.glob(f'{folder}segment_*.dat'):
+        if _path_segment(path) < keep_from:
+            _close_map(path)
+            os.remove(path)
+
+
+def clear_block_store(cur, folder=BLOCK_STORE_PATH):
+    cur.execute('DROP TABLE IF EXISTS block_store_index')
+    for path in glob.glob(f'{folder}segment_*.dat'):
+        _close_map(path)
+        os.remove(path)
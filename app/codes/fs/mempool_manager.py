@@ -1,9 +1,21 @@
-"""Temp file manager"""
+"""Mempool manager"""
 
+import collections
+import contextlib
 import glob
+import heapq
+import itertools
 import json
+import math
+import os
+import threading
+import time
 
-from ...constants import MEMPOOL_PATH, TMP_PATH
+from ...constants import BLOCK_SELECTION_POLICY, MEMPOOL_JOURNAL_COMPACT_MIN_RECORDS, MEMPOOL_JOURNAL_FILE, \
+    MEMPOOL_JOURNAL_FSYNC_RECORDS, MEMPOOL_JOURNAL_FSYNC_SECONDS, MEMPOOL_MAX_BYTES, MEMPOOL_MAX_BYTES_PER_PEER, \
+    MEMPOOL_MAX_BYTES_PER_SENDER, MEMPOOL_MAX_TRANSACTIONS, MEMPOOL_PATH, TIME_BETWEEN_BLOCKS_SECONDS, TMP_PATH
+from ..events import publish
+from ..utils import get_time_ms
 
 def get_receipts_from_storage(block_index, folder=MEMPOOL_PATH):
     """Returns a list of receipts matching a block index from mempool"""
@@ -60,4 +72,611 @@ def append_receipt_to_block_in_storage(receipt):
             if append_receipt_to_block(block):
                 json.dump(block, _file)
                 blocks.append(block)
-    return blocks
\ No newline at end of file
+    return blocks
+
+
+def get_transaction_code(transaction):
+    return transaction['transaction']['trans_code']
+
+
+def get_transaction_debits(transaction):
+    """(sender wallet, tokencode, amount) for each leg of a transfer that takes tokens from a wallet"""
+    data = transaction['transaction']['specific_data']
+    transaction_type = transaction['transaction']['type']
+    debits = []
+    if transaction_type == 4 or transaction_type == 5:
+        debits.append((data['wallet1'], data['asset1_code'], data['asset1_number']))
+    if transaction_type == 4:
+        debits.append((data['wallet2'], data['asset2_code'], data['asset2_number']))
+    return debits
+
+
+def get_transaction_sender(transaction):
+    """Wallet charged for the transaction's mempool space, the first one it debits or else its first signer"""
+    debits = get_transaction_debits(transaction)
+    if debits:
+        return debits[0][0]
+    signatures = transaction.get('signatures') or []
+    return signatures[0].get('wallet_address') if signatures else None
+
+
+def get_transaction_addresses(transaction):
+    """Wallets a transaction concerns: its signers and the wallets of a transfer"""
+    addresses = {signature.get('wallet_address') for signature in transaction.get('signatures') or []}
+    if transaction['transaction']['type'] in (4, 5):
+        data = transaction['transaction']['specific_data']
+        addresses.update([data.get('wallet1'), data.get('wallet2')])
+    addresses.discard(None)
+    return sorted(addresses)
+
+
+def get_transaction_size(transaction):
+    """Serialized size in bytes, as the transaction would be carried in a block"""
+    return len(json.dumps(transaction).encode())
+
+
+def is_fee_valid(fee):
+    """Whether fee is a finite, non-negative number, or None for no fee"""
+    if fee is None:
+        return True
+    return isinstance(fee, (int, float)) and not isinstance(fee, bool) and math.isfinite(fee) and fee >= 0
+
+
+def get_fee_rate(transaction, size=None):
+    """Fee per byte, raises ValueError for a fee that is_fee_valid refuses"""
+    fee = transaction['transaction'].get('fee')
+    if not is_fee_valid(fee):
+        raise ValueError(f'Invalid fee {fee!r}')
+    if size is None:
+        size = get_transaction_size(transaction)
+    return (fee or 0) / size
+
+
+def _measure(transaction):
+    """(size, fee rate, sender, debits) of a transaction, raises if it is malformed"""
+    size = get_transaction_size(transaction)
+    return size, get_fee_rate(transaction, size), get_transaction_sender(transaction), \
+        get_transaction_debits(transaction)
+
+
+class MempoolBudgetExceeded(Exception):
+    """The mempool, the sender or the peer has no room left for a transaction"""
+
+    def __init__(self, budget, retry_after=TIME_BETWEEN_BLOCKS_SECONDS):
+        super().__init__(f'Mempool {budget} byte budget exceeded')
+        self.budget = budget
+        self.retry_after = retry_after
+
+
+class MempoolJournal:
+    """Append-only JSON lines log of mempool additions and removals.
+
+    Records are written to the OS on every append but fsynced in batches, every
+    MEMPOOL_JOURNAL_FSYNC_RECORDS records or MEMPOOL_JOURNAL_FSYNC_SECONDS,
+    whichever comes first. A timer started by the first unsynced record keeps
+    the time bound when no further records arrive. compact() rewrites the log
+    with only the live transactions.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.records = 0
+        self.unsynced_records = 0
+        self.last_sync = time.monotonic()
+        self.lock = threading.RLock()
+        self.timer = None
+
+    def replay(self):
+        """Yield the journal's records and cut off a torn last record left by a crash"""
+        if not os.path.exists(self.path):
+            return
+        valid_length = 0
+        with open(self.path, 'rb') as _file:
+            for line in _file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    print('Dropping damaged mempool journal record')
+                    break
+                if not line.endswith(b'\n'):
+                    break
+                valid_length += len(line)
+                self.records += 1
+                yield record
+        if valid_length < os.path.getsize(self.path):
+            with open(self.path, 'r+b') as _file:
+                _file.truncate(valid_length)
+
+    def _open(self):
+        if self.file is None:
+            self.file = open(self.path, 'a')
+
+    def append(self, record):
+        with self.lock:
+            self._open()
+            self.file.write(json.dumps(record) + '\n')
+            self.file.flush()
+            self.records += 1
+            self.unsynced_records += 1
+            if (self.unsynced_records >= MEMPOOL_JOURNAL_FSYNC_RECORDS
+                    or time.monotonic() - self.last_sync >= MEMPOOL_JOURNAL_FSYNC_SECONDS):
+                self.sync()
+            elif self.timer is None:
+                self.timer = threading.Timer(MEMPOOL_JOURNAL_FSYNC_SECONDS, self.sync)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def sync(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if self.file is not None and self.unsynced_records:
+                os.fsync(self.file.fileno())
+            self.unsynced_records = 0
+            self.last_sync = time.monotonic()
+
+    def compact(self, records):
+        """Replace the journal with the given records, one add per live transaction"""
+        tmp_path = self.path + '.tmp'
+        with self.lock:
+            with open(tmp_path, 'w') as _file:
+                for record in records:
+                    _file.write(json.dumps(record) + '\n')
+                _file.flush()
+                os.fsync(_file.fileno())
+            self.close()
+            os.replace(tmp_path, self.path)
+            self.records = len(records)
+
+    def close(self):
+        with self.lock:
+            self.sync()
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+class Mempool:
+    """Pending transactions held in memory and indexed by code, sender wallet and token.
+
+    pending_debits keeps a running total, per (sender wallet, tokencode), of what
+    the pending transactions take from each wallet, so balance checks do not
+    have to look at the other transactions. admit() serializes the transactions
+    spending from the same (sender wallet, tokencode) with a lock per key, so
+    checks of unrelated spends run side by side.
+
+    A heap orders the transactions by fee rate, then by arrival. Entries of
+    removed or replaced transactions are left in the heap and skipped when they
+    surface, and the heap is rebuilt once they outnumber the live ones. A second
+    heap, lowest fee rate and oldest first, picks what to evict once the pool is
+    over its transaction count or byte cap. Transactions are kept in arrival
+    order, so the expired ones are always at the front.
+
+    Bytes are also accounted per sender wallet and per source peer. add()
+    refuses a transaction that would take its sender or peer over budget, or
+    that would be evicted straight away from a full pool, with
+    MempoolBudgetExceeded.
+
+    Changes are logged to a journal in the mempool folder, which is replayed to
+    rebuild the pool on startup.
+    """
+
+    def __init__(self, folder=MEMPOOL_PATH, max_transactions=MEMPOOL_MAX_TRANSACTIONS, max_bytes=MEMPOOL_MAX_BYTES,
+                 max_bytes_per_sender=MEMPOOL_MAX_BYTES_PER_SENDER, max_bytes_per_peer=MEMPOOL_MAX_BYTES_PER_PEER):
+        self.folder = folder
+        self.max_transactions = max_transactions
+        self.max_bytes = max_bytes
+        self.max_bytes_per_sender = max_bytes_per_sender
+        self.max_bytes_per_peer = max_bytes_per_peer
+        self.lock = threading.RLock()
+        self.transactions = {}
+        self.by_sender = {}
+        self.by_token = {}
+        self.pending_debits = {}
+        self.debit_locks = {}  # (sender wallet, tokencode) -> [lock, admissions using it]
+        self.debit_locks_lock = threading.Lock()
+        self.heap = []
+        self.eviction_heap = []
+        self.heap_entries = {}
+        self.received = {}
+        self.sizes = {}
+        self.size_bytes = 0
+        self.accounts = {}
+        self.sender_bytes = collections.Counter()
+        self.peer_bytes = collections.Counter()
+        self.rejections = collections.Counter()
+        self.unsigned = set()
+        self.evictions = collections.Counter()
+        self.sequence = itertools.count()
+        self.selections = 0
+        self.journal = MempoolJournal(folder + MEMPOOL_JOURNAL_FILE)
+
+    def load(self):
+        """Rebuild the pool from the journal, then take over any legacy transaction files"""
+        with self.lock:
+            for record in self.journal.replay():
+                if record['op'] == 'add':
+                    try:
+                        measured = _measure(record['transaction'])
+                    except Exception as e:
+                        # Written before admission checked it, one bad record must not keep the pool from loading
+                        print('Skipping mempool journal record', e)
+                        continue
+                    self._discard(get_transaction_code(record['transaction']))
+                    self._index(record['transaction'], record.get('received') or get_time_ms(), record.get('source'),
+                                measured)
+                elif record['op'] == 'remove':
+                    for transaction_code in record['transaction_codes']:
+                        self._discard(transaction_code)
+
+            legacy_files = glob.glob(f'{self.folder}transaction-*.json')
+            for filename in legacy_files:
+                try:
+                    with open(filename, 'r') as _file:
+                        self.add(json.load(_file))
+                except Exception as e:
+                    print('Could not load mempool transaction', filename, e)
+            self.journal.sync()
+            for filename in legacy_files:
+                os.remove(filename)
+            self.compact_if_needed()
+            self.enforce_limits()
+
+    def _index(self, transaction, received, source=None, measured=None):
+        # Anything that can fail on a malformed transaction runs before the pool is touched
+        transaction_code = get_transaction_code(transaction)
+        size, fee_rate, sender, debits = measured or _measure(transaction)
+        self.transactions[transaction_code] = transaction
+        sequence = next(self.sequence)
+        entry = (-fee_rate, sequence, transaction_code)
+        self.heap_entries[transaction_code] = entry
+        heapq.heappush(self.heap, entry)
+        heapq.heappush(self.eviction_heap, (fee_rate, sequence, transaction_code))
+        self.received[transaction_code] = received
+        self.sizes[transaction_code] = size
+        self.size_bytes += size
+        self.accounts[transaction_code] = (sender, source)
+        self.sender_bytes[sender] += size
+        if source is not None:
+            self.peer_bytes[source] += size
+        if not transaction.get('signatures'):
+            self.unsigned.add(transaction_code)
+        for sender, tokencode, amount in debits:
+            self.by_sender.setdefault(sender, set()).add(transaction_code)
+            self.by_token.setdefault(tokencode, set()).add(transaction_code)
+            debit = self.pending_debits.setdefault((sender, tokencode), [0, 0])
+            debit[0] += amount
+            debit[1] += 1
+
+    def _discard(self, transaction_code):
+        transaction = self.transactions.pop(transaction_code, None)
+        if transaction is None:
+            return None
+        del self.heap_entries[transaction_code]
+        del self.received[transaction_code]
+        size = self.sizes.pop(transaction_code)
+        self.size_bytes -= size
+        sender, source = self.accounts.pop(transaction_code)
+        self.sender_bytes[sender] -= size
+        if not self.sender_bytes[sender]:
+            del self.sender_bytes[sender]
+        if source is not None:
+            self.peer_bytes[source] -= size
+            if not self.peer_bytes[source]:
+                del self.peer_bytes[source]
+        self.unsigned.discard(transaction_code)
+        for sender, tokencode, amount in get_transaction_debits(transaction):
+            self.by_sender.get(sender, set()).discard(transaction_code)
+            self.by_token.get(tokencode, set()).discard(transaction_code)
+            if not self.by_sender.get(sender, True):
+                del self.by_sender[sender]
+            if not self.by_token.get(tokencode, True):
+                del self.by_token[tokencode]
+            debit = self.pending_debits[(sender, tokencode)]
+            debit[0] -= amount
+            debit[1] -= 1
+            if not debit[1]:
+                # Drop the entry rather than keep a float residue around
+                del self.pending_debits[(sender, tokencode)]
+        return transaction
+
+    def check_budget(self, transaction, source=None):
+        """Raise MempoolBudgetExceeded if transaction from source does not fit its budgets"""
+        transaction_code = get_transaction_code(transaction)
+        size = get_transaction_size(transaction)
+        with self.lock:
+            if transaction_code in self.transactions:
+                # Replaces itself
+                return
+            if self.sender_bytes[get_transaction_sender(transaction)] + size > self.max_bytes_per_sender:
+                budget = 'sender'
+            elif source is not None and self.peer_bytes[source] + size > self.max_bytes_per_peer:
+                budget = 'peer'
+            elif (self.size_bytes + size > self.max_bytes or len(self.transactions) >= self.max_transactions) \
+                    and get_fee_rate(transaction, size) <= self._lowest_fee_rate():
+                # It would be the first to go
+                budget = 'global'
+            else:
+                return
+            self.rejections[budget] += 1
+        raise MempoolBudgetExceeded(budget)
+
+    def _lowest_fee_rate(self):
+        while self.eviction_heap:
+            fee_rate, sequence, transaction_code = self.eviction_heap[0]
+            entry = self.heap_entries.get(transaction_code)
+            if entry is not None and entry[1] == sequence:
+                return fee_rate
+            heapq.heappop(self.eviction_heap)
+        return float('inf')
+
+    def add(self, transaction, source=None):
+        """Add a transaction, replacing any pending one with the same code
+
+        A replacement keeps the time the code was first received, so relaying a
+        transaction again does not keep it from expiring. source is the peer or
+        client the transaction came from, if any. Raises MempoolBudgetExceeded
+        if it does not fit, see check_budget, and ValueError if it is malformed,
+        before anything is recorded.
+        """
+        transaction_code = get_transaction_code(transaction)
+        measured = _measure(transaction)
+        with self.lock:
+            self.check_budget(transaction, source)
+            replaced = transaction_code in self.transactions
+            received = self.received[transaction_code] if replaced else get_time_ms()
+            self._discard(transaction_code)
+            self.journal.append({'op': 'add', 'transaction': transaction, 'received': received, 'source': source})
+            self._index(transaction, received, source, measured)
+            if not replaced:
+                publish('mempool_admission', {
+                    'transaction_code': transaction_code,
+                    'type': transaction['transaction']['type'],
+                    'fee': transaction['transaction'].get('fee'),
+                }, get_transaction_addresses(transaction))
+            self.enforce_limits()
+        return transaction_code
+
+    def remove(self, transaction_codes, reason=None):
+        """Remove the pending transactions among transaction_codes and return their codes"""
+        with self.lock:
+            removed = []
+            for transaction_code in transaction_codes:
+                transaction = self._discard(transaction_code)
+                if transaction is not None:
+                    removed.append(transaction_code)
+                    self._publish_removal(transaction, reason)
+            self._log_removal(removed)
+        return removed
+
+    def _publish_removal(self, transaction, reason):
+        publish('mempool_removal', {
+            'transaction_code': get_transaction_code(transaction),
+            'reason': reason,
+        }, get_transaction_addresses(transaction))
+
+    def _log_removal(self, removed):
+        if removed:
+            self.journal.append({'op': 'remove', 'transaction_codes': removed})
+            self.compact_if_needed()
+        if not self.selections and len(self.heap) > 2 * len(self.heap_entries) + 64:
+            self.heap = list(self.heap_entries.values())
+            heapq.heapify(self.heap)
+        if len(self.eviction_heap) > 2 * len(self.heap_entries) + 64:
+            self.eviction_heap = [(-entry[0], entry[1], entry[2]) for entry in self.heap_entries.values()]
+            heapq.heapify(self.eviction_heap)
+
+    def evict(self, transaction_codes, reason):
+        """Remove transactions and count them under reason in the eviction stats"""
+        removed = self.remove(transaction_codes, reason)
+        if removed:
+            with self.lock:
+                self.evictions[reason] += len(removed)
+        return removed
+
+    def enforce_limits(self):
+        """Evict the lowest fee rate, then oldest, transactions until the pool is within its caps"""
+        with self.lock:
+            evicted = []
+            while self.eviction_heap and (
+                    len(self.transactions) > self.max_transactions or self.size_bytes > self.max_bytes):
+                fee_rate, sequence, transaction_code = heapq.heappop(self.eviction_heap)
+                entry = self.heap_entries.get(transaction_code)
+                if entry is None or entry[1] != sequence:
+                    continue
+                self._publish_removal(self._discard(transaction_code), 'capacity')
+                evicted.append(transaction_code)
+            self._log_removal(evicted)
+            if evicted:
+                self.evictions['capacity'] += len(evicted)
+        return evicted
+
+    def get_received_before(self, timestamp):
+        """Codes of the transactions received before timestamp (ms), oldest first"""
+        with self.lock:
+            # Not a prefix of the arrival order, a replaced transaction keeps its first received time
+            transaction_codes = [transaction_code for transaction_code in self.transactions
+                                 if self.received[transaction_code] < timestamp]
+            return sorted(transaction_codes, key=self.received.get)
+
+    def get_unsigned(self):
+        with self.lock:
+            return list(self.unsigned)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'transactions': len(self.transactions),
+                'bytes': self.size_bytes,
+                'max_transactions': self.max_transactions,
+                'max_bytes': self.max_bytes,
+                'utilization': self.size_bytes / self.max_bytes,
+                'max_bytes_per_sender': self.max_bytes_per_sender,
+                'largest_sender_bytes': max(self.sender_bytes.values(), default=0),
+                'max_bytes_per_peer': self.max_bytes_per_peer,
+                'peer_bytes': dict(self.peer_bytes),
+                'rejections': dict(self.rejections),
+                'oldest_received': min(self.received.values(), default=None),
+                'evictions': dict(self.evictions),
+            }
+
+    def iter_by_fee_rate(self):
+        """Yield pending transactions, highest fee rate first
+
+        Entries are popped off the heap as they are yielded, so taking k
+        transactions costs O(k log n). They are pushed back once the caller
+        closes the generator, the transactions stay pending until removed.
+        """
+        taken = []
+        with self.lock:
+            self.selections += 1
+        try:
+            while True:
+                with self.lock:
+                    if not self.heap:
+                        return
+                    entry = heapq.heappop(self.heap)
+                    if self.heap_entries.get(entry[2]) != entry:
+                        continue
+                    taken.append(entry)
+                    transaction = self.transactions[entry[2]]
+                yield transaction
+        finally:
+            with self.lock:
+                for entry in taken:
+                    if self.heap_entries.get(entry[2]) == entry:
+                        heapq.heappush(self.heap, entry)
+                self.selections -= 1
+
+    def compact_if_needed(self):
+        """Rewrite the journal once most of its records are for transactions no longer pending"""
+        with self.lock:
+            if self.journal.records > MEMPOOL_JOURNAL_COMPACT_MIN_RECORDS + 2 * len(self.transactions):
+                self.journal.compact([
+                    {'op': 'add', 'transaction': transaction, 'received': self.received[transaction_code],
+                     'source': self.accounts[transaction_code][1]}
+                    for transaction_code, transaction in self.transactions.items()
+                ])
+
+    def contains(self, transaction_code):
+        return transaction_code in self.transactions
+
+    def get(self, transaction_code):
+        return self.transactions.get(transaction_code)
+
+    def get_size(self, transaction):
+        """Serialized size of transaction, kept from when it was added if it is pending"""
+        size = self.sizes.get(get_transaction_code(transaction))
+        return size if size is not None else get_transaction_size(transaction)
+
+    def get_transaction_codes(self):
+        with self.lock:
+            return list(self.transactions)
+
+    def get_transactions(self):
+        with self.lock:
+            return list(self.transactions.values())
+
+    def get_by_sender(self, sender):
+        """Codes of the pending transactions debiting the sender wallet"""
+        with self.lock:
+            return list(self.by_sender.get(sender, ()))
+
+    def get_by_token(self, tokencode):
+        """Codes of the pending transactions debiting tokencode"""
+        with self.lock:
+            return list(self.by_token.get(tokencode, ()))
+
+    def get_pending_debit(self, sender, tokencode, excluding=None):
+        """Total of tokencode that pending transactions, other than the one coded excluding, take from sender"""
+        with self.lock:
+            pending = self.pending_debits.get((sender, tokencode), [0, 0])[0]
+            if excluding in self.transactions:
+                for debit_sender, debit_token, amount in get_transaction_debits(self.transactions[excluding]):
+                    if debit_sender == sender and debit_token == tokencode:
+                        pending -= amount
+            return pending
+
+    @contextlib.contextmanager
+    def lock_debits(self, transaction):
+        """Hold the ledger locks of every (sender wallet, tokencode) transaction debits, taken in sorted order"""
+        keys = sorted({(sender, tokencode) for sender, tokencode, amount in get_transaction_debits(transaction)},
+                      key=str)
+        with self.debit_locks_lock:
+            locks = []
+            for key in keys:
+                entry = self.debit_locks.setdefault(key, [threading.Lock(), 0])
+                entry[1] += 1
+                locks.append(entry[0])
+        acquired = []
+        try:
+            for lock in locks:
+                lock.acquire()
+                acquired.append(lock)
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+            with self.debit_locks_lock:
+                for key in keys:
+                    entry = self.debit_locks[key]
+                    entry[1] -= 1
+                    if not entry[1]:
+                        del self.debit_locks[key]
+
+    def admit(self, transaction, check, source=None):
+        """Add transaction if check() passes
+
+        The ledger locks of the balances transaction spends from are held from
+        the check to the add, so two transactions spending the same funds cannot
+        both pass against the same pending debits. The pool lock is not held
+        while check() runs. Returns the transaction code, or None if the check
+        failed.
+        """
+        with self.lock_debits(transaction):
+            self.check_budget(transaction, source)
+            if not check():
+                return None
+            return self.add(transaction, source)
+
+    def clear(self):
+        with self.lock:
+            self.remove(list(self.transactions), 'cleared')
+
+    def __len__(self):
+        return len(self.transactions)
+
+
+def select_by_fee_rate(mempool):
+    return mempool.iter_by_fee_rate()
+
+
+def select_by_arrival(mempool):
+    yield from mempool.get_transactions()
+
+
+SELECTION_POLICIES = {
+    'fee_rate': select_by_fee_rate,
+    'arrival': select_by_arrival,
+}
+
+
+def get_selection_policy(name=BLOCK_SELECTION_POLICY):
+    """Callable taking the mempool and returning its transactions in the order to try them for a block"""
+    return SELECTION_POLICIES[name]
+
+
+_mempool = None
+_mempool_lock = threading.Lock()
+
+
+def get_mempool():
+    """The node's mempool, loaded from disk on first use"""
+    global _mempool
+    with _mempool_lock:
+        if _mempool is None:
+            _mempool = Mempool()
+            _mempool.load()
+    return _mempool
@@ -1,14 +1,14 @@
 """Wallet manager"""
 import codecs
-import ecdsa
 from Crypto.Hash import keccak
 import os
 import hashlib
 import datetime
 import base64
-import sqlite3
 
-from ..constants import TMP_PATH, NEWRL_DB
+from ..constants import TMP_PATH
+from .crypto_provider import get_crypto_provider
+from .db_manager import get_cursor
 from .transactionmanager import Transactionmanager
 
 
@@ -24,12 +24,10 @@ def get_address_from_public_key(public_key):
 
 
 def generate_wallet_address():
-    private_key_bytes = os.urandom(32)
+    provider = get_crypto_provider()
+    private_key_bytes = provider.generate_private_key()
     key_data = {'public': None, 'private': None, 'address': None}
-    key = ecdsa.SigningKey.from_string(
-        private_key_bytes, curve=ecdsa.SECP256k1).verifying_key
-
-    key_bytes = key.to_string()
+    key_bytes = provider.get_public_key(private_key_bytes)
 
     # the below section is to enable serialization while passing the keys through json
     private_key_final = base64.b64encode(private_key_bytes).decode('utf-8')
@@ -141,8 +139,7 @@ def get_digest(file_path):
 
 
 def get_walletdata_from_address(addressinput):
-    con = sqlite3.connect(NEWRL_DB)
-    cur = con.cursor()
+    cur = get_cursor()
     wallet_cursor = cur.execute(
         'SELECT * FROM person_wallet WHERE wallet_id=?', (addressinput, )).fetchone()
     if wallet_cursor is None:
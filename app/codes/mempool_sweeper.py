@@ -0,0 +1,66 @@
+"""Background sweep applying the mempool delete rules in docs/Mempool delete rules.txt
+
+1. Transactions without signatures are deleted.
+2. Transactions older than MEMPOOL_TRANSACTION_TTL_SECONDS are deleted, but only
+   once a block has been made after they arrived, so they had their chance.
+3. On a node with peers, transactions received before the block
+   MEMPOOL_MAX_AGE_BLOCKS back are deleted.
+
+Finally the pool is brought back under its count and byte caps.
+"""
+import datetime
+import threading
+
+from .db_manager import read_snapshot
+from .fs.mempool_manager import get_mempool
+from .p2p.peers import get_peers
+from .utils import get_time_ms
+from ..constants import MEMPOOL_MAX_AGE_BLOCKS, MEMPOOL_SWEEP_INTERVAL_SECONDS, MEMPOOL_TRANSACTION_TTL_SECONDS
+
+
+def _get_block_timestamp(cur, blocks_back):
+    """Timestamp in ms of the block blocks_back before the last one, None if there is none"""
+    block = cur.execute('SELECT timestamp FROM blocks ORDER BY block_index DESC LIMIT 1 OFFSET ?',
+                        (blocks_back, )).fetchone()
+    if block is None or not block[0]:
+        return None
+    try:
+        return int(block[0])
+    except ValueError:
+        # Older blocks carry a datetime string
+        return round(datetime.datetime.fromisoformat(block[0]).timestamp() * 1000)
+
+
+def sweep_mempool(mempool=None):
+    """Apply the delete rules once and return {reason: evicted count}"""
+    if mempool is None:
+        mempool = get_mempool()
+    with read_snapshot() as (cur, block_height):
+        last_block_ts = _get_block_timestamp(cur, 0)
+        old_block_ts = _get_block_timestamp(cur, MEMPOOL_MAX_AGE_BLOCKS)
+
+    evicted = {}
+    evicted['unsigned'] = len(mempool.evict(mempool.get_unsigned(), 'unsigned'))
+
+    expired_before = get_time_ms() - MEMPOOL_TRANSACTION_TTL_SECONDS * 1000
+    if last_block_ts is not None:
+        expired_before = min(expired_before, last_block_ts)
+        evicted['expired'] = len(mempool.evict(mempool.get_received_before(expired_before), 'expired'))
+
+    if old_block_ts is not None and get_peers():
+        evicted['stale'] = len(mempool.evict(mempool.get_received_before(old_block_ts), 'stale'))
+
+    evicted['capacity'] = len(mempool.enforce_limits())
+    if any(evicted.values()):
+        print('Mempool sweep evicted', evicted)
+    return evicted
+
+
+def start_mempool_sweeper():
+    try:
+        sweep_mempool()
+    except Exception as e:
+        print('Mempool sweep failed', e)
+    timer = threading.Timer(MEMPOOL_SWEEP_INTERVAL_SECONDS, start_mempool_sweeper)
+    timer.daemon = True
+    timer.start()
@@ -0,0 +1,77 @@
+"""Binary Merkle tree over hex encoded leaf hashes
+
+Leaves and inner nodes are hashed with different prefixes so a leaf can never
+be passed off as an inner node. A node without a sibling is carried up to the
+next level unchanged instead of being paired with itself.
+"""
+import hashlib
+
+
+EMPTY_ROOT = hashlib.sha256(b'').hexdigest()
+
+
+def _hash_leaf(leaf_hash):
+    return hashlib.sha256(b'\x00' + bytes.fromhex(leaf_hash)).digest()
+
+
+def _hash_pair(left, right):
+    return hashlib.sha256(b'\x01' + left + right).digest()
+
+
+class MerkleTree:
+    """Keeps every level so a single leaf can be replaced in O(log n)"""
+
+    def __init__(self, leaf_hashes):
+        self.levels = [[_hash_leaf(leaf_hash) for leaf_hash in leaf_hashes]]
+        while len(self.levels[-1]) > 1:
+            level = self.levels[-1]
+            self.levels.append([
+                _hash_pair(level[i], level[i + 1]) if i + 1 < len(level) else level[i]
+                for i in range(0, len(level), 2)
+            ])
+
+    def root(self):
+        if not self.levels[0]:
+            return EMPTY_ROOT
+        return self.levels[-1][0].hex()
+
+    def update(self, index, leaf_hash):
+        """Replace one leaf and rehash only its path to the root"""
+        self.levels[0][index] = _hash_leaf(leaf_hash)
+        for depth in range(1, len(self.levels)):
+            index //= 2
+            below = self.levels[depth - 1]
+            left = 2 * index
+            if left + 1 < len(below):
+                self.levels[depth][index] = _hash_pair(below[left], below[left + 1])
+            else:
+                self.levels[depth][index] = below[left]
+        return self.root()
+
+    def proof(self, index):
+        """Audit path from the leaf at index to the root, bottom up"""
+        path = []
+        for level in self.levels[:-1]:
+            sibling = index ^ 1
+            if sibling < len(level):
+                path.append({
+                    'hash': level[sibling].hex(),
+                    'position': 'left' if sibling < index else 'right',
+                })
+            index //= 2
+        return path
+
+
+def get_merkle_root(leaf_hashes):
+    return MerkleTree(leaf_hashes).root()
+
+
+def verify_merkle_proof(leaf_hash, proof, root):
+    node = _hash_leaf(leaf_hash)
+    for step in proof:
+        sibling = bytes.fromhex(step['hash'])
+        if step['position'] == 'left':
+            node = _hash_pair(sibling, node)
+        else:
+            node = _hash_pair(node, sibling)
+    return node.hex() == root
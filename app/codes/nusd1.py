@@ -1,7 +1,6 @@
 # class to create smart contract for creating stablecoins on Newrl
 import codecs
 from subprocess import call
-import ecdsa
 from Crypto.Hash import keccak
 import os
 import hashlib
@@ -10,14 +9,14 @@ import datetime
 import time
 import binascii
 import base64
-import sqlite3
 
 #from app.codes.updater import add_token
 
+from .crypto_provider import get_crypto_provider
 from .transactionmanager import Transactionmanager, is_wallet_valid
 from .chainscanner import Chainscanner, get_wallet_token_balance
 from .tokenmanager import create_token_transaction
-from ..constants import NEWRL_DB
+from .db_manager import get_cursor
 from .state_updater import *
 
 
@@ -30,11 +29,10 @@ class nusd1():
         # this is for instances of this class created for tx creation and other non-chain work
         self.address = contractaddress
         if contractaddress:  # as in this is an existing contract
-            con = sqlite3.connect(NEWRL_DB)
-            cur = con.cursor()
+            cur = get_cursor()
             # this will populate the params for a given instance of the contract
             self.loadcontract(cur, contractaddress)
-            con.close()
+            cur.close()
         # instantiation convetion: for the first time instantiation of a contract, the contractaddress is None, this is to be immediately followed by setup call
         # in a later call outside chain work or inside it, the contractaddress is present and is used to lookup the specific contract from the db
 
@@ -57,10 +55,8 @@ class nusd1():
             return False
         # add other codes here if in future 4 onwards are used for specifying other contract states.
 
-        private_key_bytes = os.urandom(32)
-        key = ecdsa.SigningKey.from_string(
-            private_key_bytes, curve=ecdsa.SECP256k1).verifying_key
-        key_bytes = key.to_string()
+        provider = get_crypto_provider()
+        key_bytes = provider.get_public_key(provider.generate_private_key())
         public_key = codecs.encode(key_bytes, 'hex')
         public_key_bytes = codecs.decode(public_key, 'hex')
         hash = keccak.new(digest_bits=256)
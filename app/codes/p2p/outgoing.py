@@ -17,6 +17,20 @@ def propogate_transaction_to_peers(transaction):
             print(f'Error broadcasting block to peer: {url}')
             print(e)
 
+def propogate_transactions_to_peers(transactions):
+    """Broadcast a batch of transactions to each peer in a single request"""
+    peers = get_peers()
+
+    for peer in peers:
+        url = 'http://' + peer['address'] + ':' + str(NEWRL_PORT)
+        print(f'Broadcasting {len(transactions)} transactions to peer', url)
+        try:
+            thread = Thread(target=send_request, args = (url + '/validate-transactions', transactions))
+            thread.start()
+        except Exception as e:
+            print(f'Error broadcasting transactions to peer: {url}')
+            print(e)
+
 def send_request(url, data):
     requests.post(url, json=data, timeout=REQUEST_TIMEOUT)
 
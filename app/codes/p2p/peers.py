@@ -8,6 +8,7 @@ from app.codes.signmanager import sign_object
 from app.codes.validator import validate_signature
 from app.migrations.init import init_newrl
 from app.codes.auth.auth import get_auth
+from app.codes.db_manager import get_connection, get_cursor
 from ...constants import AUTH_FILE_PATH, BOOTSTRAP_NODES, REQUEST_TIMEOUT, NEWRL_P2P_DB, NEWRL_PORT, MY_ADDRESS
 
 
@@ -33,16 +34,13 @@ auth_data = get_auth()
 
 
 def clear_peer_db():
-    con = sqlite3.connect(NEWRL_P2P_DB)
-    cur = con.cursor()
-    cur.execute('DROP TABLE IF EXISTS peers')
+    con = get_connection(NEWRL_P2P_DB)
+    con.execute('DROP TABLE IF EXISTS peers')
     con.commit()
-    con.close()
 
 def init_peer_db():
-    con = sqlite3.connect(NEWRL_P2P_DB)
-    cur = con.cursor()
-    cur.execute('''
+    con = get_connection(NEWRL_P2P_DB)
+    con.execute('''
                     CREATE TABLE IF NOT EXISTS peers
                     (id text NOT NULL PRIMARY KEY,
                     address text NOT NULL 
@@ -50,16 +48,14 @@ def init_peer_db():
                     ''')
     # Todo - link node to a person and add record in the node db
     con.commit()
-    con.close()
 
 
 def get_peers():
     peers = []
-    con = sqlite3.connect(NEWRL_P2P_DB)
-    con.row_factory = sqlite3.Row
-    cur = con.cursor()
+    cur = get_cursor(NEWRL_P2P_DB, row_factory=sqlite3.Row)
     peer_cursor = cur.execute('SELECT * FROM peers').fetchall()
     peers = [dict(ix) for ix in peer_cursor]
+    cur.close()
     return peers
 
 
@@ -69,43 +65,40 @@ def add_peer(peer_address):
     if peer_address == '127.0.0.1':
         return {'address': peer_address, 'status': 'FAILURE'}
 
-    con = sqlite3.connect(NEWRL_P2P_DB)
-    cur = con.cursor()
+    con = get_connection(NEWRL_P2P_DB)
     try:
         logger.info('Adding peer %s', peer_address)
         # await register_me_with_them(peer_address)
-        cur.execute('INSERT INTO peers(id, address) VALUES(?, ?)', (peer_address, peer_address, ))
+        con.execute('INSERT INTO peers(id, address) VALUES(?, ?)', (peer_address, peer_address, ))
         con.commit()
     except Exception as e:
+        con.rollback()
         logger.info('Did not add peer %s', peer_address)
         return {'address': peer_address, 'status': 'FAILURE', 'reason': str(e)}
-    con.close()
     return {'address': peer_address, 'status': 'SUCCESS'}
 
 
 def remove_peer(peer_id):
-    con = sqlite3.connect(NEWRL_P2P_DB)
-    cur = con.cursor()
+    con = get_connection(NEWRL_P2P_DB)
     try:
-        cur.execute('DELETE FROM peers where id = ?', (peer_id, ))
+        con.execute('DELETE FROM peers where id = ?', (peer_id, ))
         con.commit()
     except Exception as e:
+        con.rollback()
         print(e)
         return False
-    con.close()
     return True
 
 
 def clear_peers():
-    con = sqlite3.connect(NEWRL_P2P_DB)
-    cur = con.cursor()
+    con = get_connection(NEWRL_P2P_DB)
     try:
-        cur.execute('DELETE FROM peers')
+        con.execute('DELETE FROM peers')
         con.commit()
     except Exception as e:
+        con.rollback()
         print(e)
         return False
-    con.close()
     return True
 
 def init_bootstrap_nodes():
@@ -1,9 +1,10 @@
 import logging
 import requests
-import sqlite3
 
 from app.codes import blockchain
-from app.constants import NEWRL_PORT, REQUEST_TIMEOUT, NEWRL_DB
+from app.codes.db_manager import get_cursor
+from app.codes.fs import block_store
+from app.constants import NEWRL_PORT, PRUNED_HEADER, REQUEST_TIMEOUT
 from app.codes.p2p.peers import get_peers
 
 from app.codes.validator import validate_block, validate_block_data, validate_receipt_signature
@@ -16,16 +17,20 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def get_blocks(block_indexes):
+def get_blocks(block_indexes, cur=None):
+    stored_blocks = block_store.get_blocks(cur or get_cursor(), block_indexes)
     blocks = []
     for block_index in block_indexes:
-        blocks.append(get_block(block_index))
+        block = stored_blocks.get(int(block_index))
+        if block is None:
+            block = get_block(block_index, cur)
+        blocks.append(block)
     return blocks
 
 
-def get_block(block_index):
+def get_block(block_index, cur=None):
     chain = blockchain.Blockchain()
-    return chain.get_block(block_index)
+    return chain.get_block(block_index, cur)
 
 def get_last_block_index():
     last_block = blockchain.get_last_block_index()
@@ -46,11 +51,7 @@ def receive_block(block):
     # else:
     #     store_block_to_temp(block)
 
-    con = sqlite3.connect(NEWRL_DB)
-    cur = con.cursor()
-    blockchain.add_block(cur, block['data'], block['hash'])
-    con.commit()
-    con.close()
+    blockchain.commit_block(block['data'], block['hash'])
     
     return True
 
@@ -85,11 +86,7 @@ def sync_chain_from_node(url):
                 print('Invalid block')
                 failed_for_invalid_block = True
                 break
-            con = sqlite3.connect(NEWRL_DB)
-            cur = con.cursor()
-            blockchain.add_block(cur, block)
-            con.commit()
-            con.close()
+            blockchain.commit_block(block)
 
         if failed_for_invalid_block:
             break
@@ -114,17 +111,21 @@ def sync_chain_from_peers():
 
 # TODO - use mode of max last 
 def get_best_peer_to_sync(peers):
+    """Pick the archive peer with the longest chain, or a pruned one if no archive peer is up"""
     best_peer = None
-    best_peer_value = 0
+    best_peer_value = (False, 0)
 
     for peer in peers:
         url = 'http://' + peer['address'] + ':' + str(NEWRL_PORT)
         try:
-            their_last_block_index = int(requests.get(url + '/get-last-block-index', timeout=REQUEST_TIMEOUT).text)
+            response = requests.get(url + '/get-last-block-index', timeout=REQUEST_TIMEOUT)
+            their_last_block_index = int(response.text)
+            # Pruned peers cannot serve old transaction bodies
+            is_archive = response.headers.get(PRUNED_HEADER, 'false') != 'true'
             print(f'Peer {url} has last block {their_last_block_index}')
-            if their_last_block_index > best_peer_value:
+            if their_last_block_index > 0 and (is_archive, their_last_block_index) > best_peer_value:
                 best_peer = url
-                best_peer_value = their_last_block_index
+                best_peer_value = (is_archive, their_last_block_index)
         except Exception as e:
             print('Error getting block index from peer at', url)
     return best_peer
@@ -153,10 +154,7 @@ def ask_peers_for_block(block_index):
 
 
 def accept_block(block, broadcast=True):
-    con = sqlite3.connect(NEWRL_DB)
-    cur = con.cursor()
-    blockchain.add_block(cur, block)
-    con.close()
+    blockchain.commit_block(block)
 
     broadcast_block(block)
 
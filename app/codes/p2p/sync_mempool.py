@@ -1,88 +1,156 @@
-import json
+"""Mempool reconciliation between peers
+
+Instead of exchanging every transaction code, the caller picks a random salt and
+asks a peer for the short ids of its pending transactions, a truncated salted
+hash of each code. Comparing them with its own short ids gives the set
+difference in one round trip. A second round trip pulls only the missing
+transactions by short id, and the ones the peer lacks are pushed to it.
+
+Different codes can share a short id. Every transaction with a requested short
+id is sent, so collisions within one pool only cost extra transfers. A
+transaction sharing its short id with a different one in the other pool is
+missed in that round; the next round picks another salt and finds it.
+"""
+import collections
+import hashlib
 import os
-from app.constants import INCOMING_PATH, MEMPOOL_PATH, TMP_PATH
+
 import requests
 
+from app.codes.fs.mempool_manager import MempoolBudgetExceeded, get_mempool, is_fee_valid
 from app.codes.transactionmanager import Transactionmanager
+from app.codes.p2p.utils import get_peers
+from app.constants import MEMPOOL_SHORT_ID_BYTES, NEWRL_PORT, REQUEST_TIMEOUT
+
+
+def get_short_id(transaction_code, salt):
+    return hashlib.sha256((salt + transaction_code).encode()).digest()[:MEMPOOL_SHORT_ID_BYTES].hex()
+
+
+def get_short_ids(salt):
+    """{short id: [transaction codes]} for the pending transactions"""
+    short_ids = collections.defaultdict(list)
+    for transaction_code in get_mempool().get_transaction_codes():
+        short_ids[get_short_id(transaction_code, salt)].append(transaction_code)
+    return short_ids
 
 
 def list_mempool_transactions():
-    transaction_files = os.listdir(MEMPOOL_PATH)
-    return transaction_files
+    return get_mempool().get_transaction_codes()
+
 
+def get_mempool_digest(salt):
+    return {'salt': salt, 'short_ids': list(get_short_ids(salt))}
 
-def get_mempool_transactions(filenames):
+
+def get_mempool_transactions(transaction_codes, short_ids=None, salt=''):
+    """Pending transactions matching either the given codes or the given salted short ids"""
+    mempool = get_mempool()
+    transaction_codes = list(transaction_codes)
+    if short_ids:
+        my_short_ids = get_short_ids(salt)
+        for short_id in short_ids:
+            transaction_codes += my_short_ids.get(short_id, [])
     transactions = []
-    for filename in filenames:
-        with open(MEMPOOL_PATH + filename, "r") as transaction_file:
-            transaction = json.load(transaction_file)
-            transaction = {
-                'filename': filename,
+    for transaction_code in transaction_codes:
+        transaction = mempool.get(transaction_code)
+        if transaction is not None:
+            transactions.append({
+                'transaction_code': transaction_code,
                 'data': transaction
-            }
-            transactions.append(transaction)
+            })
     return transactions
 
 
-def push_transactions(filenames):
-    for filename in filenames:
-        print('Pulling transaction:', filename)
-
-
-def pull_transactions(filenames):
-    # Todo - Make this call between nodes
-    transactions = get_mempool_transactions(filenames)
-
-    for transaction in transactions:
-        filename = transaction['filename']
-        data = transaction['data']
-        print('Pulling transaction:', filename)
-        validate_transaction(transaction)
-        with open(MEMPOOL_PATH + filename, "w") as transaction_file:
-            json.dump(data, transaction_file)
+def push_transactions(peer_url, transaction_codes):
+    mempool = get_mempool()
+    for transaction_code in transaction_codes:
+        transaction = mempool.get(transaction_code)
+        if transaction is None:
+            continue
+        print('Pushing transaction:', transaction_code)
+        try:
+            requests.post(peer_url + '/validate-transaction', json=transaction, timeout=REQUEST_TIMEOUT)
+        except Exception as e:
+            print(f'Error pushing transaction to peer: {peer_url}', e)
+
+
+def pull_transactions(peer_url, short_ids, salt):
+    response = requests.post(peer_url + '/get-mempool-transactions',
+                             json={'short_ids': short_ids, 'salt': salt}, timeout=REQUEST_TIMEOUT)
+    pulled = []
+    for transaction in response.json():
+        if get_mempool().contains(transaction['transaction_code']):
+            # Shares its short id with one that was missing
+            continue
+        print('Pulling transaction:', transaction['transaction_code'])
+        try:
+            if admit_transaction(transaction['data'], peer_url):
+                pulled.append(transaction['transaction_code'])
+        except MempoolBudgetExceeded as e:
+            print('Not pulling transaction:', transaction['transaction_code'], e)
+    return pulled
+
+
+def sync_mempool_with_peer(peer_url):
+    salt = os.urandom(8).hex()
+    response = requests.post(peer_url + '/get-mempool-digest', json={'salt': salt}, timeout=REQUEST_TIMEOUT)
+    their_short_ids = set(response.json()['short_ids'])
+    my_short_ids = get_short_ids(salt)
+    short_ids_to_pull = list(their_short_ids - my_short_ids.keys())
+    transactions_to_push = [transaction_code for short_id, transaction_codes in my_short_ids.items()
+                            if short_id not in their_short_ids for transaction_code in transaction_codes]
+
+    pulled = pull_transactions(peer_url, short_ids_to_pull, salt) if short_ids_to_pull else []
+    if transactions_to_push:
+        push_transactions(peer_url, transactions_to_push)
+    return {'pulled': pulled, 'pushed': transactions_to_push}
 
 
 def sync_mempool_transactions():
-    my_transactions = set(list_mempool_transactions())
-    their_transactions = set(list_mempool_transactions())  # Todo - Make this call between nodes
-    transactions_to_pull = their_transactions - my_transactions
-    transactions_to_push = my_transactions - their_transactions
-
-    if len(transactions_to_pull) != 0:
-        pull_transactions(transactions_to_pull)
-    else:
+    """Reconcile the mempool with every peer"""
+    result = {'pulled': [], 'pushed': []}
+    for peer in get_peers():
+        peer_url = 'http://' + peer['address'] + ':' + str(NEWRL_PORT)
+        try:
+            peer_result = sync_mempool_with_peer(peer_url)
+        except Exception as e:
+            print(f'Error syncing mempool with peer: {peer_url}', e)
+            continue
+        result['pulled'] += peer_result['pulled']
+        result['pushed'] += peer_result['pushed']
+    if not result['pulled']:
         print('No new transactions to pull')
-
-    if len(transactions_to_push) != 0:
-        push_transactions(transactions_to_push)
-    else:
+    if not result['pushed']:
         print('No transactions to push')
+    return result
 
-    return {
-        'pulled': transactions_to_pull,
-        'pushed': transactions_to_push
-    }
 
+def admit_transaction(transaction, source=None):
+    """Add a transaction from a peer to the mempool if it is valid, and return whether it was
 
-def validate_transaction(transaction):
-    filename = INCOMING_PATH + transaction['filename']
-    data = transaction['data']
-    with open(filename, "w") as transaction_file:
-            json.dump(data, transaction_file)
-            
+    The economic check runs through Mempool.admit, like validator.validate, so a
+    transaction from a peer cannot double spend against one admitted meanwhile.
+    Raises MempoolBudgetExceeded if it does not fit the mempool budgets.
+    """
     tmtemp = Transactionmanager()
-    trandata = tmtemp.loadtransactionpassive(filename)
+    trandata = tmtemp.set_transaction_data(transaction)
+    if not is_fee_valid(trandata['transaction'].get('fee')):
+        print("Transaction id ", trandata['transaction']['trans_code'], " has an invalid fee")
+        return False
     if not tmtemp.verifytransigns():
         print("Transaction id ", trandata['transaction']['trans_code'], " has invalid signatures")
         return False
 
-    if not tmtemp.econvalidator():
+    mempool = get_mempool()
+    if mempool.contains(trandata['transaction']['trans_code']):
+        # Already pending, relaying it again must not renew it
+        return True
+    if mempool.admit(tmtemp.get_transaction_complete(), tmtemp.econvalidator, source) is None:
         print("Economic validation failed for transaction ", trandata['transaction']['trans_code'])
         return False
     return True
 
 
 def receive_transaction(transaction):
-    transaction_code = transaction['transaction']['trans_code']
-    with open(MEMPOOL_PATH + 'transaction-' + transaction_code + '.json', "w") as transaction_file:
-        json.dump(transaction, transaction_file)
\ No newline at end of file
+    admit_transaction(transaction)
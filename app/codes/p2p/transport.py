@@ -1,4 +1,5 @@
 import requests
+from app.codes.fs.mempool_manager import MempoolBudgetExceeded
 from app.codes.p2p.sync_mempool import receive_transaction
 from app.constants import TRANSPORT_SERVER
 
@@ -10,10 +11,21 @@ def receive(payload):
 
         if operation == 'send_transaction':
             receive_transaction(data)
+        elif operation == 'send_transactions':
+            refused = None
+            for transaction in data:
+                try:
+                    receive_transaction(transaction)
+                except MempoolBudgetExceeded as e:
+                    refused = e
+            if refused is not None:
+                raise refused
         elif operation == 'send_block':
             print('Received block', data)
         else:
             print('Unknown operation', operation)
+    except MempoolBudgetExceeded:
+        raise
     except Exception as e:
         print(e)
         return 'Invalid payload'
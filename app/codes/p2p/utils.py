@@ -1,13 +1,12 @@
 import sqlite3
 
 from ...constants import NEWRL_P2P_DB
+from ..db_manager import get_cursor
 
 
 def get_peers():
     peers = []
-    con = sqlite3.connect(NEWRL_P2P_DB)
-    con.row_factory = sqlite3.Row
-    cur = con.cursor()
+    cur = get_cursor(NEWRL_P2P_DB, row_factory=sqlite3.Row)
     peer_cursor = cur.execute('SELECT * FROM peers').fetchall()
     peers = [dict(ix) for ix in peer_cursor]
     return peers
@@ -0,0 +1,65 @@
+"""Pruned node mode
+
+A pruned node keeps block headers, transaction codes and transaction hashes for
+the whole chain but drops transaction bodies older than the prune depth, both
+from the transactions table and from the block store. Pruned blocks are served
+in their pruned form even while their records still sit in the active block
+store segment, see drop_segments_before.
+"""
+from .db_manager import db_transaction, get_cursor
+from .fs.block_store import drop_segments_before
+from ..constants import PRUNE_DEPTH_HEADER, PRUNED_HEADER
+
+
+_prune_depth = None
+_pruned_height = 0
+
+
+def get_prune_depth():
+    return _prune_depth
+
+
+def is_pruned():
+    """True if this node runs pruned or has dropped bodies in an earlier run"""
+    return _prune_depth is not None or _pruned_height > 0
+
+
+def init_pruning(prune_depth=None):
+    """Set the prune depth for this run and prune everything already past it"""
+    global _prune_depth, _pruned_height
+    _prune_depth = prune_depth
+    cur = get_cursor()
+    pruned = cur.execute('SELECT MAX(block_index) FROM transactions WHERE specific_data IS NULL').fetchone()
+    _pruned_height = pruned[0] or 0
+    last_block = cur.execute('SELECT MAX(block_index) FROM blocks').fetchone()
+    cur.close()
+    if _prune_depth is not None and last_block[0]:
+        with db_transaction() as cur:
+            prune_chain(cur, last_block[0], prune_all=True)
+
+
+def prune_chain(cur, last_block_index, prune_all=False):
+    """Drop transaction bodies that fell past the prune depth after last_block_index was added
+
+    Only the block that just left the retained window is pruned unless prune_all is set.
+    """
+    global _pruned_height
+    if _prune_depth is None:
+        return
+    prune_below = last_block_index - _prune_depth
+    if prune_below < 1:
+        return
+    if prune_all:
+        cur.execute('UPDATE transactions SET specific_data = NULL WHERE block_index <= ? AND specific_data IS NOT NULL',
+                    (prune_below, ))
+    else:
+        cur.execute('UPDATE transactions SET specific_data = NULL WHERE block_index = ?', (prune_below, ))
+    drop_segments_before(cur, prune_below)
+    _pruned_height = max(_pruned_height, prune_below)
+
+
+def add_prune_headers(response):
+    """Tell peers whether this node can serve full history"""
+    response.headers[PRUNED_HEADER] = 'true' if is_pruned() else 'false'
+    if _prune_depth is not None:
+        response.headers[PRUNE_DEPTH_HEADER] = str(_prune_depth)
@@ -0,0 +1,125 @@
+"""Batch secp256k1 signature verification on a process pool
+
+Pure Python ecdsa holds the GIL for several milliseconds per signature, so
+batches are split across SIGNATURE_VERIFY_WORKERS processes. Batches smaller
+than SIGNATURE_VERIFY_MIN_BATCH, where the round trip to the pool costs more
+than it saves, are verified inline.
+
+A batch item is (message bytes, public key bytes, signature bytes).
+
+Public keys parsed by the crypto provider are kept in an LRU of
+VERIFYING_KEY_CACHE_SIZE keys, one per process, so point decompression is paid
+once per key. Keys that sign often, such as custodians and committee nodes, are
+prepared for repeated use once they have been used VERIFYING_KEY_PRECOMPUTE_USES
+times, which for python-ecdsa halves their verification time.
+
+Wallet public keys are cached by address as well. They never change once a
+wallet is created, so the cache only has to be cleared when the chain is
+reverted.
+"""
+import collections
+import functools
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from .crypto_provider import get_crypto_provider
+from .db_manager import get_cursor
+from ..constants import PUBLIC_KEY_CACHE_SIZE, SIGNATURE_VERIFY_MIN_BATCH, SIGNATURE_VERIFY_WORKERS, \
+    VERIFYING_KEY_CACHE_SIZE, VERIFYING_KEY_PRECOMPUTE_USES
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_verifying_keys = collections.OrderedDict()  # public key bytes -> [parsed public key, uses]
+_verifying_keys_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=PUBLIC_KEY_CACHE_SIZE)
+def get_wallet_public_key(address):
+    """Base64 public key of a wallet, raises if the wallet does not exist"""
+    cur = get_cursor()
+    public_key = cur.execute(
+        'SELECT wallet_public FROM wallets WHERE wallet_address=?', (address, )).fetchone()
+    cur.close()
+    if public_key is None:
+        raise Exception('Wallet with address not found')
+    return public_key[0]
+
+
+def clear_wallet_public_keys():
+    get_wallet_public_key.cache_clear()
+
+
+def get_verifying_key(public_key_bytes):
+    """Public key parsed by the crypto provider from raw bytes, raises for an invalid key"""
+    with _verifying_keys_lock:
+        entry = _verifying_keys.get(public_key_bytes)
+        if entry is not None:
+            _verifying_keys.move_to_end(public_key_bytes)
+            entry[1] += 1
+            if entry[1] != VERIFYING_KEY_PRECOMPUTE_USES:
+                return entry[0]
+
+    provider = get_crypto_provider()
+    if entry is not None:
+        verifying_key = provider.precompute(entry[0])
+    else:
+        verifying_key = provider.load_public_key(public_key_bytes)
+    with _verifying_keys_lock:
+        if entry is None:
+            entry = _verifying_keys.setdefault(public_key_bytes, [verifying_key, 1])
+            while len(_verifying_keys) > VERIFYING_KEY_CACHE_SIZE:
+                _verifying_keys.popitem(last=False)
+        else:
+            entry[0] = verifying_key
+    return entry[0]
+
+
+def verify_signature(message, public_key_bytes, signature_bytes):
+    try:
+        return get_crypto_provider().verify(get_verifying_key(public_key_bytes), signature_bytes, message)
+    except Exception:
+        return False
+
+
+def _verify_batch(items):
+    return [verify_signature(*item) for item in items]
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned rather than forked, the server process holds threads, locks and db connections
+            _pool = ProcessPoolExecutor(max_workers=SIGNATURE_VERIFY_WORKERS,
+                                        mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def shutdown_verifier():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False)
+
+
+def verify_signatures(items):
+    """Verify a batch of (message, public key, signature) and return a bool per item, in order"""
+    items = list(items)
+    if SIGNATURE_VERIFY_WORKERS < 1 or len(items) < SIGNATURE_VERIFY_MIN_BATCH:
+        return _verify_batch(items)
+
+    chunk_size = -(-len(items) // SIGNATURE_VERIFY_WORKERS)
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+    try:
+        results = []
+        for chunk_results in _get_pool().map(_verify_batch, chunks):
+            results.extend(chunk_results)
+        return results
+    except BrokenProcessPool:
+        print('Signature verification pool broke, verifying inline')
+        shutdown_verifier()
+        return _verify_batch(items)
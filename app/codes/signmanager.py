@@ -1,8 +1,8 @@
 """Sign and validate signatures"""
-import json
 import base64
-import ecdsa
 
+from .crypto_provider import get_crypto_provider
+from .encoding import signing_encode
 from .transactionmanager import Transactionmanager, get_valid_addresses
 
 
@@ -46,8 +46,7 @@ def sign_transaction(wallet_data, transaction_data):
 
 def sign_object(private_key, data):
     pvtkeybytes = base64.b64decode(private_key)
-    msg = json.dumps(data).encode()
-    sk = ecdsa.SigningKey.from_string(pvtkeybytes, curve=ecdsa.SECP256k1)
-    msgsignbytes = sk.sign(msg)
+    msg = signing_encode(data)
+    msgsignbytes = get_crypto_provider().sign(pvtkeybytes, msg)
     msgsign = base64.b64encode(msgsignbytes).decode('utf-8')
     return msgsign
@@ -0,0 +1,192 @@
+"""Sparse Merkle tree committing to all balances
+
+Leaves are keyed by sha256 of the (wallet, token) pair and hold the balance in
+minor units. A zero balance is an empty leaf. A subtree holding a single leaf
+is represented by that leaf, so the tree is only as deep as needed to tell its
+keys apart and its shape depends only on the set of keys. Nodes are stored in
+the state_tree table by their bit path from the root and only the paths
+touched by a batch of balance changes are read and rewritten.
+"""
+import hashlib
+import json
+
+
+EMPTY_HASH = bytes(32)
+
+
+def _sha256(data):
+    return hashlib.sha256(data).digest()
+
+
+def get_leaf_key(wallet_address, tokencode):
+    return _sha256(json.dumps([wallet_address, str(tokencode)]).encode())
+
+
+def get_leaf_hash(leaf_key, balance):
+    return _sha256(b'\x00' + leaf_key + str(balance).encode())
+
+
+def get_node_hash(left_hash, right_hash):
+    return _sha256(b'\x01' + left_hash + right_hash)
+
+
+def _bit(leaf_key, depth):
+    return (leaf_key[depth // 8] >> (7 - depth % 8)) & 1
+
+
+def init_state_tree(cur):
+    cur.execute('''
+                    CREATE TABLE IF NOT EXISTS state_tree
+                    (path text NOT NULL PRIMARY KEY,
+                    hash blob NOT NULL,
+                    leaf_key blob,
+                    balance integer)
+                    WITHOUT ROWID
+                    ''')
+
+
+class _TreeUpdate:
+    """Nodes read and written while applying one batch of leaf changes.
+
+    A node is a (hash, leaf_key, balance) tuple, leaf_key is None for inner nodes.
+    """
+
+    def __init__(self, cur):
+        self.cur = cur
+        self.nodes = {}
+        self.changed = set()
+
+    def get(self, path):
+        if path not in self.nodes:
+            self.nodes[path] = self.cur.execute(
+                'SELECT hash, leaf_key, balance FROM state_tree WHERE path = ?', (path, )).fetchone()
+        return self.nodes[path]
+
+    def set(self, path, node):
+        self.nodes[path] = node
+        self.changed.add(path)
+
+    def update(self, path, leaves):
+        """Apply (leaf_key, balance) changes below path and return the new node at path"""
+        node = self.get(path)
+        if not leaves:
+            return node
+        if node is None or node[1] is not None:
+            # Nothing below an empty node or a leaf, rebuild this subtree from its leaves
+            merged = dict(leaves)
+            if node is not None and node[1] not in merged:
+                merged[node[1]] = node[2]
+            return self.build(path, [(leaf_key, balance) for leaf_key, balance in merged.items() if balance])
+        depth = len(path)
+        left = self.update(path + '0', [leaf for leaf in leaves if _bit(leaf[0], depth) == 0])
+        right = self.update(path + '1', [leaf for leaf in leaves if _bit(leaf[0], depth) == 1])
+        return self.join(path, left, right)
+
+    def build(self, path, leaves):
+        if not leaves:
+            self.set(path, None)
+            return None
+        if len(leaves) == 1:
+            leaf_key, balance = leaves[0]
+            node = (get_leaf_hash(leaf_key, balance), leaf_key, balance)
+            self.set(path, node)
+            return node
+        depth = len(path)
+        left = self.build(path + '0', [leaf for leaf in leaves if _bit(leaf[0], depth) == 0])
+        right = self.build(path + '1', [leaf for leaf in leaves if _bit(leaf[0], depth) == 1])
+        return self.join(path, left, right)
+
+    def join(self, path, left, right):
+        if left is None and right is None:
+            self.set(path, None)
+            return None
+        lone = left if right is None else right if left is None else None
+        if lone is not None and lone[1] is not None:
+            # A leaf alone in its subtree moves up
+            self.set(path + '0', None)
+            self.set(path + '1', None)
+            self.set(path, lone)
+            return lone
+        node = (get_node_hash(left[0] if left else EMPTY_HASH, right[0] if right else EMPTY_HASH), None, None)
+        self.set(path, node)
+        return node
+
+    def flush(self):
+        deleted = [(path, ) for path in self.changed if self.nodes[path] is None]
+        written = [(path, ) + self.nodes[path] for path in self.changed if self.nodes[path] is not None]
+        self.cur.executemany('DELETE FROM state_tree WHERE path = ?', deleted)
+        self.cur.executemany(
+            'INSERT OR REPLACE INTO state_tree (path, hash, leaf_key, balance) VALUES (?, ?, ?, ?)', written)
+        self.changed.clear()
+
+
+def update_state_tree(cur, balances):
+    """Apply {(wallet_address, tokencode): balance} to the tree and return the new root"""
+    leaves = [(get_leaf_key(wallet_address, tokencode), balance)
+              for (wallet_address, tokencode), balance in balances.items()]
+    tree = _TreeUpdate(cur)
+    root = tree.update('', leaves)
+    tree.flush()
+    return root[0] if root else EMPTY_HASH
+
+
+def rebuild_state_tree(cur):
+    """Build the tree from scratch out of the balances table"""
+    cur.execute('DELETE FROM state_tree')
+    balances = {(row[0], row[1]): row[2] for row in cur.execute(
+        'SELECT wallet_address, tokencode, balance FROM balances WHERE balance != 0')}
+    return update_state_tree(cur, balances)
+
+
+def get_state_root(cur):
+    root = cur.execute("SELECT hash FROM state_tree WHERE path = ''").fetchone()
+    return root[0] if root else EMPTY_HASH
+
+
+def get_balance_proof(cur, wallet_address, tokencode):
+    """Inclusion or exclusion proof for a balance
+
+    siblings are the hashes next to the path from the root down to the node where
+    the key ends. leaf is the leaf found there, which for an exclusion proof is
+    either None or a different leaf sharing the path.
+    """
+    leaf_key = get_leaf_key(wallet_address, tokencode)
+    siblings = []
+    path = ''
+    node = cur.execute("SELECT hash, leaf_key, balance FROM state_tree WHERE path = ''").fetchone()
+    while node is not None and node[1] is None:
+        bit = _bit(leaf_key, len(path))
+        sibling = cur.execute('SELECT hash FROM state_tree WHERE path = ?',
+                              (path + str(1 - bit), )).fetchone()
+        siblings.append(sibling[0].hex() if sibling else EMPTY_HASH.hex())
+        path += str(bit)
+        node = cur.execute('SELECT hash, leaf_key, balance FROM state_tree WHERE path = ?', (path, )).fetchone()
+    leaf = {'leaf_key': node[1].hex(), 'balance': node[2]} if node is not None else None
+    return {'siblings': siblings, 'leaf': leaf}
+
+
+def verify_balance_proof(state_root, wallet_address, tokencode, balance, proof):
+    """Check that wallet_address holds balance of tokencode under state_root (hex)"""
+    leaf_key = get_leaf_key(wallet_address, tokencode)
+    leaf = proof['leaf']
+    depth = len(proof['siblings'])
+    if leaf is None:
+        if balance:
+            return False
+        node_hash = EMPTY_HASH
+    else:
+        found_key = bytes.fromhex(leaf['leaf_key'])
+        if found_key == leaf_key:
+            if leaf['balance'] != balance:
+                return False
+        elif balance or any(_bit(found_key, i) != _bit(leaf_key, i) for i in range(depth)):
+            return False
+        node_hash = get_leaf_hash(found_key, leaf['balance'])
+
+    for depth in reversed(range(depth)):
+        sibling = bytes.fromhex(proof['siblings'][depth])
+        if _bit(leaf_key, depth) == 0:
+            node_hash = get_node_hash(node_hash, sibling)
+        else:
+            node_hash = get_node_hash(sibling, node_hash)
+    return node_hash.hex() == state_root
@@ -5,6 +5,10 @@ from lib2to3.pgen2 import token
 
 from ..constants import NEWRL_DB
 from .db_updater import *
+from .events import stage_balance_changes
+from .state_tree import get_state_root
+from .state_view import StateView
+from .verdict_cache import stage_state_changes
 
 
 def update_db_states(cur, newblockindex, transactions, creator=None):
@@ -17,8 +21,10 @@ def update_db_states(cur, newblockindex, transactions, creator=None):
 #    latest_index = cur.execute('SELECT MAX(block_index) FROM blocks')
     add_tx_to_block(cur, newblockindex, transactions)
 
+    state = StateView(cur)
+    state.preload(transactions)
     if creator:
-        add_block_reward(cur, creator, newblockindex)
+        add_block_reward(state, creator, newblockindex)
 
     for transaction in transactions:
         transaction_data = transaction['specific_data']
@@ -28,16 +34,22 @@ def update_db_states(cur, newblockindex, transactions, creator=None):
         transaction_code = transaction['transaction_code'] if 'transaction_code' in transaction else transaction['trans_code']
 
         update_state_from_transaction(
-            cur,
+            state,
             transaction['type'],
             transaction_data,
             transaction_code,
             transaction['timestamp']
         )
+    balances = state.flush()
+    stage_balance_changes(newblockindex, balances)
+    stage_state_changes(newblockindex, balances)
+    cur.execute('UPDATE blocks SET state_root = ? WHERE block_index = ?',
+                (get_state_root(cur).hex(), newblockindex))
     return True
 
 
 def update_state_from_transaction(cur, transaction_type, transaction_data, transaction_code, transaction_timestamp):
+    """Apply a transaction to the state. cur is a StateView, flushed by the caller"""
     if transaction_type == 1:  # this is a wallet creation transaction
         add_wallet_pid(cur, transaction_data)
 
@@ -49,12 +61,12 @@ def update_state_from_transaction(cur, transaction_type, transaction_data, trans
         sender2 = transaction_data['wallet2']
 
         tokencode1 = transaction_data['asset1_code']
-        amount1 = int(transaction_data['asset1_number'] or 0)
+        amount1 = to_minor_units(transaction_data['asset1_number'])
         transfer_tokens_and_update_balances(
             cur, sender1, sender2, tokencode1, amount1)
 
         tokencode2 = transaction_data['asset2_code']
-        amount2 = int(transaction_data['asset2_number'] or 0)
+        amount2 = to_minor_units(transaction_data['asset2_number'])
         transfer_tokens_and_update_balances(
             cur, sender2, sender1, tokencode2, amount2)
 
@@ -76,7 +88,7 @@ def update_state_from_transaction(cur, transaction_type, transaction_data, trans
         module = importlib.import_module(
             ".codes.contracts."+contract['name'], package="app")
         sc_class = getattr(module, contract['name'])
-        sc_instance = sc_class(transaction_data['address'])
+        sc_instance = sc_class(transaction_data['address'], cur)
     #    sc_instance = nusd1(transaction['specific_data']['address'])
         funct = getattr(sc_instance, funct)
         funct(cur, transaction_data['params'])
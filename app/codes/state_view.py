@@ -0,0 +1,158 @@
+"""In-memory view of the state tables used while applying a block"""
+from .db_updater import to_minor_units
+from .state_tree import update_state_tree
+
+
+SQL_VARIABLES_PER_QUERY = 500
+
+
+def _chunks(items, size=SQL_VARIABLES_PER_QUERY):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class StateView:
+    """Overlay over balances, wallets and tokens for one block.
+
+    Touched rows are read from the db once and every later read or write
+    happens in memory, so intra-block reads see earlier writes. Balance
+    changes are written to the db by flush() with executemany. Any other
+    statement goes to the underlying cursor through execute(), which lets the
+    view be passed wherever the state helpers expect a cursor.
+    """
+
+    def __init__(self, cur):
+        self.cur = cur
+        self.balances = {}
+        self.changed_balances = set()
+        self.wallets = {}
+        self.tokens = {}
+
+    def execute(self, *args):
+        return self.cur.execute(*args)
+
+    def preload(self, transactions):
+        """Load the balances, wallets and tokens the transactions will touch"""
+        wallets = set()
+        tokens = set()
+        balance_keys = set()
+        for transaction in transactions:
+            for wallet, token in get_transaction_balance_keys(transaction):
+                if wallet:
+                    wallets.add(wallet)
+                if token:
+                    tokens.add(token)
+                if wallet and token:
+                    balance_keys.add(_balance_key(wallet, token))
+        self.load_wallets(wallets)
+        self.load_tokens(tokens)
+        self.load_balances(balance_keys)
+
+    def load_balances(self, keys):
+        keys = [_balance_key(*key) for key in keys]
+        keys = [key for key in keys if key not in self.balances]
+        for chunk in _chunks(keys, SQL_VARIABLES_PER_QUERY // 2):
+            placeholders = ', '.join(['(?, ?)'] * len(chunk))
+            params = [value for key in chunk for value in key]
+            rows = self.cur.execute(f'''SELECT wallet_address, tokencode, balance FROM balances
+                WHERE (wallet_address, tokencode) IN (VALUES {placeholders})''', params).fetchall()
+            for key in chunk:
+                self.balances[key] = 0
+            for wallet_address, tokencode, balance in rows:
+                self.balances[(wallet_address, tokencode)] = balance
+
+    def load_wallets(self, addresses):
+        addresses = [address for address in addresses if address not in self.wallets]
+        for chunk in _chunks(addresses):
+            placeholders = ', '.join(['?'] * len(chunk))
+            rows = self.cur.execute(
+                f'SELECT wallet_address FROM wallets WHERE wallet_address IN ({placeholders})', chunk).fetchall()
+            found = {row[0] for row in rows}
+            for address in chunk:
+                self.wallets[address] = address in found
+
+    def load_tokens(self, tokencodes):
+        tokencodes = [str(tokencode) for tokencode in tokencodes]
+        tokencodes = [tokencode for tokencode in tokencodes if tokencode not in self.tokens]
+        for chunk in _chunks(tokencodes):
+            placeholders = ', '.join(['?'] * len(chunk))
+            rows = self.cur.execute(
+                f'SELECT tokencode FROM tokens WHERE tokencode IN ({placeholders})', chunk).fetchall()
+            found = {row[0] for row in rows}
+            for tokencode in chunk:
+                self.tokens[tokencode] = tokencode in found
+
+    def get_balance(self, wallet_address, tokencode):
+        key = _balance_key(wallet_address, tokencode)
+        if key not in self.balances:
+            self.load_balances([key])
+        return self.balances[key]
+
+    def set_balance(self, wallet_address, tokencode, balance):
+        key = _balance_key(wallet_address, tokencode)
+        self.balances[key] = to_minor_units(balance)
+        self.changed_balances.add(key)
+
+    def wallet_exists(self, wallet_address):
+        if wallet_address not in self.wallets:
+            self.load_wallets([wallet_address])
+        return self.wallets[wallet_address]
+
+    def wallet_added(self, wallet_address):
+        self.wallets[wallet_address] = True
+
+    def token_exists(self, tokencode):
+        tokencode = str(tokencode)
+        if tokencode not in self.tokens:
+            self.load_tokens([tokencode])
+        return self.tokens[tokencode]
+
+    def token_added(self, tokencode):
+        self.tokens[str(tokencode)] = True
+
+    def flush(self):
+        """Write changed balances to the db and the state tree in one batch
+
+        Returns {(wallet_address, tokencode): balance} for the balances written.
+        """
+        if not self.changed_balances:
+            return {}
+        changed = sorted(self.changed_balances)
+        self.cur.executemany('INSERT OR IGNORE INTO wallet_ids (wallet_address) VALUES (?)',
+                             [(wallet,) for wallet in {key[0] for key in changed}])
+        self.cur.executemany('INSERT OR IGNORE INTO token_ids (tokencode) VALUES (?)',
+                             [(token,) for token in {key[1] for key in changed}])
+        self.cur.executemany('''INSERT OR REPLACE INTO balances_store (wallet_id, token_id, balance)
+            VALUES ((SELECT id FROM wallet_ids WHERE wallet_address = ?),
+            (SELECT id FROM token_ids WHERE tokencode = ?), ?)''',
+                             [(wallet, token, self.balances[(wallet, token)]) for wallet, token in changed])
+        balances = {key: self.balances[key] for key in changed}
+        update_state_tree(self.cur, balances)
+        self.changed_balances.clear()
+        return balances
+
+
+def _balance_key(wallet_address, tokencode):
+    # Tokencodes are stored as text; clients sometimes send them as numbers
+    return (wallet_address, str(tokencode))
+
+
+def get_transaction_balance_keys(transaction):
+    """(wallet, tokencode) pairs a transaction reads, either part may be None"""
+    transaction_type = transaction['type']
+    data = transaction['specific_data']
+    if isinstance(data, str):
+        return []
+    if transaction_type == 1:
+        return [(data.get('wallet_address'), None), (data.get('custodian_wallet'), None)]
+    if transaction_type == 2:
+        return [(data.get('first_owner'), data.get('tokencode') or None)]
+    if transaction_type == 4 or transaction_type == 5:
+        return [
+            (data.get('wallet1'), data.get('asset1_code')),
+            (data.get('wallet2'), data.get('asset1_code')),
+            (data.get('wallet1'), data.get('asset2_code')),
+            (data.get('wallet2'), data.get('asset2_code')),
+        ]
+    return []
@@ -1,17 +1,22 @@
 """Transaction management functions"""
 import time
-import ecdsa
 import os
 import hashlib
 import json
 import datetime
 import base64
-import sqlite3
 
 from ..types import TRANSACTION_ONE_WAY_TRANSFER, TRANSACTION_SMART_CONTRACT, TRANSACTION_TRUST_SCORE_CHANGE, TRANSACTION_TWO_WAY_TRANSFER, TRANSACTION_WALLET_CREATION, TRANSCATION_TOKEN_CREATION
 from .chainscanner import get_wallet_token_balance
-from ..constants import ALLOWED_CUSTODIANS_FILE, MEMPOOL_PATH, NEWRL_DB
+from ..constants import ALLOWED_CUSTODIANS_FILE, TMP_PATH
+from .db_manager import get_cursor
+from .encoding import signing_encode
+from .fs.mempool_manager import get_mempool, get_transaction_debits
+from .crypto_provider import get_crypto_provider
+from .signature_verifier import get_wallet_public_key, verify_signature, verify_signatures
 from .utils import get_time_ms
+from .verdict_cache import get_state_versions, is_economics_verdict_valid, is_signature_verdict_valid, \
+    set_economics_verdict, set_signature_verdict
 
 
 class Transactionmanager:
@@ -28,8 +33,19 @@ class Transactionmanager:
         }
 
         self.signatures = []
-        self.mempool = MEMPOOL_PATH
         self.validity = 0
+        self._signing_message = None
+        self._pending_debits_seen = {}
+
+    def get_signing_message(self):
+        """Bytes that signatures of the transaction are made over, encoded once per transaction"""
+        if self._signing_message is None:
+            self._signing_message = signing_encode(self.transaction)
+        return self._signing_message
+
+    def get_verdict_key(self):
+        """Hash of the transaction and its signatures that validation verdicts are cached under"""
+        return hashlib.sha256(self.get_signing_message() + signing_encode(self.signatures)).digest()
 
     def get_valid_addresses(self):
         """Get valid signature addresses for a transaction"""
@@ -53,10 +69,11 @@ class Transactionmanager:
         self.transaction['descr'] = tran_data['descr']
         self.transaction['valid'] = 1  # default at creation is unverified
         self.transaction['specific_data'] = tran_data['specific_data']
-        trstr = json.dumps(self.transaction).encode()
+        trstr = signing_encode(self.transaction)
         hs = hashlib.blake2b(digest_size=20)
         hs.update(trstr)
         self.transaction['trans_code'] = hs.hexdigest()
+        self._signing_message = None
         self.signatures = tran_data_all['signatures']
         transaction_all = {'transaction': self.transaction,
                            'signatures': self.signatures}
@@ -66,6 +83,7 @@ class Transactionmanager:
         """this just loads the transactions passively, no change"""
         self.transaction = transaction_data['transaction']
         self.signatures = transaction_data['signatures']
+        self._signing_message = None
         return transaction_data
 
     def loadtransactionpassive(self, file):
@@ -75,15 +93,19 @@ class Transactionmanager:
             trandata = json.load(readfile)
         self.transaction = trandata['transaction']
         self.signatures = trandata['signatures']
+        self._signing_message = None
         return trandata
 
     def save_transaction_to_mempool(self, file=None):
-        """dumps active transaction into a stated file or in mempool by default"""
+        """dumps active transaction into a stated file or in the temp folder by default
+
+        Transactions written here are unsigned. Signed ones enter the mempool through validator.validate
+        """
         transaction_timestamp = self.transaction['timestamp']
         if not transaction_timestamp:
             transaction_timestamp = get_time_ms()
         if not file:
-            file = f"{self.mempool}transaction-{self.transaction['type']}-{transaction_timestamp}.json"
+            file = f"{TMP_PATH}transaction-{self.transaction['type']}-{transaction_timestamp}.json"
         transaction_complete = self.get_transaction_complete()
         with open(file, "w") as writefile:
             json.dump(transaction_complete, writefile)
@@ -99,102 +121,66 @@ class Transactionmanager:
 
     def sign_transaction(self, private_key_bytes, address):
         """this takes keybytes and not binary string and not base64 string"""
-        msg = json.dumps(self.transaction).encode()
-        signing_key = ecdsa.SigningKey.from_string(private_key_bytes, curve=ecdsa.SECP256k1)
-        msgsignbytes = signing_key.sign(msg)
+        msg = self.get_signing_message()
+        msgsignbytes = get_crypto_provider().sign(private_key_bytes, msg)
         msgsign = base64.b64encode(msgsignbytes).decode('utf-8')
         self.signatures.append({'wallet_address': address, 'msgsign': msgsign})
-        return signing_key.sign(msg)
+        return msgsignbytes
 
     def verify_sign(self, sign_trans, public_key_bytes):
         """The pubkey above is in bytes form"""
         sign_trans_bytes = base64.decodebytes(sign_trans.encode('utf-8'))
-        verifying_key = ecdsa.VerifyingKey.from_string(public_key_bytes, curve=ecdsa.SECP256k1)
-        message = json.dumps(self.transaction).encode()
-        return verifying_key.verify(sign_trans_bytes, message)
+        message = self.get_signing_message()
+        return verify_signature(message, public_key_bytes, sign_trans_bytes)
 
-    def verifytransigns(self):
-        # need to add later a check for addresses mentioned in the transaction (vary by type) and the signing ones
+    def get_signature_items(self):
+        """Addresses that have to sign, and (wallet address, (message, public key bytes, signature bytes))
+        for each relevant signature"""
         validadds = self.get_valid_addresses()
-        addvaliditydict = {}
-        for valadd in validadds:
-            addvaliditydict[valadd] = False
-
-        prodflag = 1
+        message = self.get_signing_message()
+        items = []
         for signature in self.signatures:
             signaddress = signature['wallet_address']
-            addressvalidity = 0
-            for valadd in validadds:
-                if signaddress == valadd:  # the signature is of a relevant address for that transaction
-                    addressvalidity = 1
-            if not addressvalidity:
+            if signaddress not in validadds:
                 print("Signature with address ", signaddress,
                       " is not relevant for this transaction.")
                 continue
-            msgsign = signature['msgsign']
-            pubkey = get_public_key_from_address(signaddress)
-    #		print("encoded pubkey from json file: ",pubkey)
-            # here we decode the base64 form to get pubkeybytes
-            pubkeybytes = base64.b64decode(pubkey)
-        #	print("decoded bytes of pubkey",pubkeybytes)
-    #		print("now verifying ",msgsign)
-            if not self.verify_sign(msgsign, pubkeybytes):
-                print("Signature for address ", signaddress, " is invalid")
-                prodflag = prodflag*0
-                addvaliditydict[signaddress] = False  # making doubly sure
-                return False
-            else:
-                # for a valid address the signature is found
-                addvaliditydict[signaddress] = True
-                prodflag = prodflag*1
-        if prodflag:
-            print("All provided signatures of the message valid; still need to check if all required ones are provided")
-        #	return True
-        else:
-            print("Some of the provided signatures not valid")
-        #	return False
-        # now checking if signatures for all valid addresses are covered
-        validsignspresent = 0
-        for valadd in validadds:
-            if addvaliditydict[valadd]:
-                validsignspresent += 1
-            else:
-                print(
-                    "Either couldn't find signature or found invalid signature for ", valadd)
-            #	valaddsignpresent=valaddsignpresent*0;	#any one signaure not being present will throw an error
-        if prodflag and validsignspresent >= len(validadds):
-            print("All provided signatures valid and all required signatures provided")
-            return True
-        else:
-            print("Either some signatures invalid or some required ones missing")
-            return False
+            pubkeybytes = base64.b64decode(get_public_key_from_address(signaddress))
+            sign_trans_bytes = base64.decodebytes(signature['msgsign'].encode('utf-8'))
+            items.append((signaddress, (message, pubkeybytes, sign_trans_bytes)))
+        return validadds, items
 
-    def mempoolpayment(self, sender, tokencode):
-        #	if not mempool:
-        mempool = self.mempool
-        filenames = os.listdir(mempool)
-        mppayment = 0
-        for filename in filenames:
-            fl = mempool+filename
-        #	self.loadtransaction
-            with open(fl, "r") as readfile:
-                trandata = json.load(readfile)['transaction']
-            ttype = trandata['type']
-            if ttype < 3:  # 0 is genesis, 1 is wallet creation, 2 is token creation
-                continue
-            if ttype == 5:  # unilateral transaction so will have only asset_1 number
-                if sender == trandata['specific_data']['wallet1'] and trandata['specific_data']['asset1_code'] == tokencode:
-                    mppayment += trandata['specific_data']['asset1_number']
-            if ttype == 4:  # bilateral trasnaction so will have both aset_1 and asset_2 numbers
-                if sender == trandata['specific_data']['wallet1'] and trandata['specific_data']['asset1_code'] == tokencode:
-                    mppayment += trandata['specific_data']['asset1_number']
-                if sender == trandata['specific_data']['wallet2'] and trandata['specific_data']['asset2_code'] == tokencode:
-                    mppayment += trandata['specific_data']['asset2_number']
+    def verifytransigns(self):
+        return verify_transactions_signatures([self])[0]
 
+    def mempoolpayment(self, sender, tokencode):
+        """Amount of tokencode that other transactions pending in the mempool take from sender"""
         #	need to incorporate the fee as well in future
-        return mppayment
+        pending = get_mempool().get_pending_debit(sender, tokencode, excluding=self.transaction['trans_code'])
+        self._pending_debits_seen[(sender, tokencode)] = pending
+        return pending
 
-    def econvalidator(self):
+    def econvalidator(self, cur=None):
+        """Economic validity, reusing the verdict of an earlier check of a transfer if nothing it read has changed
+
+        cur is the cursor to read state with, by default one on the pooled connection.
+        """
+        debits = get_transaction_debits(self.get_transaction_complete())
+        if not debits:
+            return self.check_economics(cur)
+        verdict_key = self.get_verdict_key()
+        if is_economics_verdict_valid(verdict_key, self.mempoolpayment):
+            return True
+        balances = [(sender, tokencode) for sender, tokencode, _ in debits]
+        versions = get_state_versions(balances)
+        self._pending_debits_seen = {}
+        valid = self.check_economics(cur)
+        if valid:
+            set_economics_verdict(verdict_key, balances, versions,
+                                  [self._pending_debits_seen[balance] for balance in balances])
+        return valid
+
+    def check_economics(self, cur=None):
         # start with all holdings of the wallets involved and add validated transactions from mempool
         # from mempool only include transactions that reduce balance and not those that increase
         # check if the sender has enough balance to spend
@@ -202,7 +188,7 @@ class Transactionmanager:
         if self.transaction['type'] == 1:
             custodian = self.transaction['specific_data']['custodian_wallet']
             walletaddress = self.transaction['specific_data']['wallet_address']
-            if not is_wallet_valid(custodian):
+            if not is_wallet_valid(custodian, cur):
                 print("No custodian address found")
             #	self.transaction['valid']=0
                 self.validity = 0
@@ -220,7 +206,7 @@ class Transactionmanager:
                     else:
                         self.validity = 0  # other custodian cannot sign someone's linked wallet address
                 else:   # this is a new wallet and person
-                    if is_wallet_valid(walletaddress):
+                    if is_wallet_valid(walletaddress, cur):
                         print("Wallet with address",
                               walletaddress, " already exists.")
                         self.validity = 0
@@ -250,7 +236,7 @@ class Transactionmanager:
             fovalidity = False
             custvalidity = False
             if firstowner:
-                if is_wallet_valid(firstowner):
+                if is_wallet_valid(firstowner, cur):
                     print("Valid first owner")
                     fovalidity = True
                 else:
@@ -262,7 +248,7 @@ class Transactionmanager:
                     fovalidity = False  # amount cannot be non-zero if no first owner
                 else:
                     fovalidity = True
-            if is_wallet_valid(custodian):
+            if is_wallet_valid(custodian, cur):
                 print("Valid custodian")
                 custvalidity = True
             if not fovalidity:
@@ -280,9 +266,9 @@ class Transactionmanager:
                 if 'tokencode' in self.transaction['specific_data']:
                     tcode = self.transaction['specific_data']['tokencode']
                     if tcode and tcode != "0" and tcode != "" and tcode != "string":
-                        if is_token_valid(self.transaction['specific_data']['tokencode']):
+                        if is_token_valid(self.transaction['specific_data']['tokencode'], cur):
                             existing_custodian = get_custodian_from_token(
-                                self.transaction['specific_data']['tokencode'])
+                                self.transaction['specific_data']['tokencode'], cur)
                             if custodian == existing_custodian:
                                 self.validity = 1  # tokencode exists and is run by the given custodian
                             else:
@@ -301,11 +287,11 @@ class Transactionmanager:
         if self.transaction['type'] == 3:
             self.validity = 1
             for wallet in self.transaction['specific_data']['signers']:
-                if not is_wallet_valid(wallet):
+                if not is_wallet_valid(wallet, cur):
                     self.validity = 0
             if 'participants' in self.transaction['specific_data']['params']:
                 for wallet in self.transaction['specific_data']['params']['participants']:
-                    if not is_wallet_valid(wallet):
+                    if not is_wallet_valid(wallet, cur):
                         self.validity = 0
 
     #	self.validity=0
@@ -317,8 +303,7 @@ class Transactionmanager:
             sender2 = self.transaction['specific_data']['wallet2']
             tokencode1 = self.transaction['specific_data']['asset1_code']
             token1mp = self.mempoolpayment(sender1, tokencode1)
-            token1amt = max(
-                self.transaction['specific_data']['asset1_number'], token1mp)
+            token1amt = self.transaction['specific_data']['asset1_number'] + token1mp
             sender1valid = False
             sender2valid = False
 
@@ -327,12 +312,11 @@ class Transactionmanager:
                 #	startingbalance2=0;
                 tokencode2 = self.transaction['specific_data']['asset2_code']
                 token2mp = self.mempoolpayment(sender2, tokencode2)
-                token2amt = max(
-                    self.transaction['specific_data']['asset2_number'], token2mp)
+                token2amt = self.transaction['specific_data']['asset2_number'] + token2mp
 
             # address validity applies to both senders in ttype 4 and 5; since sender2 is still receiving tokens
-            sender1valid = is_wallet_valid(sender1)
-            sender2valid = is_wallet_valid(sender2)
+            sender1valid = is_wallet_valid(sender1, cur)
+            sender2valid = is_wallet_valid(sender2, cur)
             if not sender1valid:
                 print("Invalid sender1 wallet")
             #	self.transaction['valid']=0
@@ -349,8 +333,8 @@ class Transactionmanager:
             if ttype == 4:
                 # by keeping it here, we ensure that no code refers to token2valid for type5
                 token2valid = False
-            token1valid = is_token_valid(tokencode1)
-            token2valid = ttype == 4 and is_token_valid(tokencode2)
+            token1valid = is_token_valid(tokencode1, cur)
+            token2valid = ttype == 4 and is_token_valid(tokencode2, cur)
             if not token1valid:
                 print("Invalid asset1 code")
                 self.validity = 0
@@ -372,10 +356,10 @@ class Transactionmanager:
             # resetting to check the balances being sufficient, in futures, make different functions
             self.validity = 0
 
-            startingbalance1 = get_wallet_token_balance(sender1, tokencode1)
+            startingbalance1 = get_wallet_token_balance(sender1, tokencode1, cur)
             if ttype == 4:
                 startingbalance2 = get_wallet_token_balance(
-                    sender2, tokencode2)
+                    sender2, tokencode2, cur)
             if token1amt > startingbalance1:  # sender1 is trying to send more than she owns
                 print("sender1 is trying to send,", token1amt, "she owns,",
                       startingbalance1, " invalidating transaction")
@@ -409,14 +393,14 @@ class Transactionmanager:
             wallet1valid = False
             wallet2valid = False
 
-            wallet1valid = is_wallet_valid(wallet1)
-            wallet2valid = is_wallet_valid(wallet2)
+            wallet1valid = is_wallet_valid(wallet1, cur)
+            wallet2valid = is_wallet_valid(wallet2, cur)
             if not wallet1valid or not wallet2valid:
                 print("One of the wallets is invalid")
                 self.validity = 0
             else:
                 #    if get_pid_from_wallet(wallet1) != personid1 or get_pid_from_wallet(wallet2) != personid2:
-                if not get_pid_from_wallet(wallet1) or not get_pid_from_wallet(wallet2):
+                if not get_pid_from_wallet(wallet1, cur) or not get_pid_from_wallet(wallet2, cur):
                     print(
                         "One of the wallet addresses does not have a valid associated personids.")
                     self.validity = 0
@@ -436,20 +420,59 @@ class Transactionmanager:
         # check the token restrictions on ownertype and check the type of the recipient
 
 
+def verify_transactions_signatures(transaction_managers):
+    """Verify the signatures of several transactions in one batch, a bool per transaction
+
+    A transaction is valid when every relevant signature verifies and every
+    address that has to sign it did. Transactions found valid before are not
+    verified again.
+    """
+    verdict_keys = []
+    signature_checks = []
+    for transaction_manager in transaction_managers:
+        verdict_key = transaction_manager.get_verdict_key()
+        verdict_keys.append(verdict_key)
+        if is_signature_verdict_valid(verdict_key):
+            signature_checks.append(True)
+            continue
+        try:
+            signature_checks.append(transaction_manager.get_signature_items())
+        except Exception as e:
+            print("Could not read signatures of ", transaction_manager.transaction.get('trans_code'), e)
+            signature_checks.append(None)
+    results = iter(verify_signatures(
+        [item for checks in signature_checks if checks not in (None, True) for _, item in checks[1]]))
+
+    valid = []
+    for verdict_key, checks in zip(verdict_keys, signature_checks):
+        if checks is None or checks is True:
+            valid.append(checks is True)
+            continue
+        validadds, items = checks
+        signed = set()
+        all_verified = True
+        for signaddress, _ in items:
+            if next(results):
+                signed.add(signaddress)
+            else:
+                print("Signature for address ", signaddress, " is invalid")
+                all_verified = False
+        missing = [valadd for valadd in validadds if valadd not in signed]
+        if missing:
+            print("Either couldn't find signature or found invalid signature for ", missing)
+        valid.append(all_verified and not missing)
+        if valid[-1]:
+            set_signature_verdict(verdict_key)
+    return valid
+
+
 def get_public_key_from_address(address):
-    con = sqlite3.connect(NEWRL_DB)
-    cur = con.cursor()
-    wallet_cursor = cur.execute(
-        'SELECT wallet_public FROM wallets WHERE wallet_address=?', (address, ))
-    public_key = wallet_cursor.fetchone()
-    if public_key is None:
-        raise Exception('Wallet with address not found')
-    return public_key[0]
+    return get_wallet_public_key(address)
 
 
-def is_token_valid(token_code):
-    con = sqlite3.connect(NEWRL_DB)
-    cur = con.cursor()
+def is_token_valid(token_code, cur=None):
+    if cur is None:
+        cur = get_cursor()
     token_cursor = cur.execute(
         'SELECT tokencode FROM tokens WHERE tokencode=?', (token_code, ))
     token = token_cursor.fetchone()
@@ -458,9 +481,9 @@ def is_token_valid(token_code):
     return True
 
 
-def is_wallet_valid(address):
-    con = sqlite3.connect(NEWRL_DB)
-    cur = con.cursor()
+def is_wallet_valid(address, cur=None):
+    if cur is None:
+        cur = get_cursor()
     wallet_cursor = cur.execute(
         'SELECT wallet_public FROM wallets WHERE wallet_address=?', (address, ))
     wallet = wallet_cursor.fetchone()
@@ -470,8 +493,7 @@ def is_wallet_valid(address):
 
 
 def get_wallets_from_pid(personidinput):
-    con = sqlite3.connect(NEWRL_DB)
-    cur = con.cursor()
+    cur = get_cursor()
     wallet_cursor = cur.execute(
         'SELECT wallet_id FROM person_wallet WHERE person_id=?', (personidinput, )).fetchall()
     if wallet_cursor is None:
@@ -480,9 +502,9 @@ def get_wallets_from_pid(personidinput):
     return wallets
 
 
-def get_pid_from_wallet(walletaddinput):
-    con = sqlite3.connect(NEWRL_DB)
-    cur = con.cursor()
+def get_pid_from_wallet(walletaddinput, cur=None):
+    if cur is None:
+        cur = get_cursor()
     pid_cursor = cur.execute(
         'SELECT person_id FROM person_wallet WHERE wallet_id=?', (walletaddinput, ))
     pid = pid_cursor.fetchone()
@@ -491,9 +513,9 @@ def get_pid_from_wallet(walletaddinput):
     return pid[0]
 
 
-def get_custodian_from_token(token_code):
-    con = sqlite3.connect(NEWRL_DB)
-    cur = con.cursor()
+def get_custodian_from_token(token_code, cur=None):
+    if cur is None:
+        cur = get_cursor()
     token_cursor = cur.execute(
         'SELECT custodian FROM tokens WHERE tokencode=?', (token_code, ))
     custodian = token_cursor.fetchone()
@@ -512,11 +534,10 @@ def get_sc_validadds(transaction):
     if not address:
         print("Invalid call to a function of a contract yet to be set up.")
         return False
-    con = sqlite3.connect(NEWRL_DB)
-    cur = con.cursor()
+    cur = get_cursor()
     signatories = cur.execute(
         'SELECT signatories FROM contracts WHERE address=?', (address, )).fetchone()
-    con.close()
+    cur.close()
     if signatories is None:
         print("Contract does not exist.")
         return False
@@ -1,87 +1,89 @@
 """Updater that adds a new block and updates state db"""
+import contextlib
 import datetime
 import json
 import os
-import sqlite3
 import requests
 
-from ..constants import IS_TEST, NEWRL_DB, NEWRL_PORT, REQUEST_TIMEOUT, MEMPOOL_PATH, TIME_BETWEEN_BLOCKS_SECONDS
+from ..constants import IS_TEST, MAX_BLOCK_SIZE_BYTES, MAX_BLOCK_TRANSACTIONS, NEWRL_PORT, REQUEST_TIMEOUT, TIME_BETWEEN_BLOCKS_SECONDS
 from .p2p.peers import get_peers
 from .utils import BufferedLog, get_time_ms
-from .blockchain import Blockchain
-from .transactionmanager import Transactionmanager
+from .blockchain import Blockchain, store_block
+from .checkpoints import on_block_committed
+from .pruning import prune_chain
+from .db_manager import get_connection
+from .db_updater import get_included_transaction_codes
+from .fs.mempool_manager import get_mempool, get_selection_policy
+from .transactionmanager import Transactionmanager, verify_transactions_signatures
 from .state_updater import update_db_states
 from .crypto import calculate_hash, sign_object, _private, _public
 from .consensus.consensus import generate_block_receipt
 
 
-MAX_BLOCK_SIZE = 10
-
 def run_updater():
     logger = BufferedLog()
     blockchain = Blockchain()
 
-    con = sqlite3.connect(NEWRL_DB)
+    con = get_connection()
     cur = con.cursor()
     block_time_limit = 1  # Number of hours of no transactions still prompting new block
-    block_height = 0
     latest_ts = blockchain.get_latest_ts(cur)
 
-    filenames = os.listdir(MEMPOOL_PATH)  # this is the mempool
-    logger.log("Files in mempool: ", filenames)
+    mempool = get_mempool()
+    logger.log("Transactions in mempool: ", len(mempool))
     textarray = []
     signarray = []
-    transfiles = filenames
     txcodes = []
-    tmtemp = Transactionmanager()
 
-    for filename in transfiles:
-        file = MEMPOOL_PATH + filename
-        try:
-            with open(file, "r") as read_file:
-                logger.log("Processing ", file)
-                transaction_file_data = json.load(read_file)
-        except:
-            logger.log("Couldn't load transaction file ", file)
-            continue
-        
-        transaction = transaction_file_data['transaction']
-        signatures = transaction_file_data['signatures']
-
-        # new code for validating again
-        trandata = tmtemp.loadtransactionpassive(file)
-        if not tmtemp.verifytransigns():
-            logger.log(
-                f"Transaction id {trandata['transaction']['trans_code']} has invalid signatures")
-            os.remove(file)
-            continue
-        if not tmtemp.econvalidator():
-            logger.log("Economic validation failed for transaction ",
-                        trandata['transaction']['trans_code'])
-            os.remove(file)
-            continue
-
-        logger.log("Found valid transaction, checking if it is already included")
-        transactions_cursor = cur.execute("SELECT * FROM transactions where transaction_code='" + transaction['trans_code'] + "'")
-        row = transactions_cursor.fetchone()
-        if row is not None:
-            # The current transaction is already included in some earlier block
-            os.remove(file)
-            continue
-        
-        if trandata['transaction']['trans_code'] not in txcodes:
-            textarray.append(transaction)
-            signarray.append(signatures)
-            txcodes.append(trandata['transaction']['trans_code'])
-            try:
-                os.remove(file)
-            except:
-                logger.log("Couldn't delete:",file)
-        block_height += 1
-        if block_height >= MAX_BLOCK_SIZE:
-            logger.log(
-                "Reached max block height, moving forward with the collected transactions")
-            break
+    # Drop what earlier blocks already include before looking at any candidate
+    included = get_included_transaction_codes(cur, mempool.get_transaction_codes())
+    if included:
+        logger.log(f"Removing {len(included)} already included transactions from mempool")
+        mempool.remove(included, 'included')
+
+    selected = set()
+    block_size = 0
+    with contextlib.closing(get_selection_policy()(mempool)) as candidates:
+        while len(txcodes) < MAX_BLOCK_TRANSACTIONS:
+            # Signatures of the next candidates are verified together, the economics one by one below
+            batch = _next_candidates(mempool, candidates, MAX_BLOCK_TRANSACTIONS - len(txcodes),
+                                     selected, MAX_BLOCK_SIZE_BYTES - block_size)
+            if not batch:
+                break
+            managers = []
+            for transaction_file_data in batch:
+                transaction_manager = Transactionmanager()
+                transaction_manager.set_transaction_data(transaction_file_data)
+                managers.append(transaction_manager)
+            signatures_valid = verify_transactions_signatures(managers)
+
+            for transaction_manager, signature_valid in zip(managers, signatures_valid):
+                transaction = transaction_manager.transaction
+                transaction_code = transaction['trans_code']
+                transaction_size = mempool.get_size(transaction_manager.get_transaction_complete())
+                if block_size + transaction_size > MAX_BLOCK_SIZE_BYTES:
+                    continue
+                logger.log("Processing ", transaction_code)
+
+                if not signature_valid:
+                    logger.log(f"Transaction id {transaction_code} has invalid signatures")
+                    mempool.remove([transaction_code], 'invalid')
+                    continue
+                if not transaction_manager.econvalidator():
+                    logger.log("Economic validation failed for transaction ", transaction_code)
+                    mempool.remove([transaction_code], 'invalid')
+                    continue
+
+                # Stays in the mempool until the block is committed, so its debit still
+                # counts when the transactions after it are validated
+                textarray.append(transaction)
+                signarray.append(transaction_manager.signatures)
+                txcodes.append(transaction_code)
+                block_size += transaction_size
+                if len(txcodes) >= MAX_BLOCK_TRANSACTIONS:
+                    logger.log(
+                        "Reached max block transactions, moving forward with the collected transactions")
+                    break
 
     transactionsdata = {"transactions": textarray, "signatures": signarray}
     if len(textarray) > 0:
@@ -96,15 +98,24 @@ def run_updater():
         logger.log("Time since last block: ", time_diff, " seconds")
         if time_diff < TIME_BETWEEN_BLOCKS_SECONDS * 1000:  # TODO - Change the block time limit
             logger.log("No new transactions, not enough time since last block. Exiting.")
+            cur.close()
             return logger.get_logs()
         else:
             logger.log(f"More than {TIME_BETWEEN_BLOCKS_SECONDS} seconds since the last block. Adding a new empty one.")
 
     print(transactionsdata)
-    block = blockchain.mine_block(cur, transactionsdata)
-    update_db_states(cur, block['index'], transactionsdata['transactions'])
-    con.commit()
-    con.close()
+    try:
+        block = blockchain.mine_block(cur, transactionsdata)
+        update_db_states(cur, block['index'], transactionsdata['transactions'])
+        store_block(cur, block['index'])
+        prune_chain(cur, block['index'])
+        con.commit()
+    except Exception:
+        con.rollback()
+        raise
+    finally:
+        cur.close()
+    on_block_committed(block['index'])
 
     # Generate and add a single receipt to the block of mining node
     # block_receipt = generate_block_receipt(block)
@@ -115,6 +126,25 @@ def run_updater():
 
     return logger.get_logs()
 
+def _next_candidates(mempool, candidates, count, selected, space):
+    """Up to count candidates not yet selected that each fit in space bytes"""
+    batch = []
+    if count <= 0:
+        return batch
+    for transaction_file_data in candidates:
+        transaction_code = transaction_file_data['transaction']['trans_code']
+        if transaction_code in selected:
+            continue
+        if mempool.get_size(transaction_file_data) > space:
+            # Does not fit, a smaller one further down might
+            continue
+        selected.add(transaction_code)
+        batch.append(transaction_file_data)
+        if len(batch) >= count:
+            break
+    return batch
+
+
 def broadcast_block(block):
     peers = get_peers()
 
@@ -2,28 +2,74 @@
 
 import base64
 import datetime
+import functools
 import json
 import logging
 
-import ecdsa
 import os
 
 from app.codes.p2p.transport import send
 from .blockchain import get_last_block_hash
-from .transactionmanager import Transactionmanager
-from ..constants import MEMPOOL_PATH
-from .p2p.outgoing import propogate_transaction_to_peers
+from .db_manager import get_cursor, get_read_connection
+from .db_updater import get_included_transaction_codes
+from .encoding import signing_encode
+from .signature_verifier import verify_signature, verify_signatures
+from .transactionmanager import Transactionmanager, verify_transactions_signatures
+from .fs.mempool_manager import MempoolBudgetExceeded, get_mempool, is_fee_valid
+from .p2p.outgoing import propogate_transaction_to_peers, propogate_transactions_to_peers
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def validate(transaction):
+def is_transaction_included(transaction_code):
+    cur = get_cursor()
+    included = get_included_transaction_codes(cur, [transaction_code])
+    cur.close()
+    return bool(included)
+
+
+def get_budget_check(error):
+    """Check for a transaction refused by the mempool budgets, retry_after is in seconds"""
+    return {'valid': False, 'msg': str(error), 'retry_after': error.retry_after}
+
+
+def validate(transaction, source=None):
+    """Validate a transaction and add it to the mempool
+
+    source is the address of the peer or client that sent it, used for its
+    mempool byte budget.
+    """
     transaction_manager = Transactionmanager()
     transaction_manager.set_transaction_data(transaction)
-    economics_valid = transaction_manager.econvalidator()
+    if not is_fee_valid(transaction_manager.transaction.get('fee')):
+        check = {'valid': False, 'msg': 'Invalid fee'}
+        print(check)
+        return check
+    if is_transaction_included(transaction_manager.transaction['trans_code']):
+        check = {'valid': False, 'msg': 'Transaction already included in a block'}
+        print(check)
+        return check
+    mempool = get_mempool()
     signatures_valid = transaction_manager.verifytransigns()
+    if signatures_valid and mempool.contains(transaction_manager.transaction['trans_code']):
+        # Already pending and propagated when it first arrived
+        check = {'valid': True, 'msg': 'All well'}
+        print(check)
+        return check
+
+    transaction_code = None
+    if signatures_valid:
+        # The balance check and the add are one step, so concurrent spends of the same funds cannot both get in
+        try:
+            transaction_code = mempool.admit(transaction_manager.get_transaction_complete(),
+                                             transaction_manager.econvalidator, source)
+        except MempoolBudgetExceeded as e:
+            check = get_budget_check(e)
+            print(check)
+            return check
+    economics_valid = transaction_code is not None
     valid = False
     if economics_valid and signatures_valid:
         msg = "All well"
@@ -35,9 +81,6 @@ def validate(transaction):
     check = {'valid': valid, 'msg': msg}
 
     if valid:  # Economics and signatures are both valid
-        transaction_file = f"{MEMPOOL_PATH}transaction-{transaction_manager.transaction['type']}-{transaction_manager.transaction['trans_code']}.json"
-        transaction_manager.save_transaction_to_mempool(transaction_file)
-
         # Broadcast transaction to peers
         propogate_transaction_to_peers(transaction_manager.get_transaction_complete())
 
@@ -55,16 +98,102 @@ def validate(transaction):
     return check
 
 
-def validate_signature(data, public_key, signature):
-    public_key_bytes = base64.b64decode(public_key)
-    sign_trans_bytes = base64.decodebytes(signature.encode('utf-8'))
-    vk = ecdsa.VerifyingKey.from_string(
-        public_key_bytes, curve=ecdsa.SECP256k1)
-    message = json.dumps(data).encode()
+def validate_transactions(transactions, source=None):
+    """Validate a batch of transactions and return a check per transaction, in order
+
+    Inclusion in the chain is looked up for the whole batch at once. The balance
+    checks read through one cursor on the read-only connection, in batch order,
+    so a transaction spending funds already spent by an earlier one in the batch
+    is rejected. They do not share a snapshot: balances older than the pending
+    debits they are checked against would miss transactions committed since.
+    Accepted transactions are broadcast together.
+    """
+    checks = [None] * len(transactions)
+    managers = {}
+    batch_codes = set()
+    for index, transaction in enumerate(transactions):
+        transaction_manager = Transactionmanager()
+        try:
+            transaction_manager.set_transaction_data(transaction)
+        except Exception as e:
+            checks[index] = {'valid': False, 'msg': f'Invalid transaction: {e}'}
+            continue
+        if not is_fee_valid(transaction_manager.transaction.get('fee')):
+            checks[index] = {'valid': False, 'msg': 'Invalid fee'}
+            continue
+        transaction_code = transaction_manager.transaction['trans_code']
+        if transaction_code in batch_codes:
+            checks[index] = {'valid': False, 'msg': 'Duplicate transaction in batch'}
+            continue
+        batch_codes.add(transaction_code)
+        managers[index] = transaction_manager
+
+    cur = get_cursor()
+    included = get_included_transaction_codes(
+        cur, [manager.transaction['trans_code'] for manager in managers.values()])
+    cur.close()
+    for index, transaction_manager in list(managers.items()):
+        if transaction_manager.transaction['trans_code'] in included:
+            checks[index] = {'valid': False, 'msg': 'Transaction already included in a block'}
+            del managers[index]
+    signatures_valid = verify_transactions_signatures(list(managers.values()))
+    for index, valid in zip(list(managers), signatures_valid):
+        if not valid:
+            checks[index] = {'valid': False, 'msg': 'Invalid signatures'}
+            del managers[index]
+
+    mempool = get_mempool()
+    accepted = set()
+    cur = get_read_connection().cursor()
     try:
-        return vk.verify(sign_trans_bytes, message)
-    except:
-        return False
+        for index, transaction_manager in managers.items():
+            transaction_code = transaction_manager.transaction['trans_code']
+            if mempool.contains(transaction_code):
+                checks[index] = {'valid': True, 'msg': 'All well'}
+                continue
+            try:
+                if mempool.admit(transaction_manager.get_transaction_complete(),
+                                 functools.partial(transaction_manager.econvalidator, cur), source) is None:
+                    checks[index] = {'valid': False, 'msg': 'Economic validation failed'}
+                    continue
+            except MempoolBudgetExceeded as e:
+                checks[index] = get_budget_check(e)
+                continue
+            checks[index] = {'valid': True, 'msg': 'All well'}
+            accepted.add(transaction_code)
+    finally:
+        cur.close()
+
+    # Capacity eviction can push out batch members admitted earlier
+    accepted_transactions = []
+    for index, transaction_manager in managers.items():
+        transaction_code = transaction_manager.transaction['trans_code']
+        if transaction_code not in accepted:
+            continue
+        if mempool.contains(transaction_code):
+            accepted_transactions.append(transaction_manager.get_transaction_complete())
+        else:
+            checks[index] = {'valid': False, 'msg': 'Mempool is full and the fee rate is too low'}
+
+    if accepted_transactions:
+        propogate_transactions_to_peers(accepted_transactions)
+        try:
+            send({'operation': 'send_transactions', 'data': accepted_transactions})
+        except:
+            print('Error sending transactions to transport server')
+
+    print(f'Validated {len(transactions)} transactions, accepted {len(accepted_transactions)}')
+    return checks
+
+
+def get_signature_item(data, public_key, signature):
+    """(message, public key bytes, signature bytes) as taken by the signature verifier"""
+    return (signing_encode(data), base64.b64decode(public_key),
+            base64.decodebytes(signature.encode('utf-8')))
+
+
+def validate_signature(data, public_key, signature):
+    return verify_signature(*get_signature_item(data, public_key, signature))
 
 
 def validate_receipt_signature(receipt):
@@ -79,13 +208,27 @@ def get_node_trust_score(public_key):
     # TODO - Return the actual trust score of the node by lookup on public_key
     return 1
 
+def validate_receipt_signatures(receipts):
+    """Verify the signatures of several receipts in one batch, a bool per receipt"""
+    items = []
+    for receipt in receipts:
+        try:
+            items.append(get_signature_item(receipt['data'], receipt['public'], receipt['signature']))
+        except:
+            logger.error('Error validating receipt signature')
+            items.append(None)
+    results = iter(verify_signatures([item for item in items if item is not None]))
+    return [item is not None and next(results) for item in items]
+
+
 def validate_block_receipts(block):
     total_receipt_count = 0
     postitive_receipt_count = 0
-    for receipt in block['receipts']:
+    signatures_valid = validate_receipt_signatures(block['receipts'])
+    for receipt, signature_valid in zip(block['receipts'], signatures_valid):
         total_receipt_count += 1
 
-        if not validate_receipt_signature(receipt):
+        if not signature_valid:
             continue
 
         if receipt['data']['block_index'] != block['index'] or receipt['data']['block_hash'] != block['hash'] or receipt['data']['vote'] < 1:
@@ -0,0 +1,102 @@
+"""Validation verdicts shared between admission, relays and block assembly
+
+Verdicts are keyed by a hash of the transaction and its signatures, so a
+transaction sent again with other content or signatures is checked afresh.
+
+Valid signatures stay valid. Wallet keys never change once created, so a
+signature verdict is kept until the chain is reverted.
+
+A transfer's economic verdict depends on the balances it spends from and the
+debits of the other pending transactions on them. It is kept with the state
+version of each balance it read and the pending debits it counted. It holds
+while no committed block has touched those balances and the pending debits
+have not grown. State versions are bumped after a block commits, and read
+before a check runs, so a check racing a commit is recorded against the
+older version and is redone.
+
+Only valid verdicts are cached; invalid transactions leave the mempool anyway.
+"""
+import collections
+import threading
+
+from ..constants import VERDICT_CACHE_SIZE
+
+
+_signature_verdicts = collections.OrderedDict()  # verdict key -> True
+_economics_verdicts = collections.OrderedDict()  # verdict key -> [((wallet, tokencode), version, pending debit)]
+_state_versions = collections.Counter()  # (wallet, tokencode) -> version
+_staged_changes = {}  # block index -> (wallet, tokencode) keys it changed
+_lock = threading.Lock()
+
+
+def _state_key(wallet_address, tokencode):
+    return (wallet_address, str(tokencode))
+
+
+def _remember(verdicts, key, value):
+    with _lock:
+        verdicts[key] = value
+        verdicts.move_to_end(key)
+        while len(verdicts) > VERDICT_CACHE_SIZE:
+            verdicts.popitem(last=False)
+
+
+def is_signature_verdict_valid(key):
+    return key in _signature_verdicts
+
+
+def set_signature_verdict(key):
+    _remember(_signature_verdicts, key, True)
+
+
+def get_state_versions(balances):
+    """Current versions of [(wallet, tokencode)], to read before checking against them"""
+    with _lock:
+        return [_state_versions[_state_key(*balance)] for balance in balances]
+
+
+def is_economics_verdict_valid(key, get_pending_debit):
+    """Whether a valid economic verdict still holds
+
+    get_pending_debit(wallet, tokencode) gives the debits pending on a balance
+    from other transactions.
+    """
+    with _lock:
+        dependencies = _economics_verdicts.get(key)
+        if dependencies is None:
+            return False
+        if any(_state_versions[balance] != version for balance, version, _ in dependencies):
+            del _economics_verdicts[key]
+            return False
+    return all(get_pending_debit(*balance) <= pending for balance, _, pending in dependencies)
+
+
+def set_economics_verdict(key, balances, versions, pending_debits):
+    """Remember a valid economic verdict read at versions, counting pending_debits, one per balance"""
+    _remember(_economics_verdicts, key, [
+        (_state_key(*balance), version, pending)
+        for balance, version, pending in zip(balances, versions, pending_debits)
+    ])
+
+
+def stage_state_changes(block_index, balances):
+    """Hold the (wallet, tokencode) balances a block changed until it is committed"""
+    with _lock:
+        _staged_changes[block_index] = [_state_key(*balance) for balance in balances]
+
+
+def apply_state_changes(block_index):
+    """Invalidate the economic verdicts that read balances changed by a committed block"""
+    with _lock:
+        for staged_index in [index for index in _staged_changes if index <= block_index]:
+            changes = _staged_changes.pop(staged_index)
+            if staged_index == block_index:
+                _state_versions.update(changes)
+
+
+def clear_verdicts():
+    """Forget every verdict, for when the chain is reverted"""
+    with _lock:
+        _signature_verdicts.clear()
+        _economics_verdicts.clear()
+        _staged_changes.clear()
@@ -11,6 +11,8 @@ TMP_PATH = DATA_PATH + 'tmp/'
 INCOMING_PATH = DATA_PATH + 'tmp/incoming/'
 NEWRL_DB = DATA_PATH + 'newrl.db'
 NEWRL_P2P_DB = DATA_PATH + 'newrl_p2p.db'
+BLOCK_STORE_PATH = DATA_PATH + 'blocks/'
+CHECKPOINTS_PATH = DATA_PATH + 'checkpoints/'
 STATE_FILE = 'state.json'
 CHAIN_FILE = 'chain.json'
 ALLOWED_CUSTODIANS_FILE = 'allowed_custodians.json'
@@ -25,6 +27,42 @@ TREASURY = "treasury_address"
 COINBASE_SC = "coinbase_sc_address"
 TRANSPORT_SERVER = 'http://localhost:8095'
 
+# SQLite connection tuning, applied to every pooled connection
+DB_BUSY_TIMEOUT_MS = 5000
+DB_CACHE_SIZE_KB = 64000  # Page cache per connection
+DB_MMAP_SIZE_BYTES = 256 * 1024 * 1024
+DB_SYNCHRONOUS = 'NORMAL'  # Durable across app crashes in WAL mode, fsync only on checkpoint
+BLOCK_HEIGHT_HEADER = 'X-Newrl-Block-Height'  # Block height a read response reflects
+BLOCK_SEGMENT_MAX_BYTES = 64 * 1024 * 1024  # Block store segment files roll over at this size
+PRUNED_HEADER = 'X-Newrl-Pruned'  # Set to true by nodes that dropped old transaction bodies
+PRUNE_DEPTH_HEADER = 'X-Newrl-Prune-Depth'
+STATE_CHECKPOINT_INTERVAL = 100  # Blocks between state checkpoints used by revert
+STATE_CHECKPOINTS_TO_KEEP = 10
+MEMPOOL_JOURNAL_FILE = 'journal.log'
+MEMPOOL_JOURNAL_FSYNC_RECORDS = 100  # fsync the mempool journal after this many records
+MEMPOOL_JOURNAL_FSYNC_SECONDS = 1  # or once this much time has passed since the last fsync
+MEMPOOL_JOURNAL_COMPACT_MIN_RECORDS = 1000
+MAX_BLOCK_TRANSACTIONS = 10
+MAX_BLOCK_SIZE_BYTES = 1024 * 1024  # Serialized size of the transactions in a block
+BLOCK_SELECTION_POLICY = 'fee_rate'  # One of mempool_manager.SELECTION_POLICIES
+MEMPOOL_MAX_TRANSACTIONS = 10000
+MEMPOOL_MAX_BYTES = 64 * 1024 * 1024
+MEMPOOL_MAX_BYTES_PER_SENDER = 1024 * 1024  # Pending bytes a single wallet may hold in the mempool
+MEMPOOL_MAX_BYTES_PER_PEER = 8 * 1024 * 1024  # Pending bytes a single peer or client may submit
+MEMPOOL_TRANSACTION_TTL_SECONDS = 24 * 60 * 60
+MEMPOOL_MAX_AGE_BLOCKS = 2  # With peers, drop transactions received before the block this many back
+MEMPOOL_SWEEP_INTERVAL_SECONDS = 60
+MEMPOOL_SHORT_ID_BYTES = 6  # Salted short transaction ids used for mempool reconciliation
+EVENT_QUEUE_SIZE = 1000  # Events an event stream subscriber may fall behind before it is dropped
+EVENT_KEEPALIVE_SECONDS = 15
+CRYPTO_PROVIDER = os.environ.get('NEWRL_CRYPTO_PROVIDER', 'auto')  # ecdsa, coincurve or auto
+SIGNATURE_VERIFY_WORKERS = os.cpu_count() or 1  # Processes verifying signature batches, 0 to verify inline
+SIGNATURE_VERIFY_MIN_BATCH = 8  # Smaller batches are verified inline
+VERIFYING_KEY_CACHE_SIZE = 4096  # Parsed public keys kept per process
+VERIFYING_KEY_PRECOMPUTE_USES = 4  # Precompute tables for a key once it has verified this many signatures
+PUBLIC_KEY_CACHE_SIZE = 4096  # Wallet public keys kept by address
+VERDICT_CACHE_SIZE = 100000  # Signature and economic validation verdicts kept, each
+
 TIME_BETWEEN_BLOCKS_SECONDS = 30  # The time period between blocks
 COMMITTEE_SIZE = 6
 MINIMUM_ACCEPTANCE_VOTES = 4
@@ -6,12 +6,18 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.codes.p2p.sync_chain import sync_chain_from_peers
+from app.codes.p2p.sync_mempool import sync_mempool_transactions
 
 from .constants import NEWRL_PORT
 from .codes.p2p.peers import init_bootstrap_nodes, update_my_address, update_software
 from .codes.clock.global_time import start_mining_clock, update_time_difference
+from .codes.pruning import init_pruning
+from .codes.fs.mempool_manager import get_mempool
+from .codes.mempool_sweeper import start_mempool_sweeper
+from .codes.signature_verifier import shutdown_verifier
 
 from .routers import blockchain
+from .routers import events
 from .routers import p2p
 from .routers import transport
 
@@ -23,6 +29,7 @@ parser = argparse.ArgumentParser()
 parser.add_argument("--disablenetwork", help="run the node local only with no network connection", action="store_true")
 parser.add_argument("--disableupdate", help="run the node without updating software", action="store_true")
 parser.add_argument("--disablebootstrap", help="run the node without bootstrapping", action="store_true")
+parser.add_argument("--prune-depth", type=int, help="drop transaction bodies older than this many blocks")
 args = parser.parse_args()
 
 app = FastAPI(
@@ -41,11 +48,14 @@ app.add_middleware(
 )
 
 app.include_router(blockchain.router)
+app.include_router(events.router)
 app.include_router(p2p.router)
 app.include_router(transport.router)
 
 @app.on_event('startup')
 def app_startup():
+    init_pruning(args.prune_depth)
+    start_mempool_sweeper()
     try:
         if not args.disablenetwork:
             if not args.disableupdate:
@@ -53,6 +63,7 @@ def app_startup():
             if not args.disablebootstrap:
                 init_bootstrap_nodes()
             sync_chain_from_peers()
+            sync_mempool_transactions()
         update_time_difference()
         update_my_address()
         # start_mining_clock()
@@ -60,6 +71,12 @@ def app_startup():
         print('Bootstrap failed')
         logging.critical(e, exc_info=True)
 
+
+@app.on_event('shutdown')
+def app_shutdown():
+    get_mempool().journal.close()
+    shutdown_verifier()
+
 if __name__ == "__main__":
     uvicorn.run("app.main:app", host="0.0.0.0", port=NEWRL_PORT, reload=True)
 
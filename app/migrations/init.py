@@ -1,5 +1,5 @@
 import os
-from ..constants import INCOMING_PATH, MEMPOOL_PATH, TMP_PATH, DATA_PATH
+from ..constants import BLOCK_STORE_PATH, CHECKPOINTS_PATH, INCOMING_PATH, MEMPOOL_PATH, TMP_PATH, DATA_PATH
 from ..migrations.init_db import init_db, init_trust_db
 from ..migrations.migrate_db import run_migrations
 
@@ -13,6 +13,10 @@ def init_newrl():
         os.mkdir(TMP_PATH)
     if not os.path.exists(INCOMING_PATH):
         os.mkdir(INCOMING_PATH)
+    if not os.path.exists(BLOCK_STORE_PATH):
+        os.mkdir(BLOCK_STORE_PATH)
+    if not os.path.exists(CHECKPOINTS_PATH):
+        os.mkdir(CHECKPOINTS_PATH)
 
     # clear_db()
     init_db()
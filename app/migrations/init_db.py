@@ -1,26 +1,32 @@
-import sqlite3
-import json
-
-from ..codes.state_updater import update_state_from_transaction
+from ..codes.db_manager import get_connection
+from ..codes.fs.block_store import clear_block_store, init_block_store
+from ..codes.checkpoints import clear_checkpoints, revert_state
+from ..codes.state_tree import init_state_tree
+from ..codes.verdict_cache import clear_verdicts
+from ..codes.signature_verifier import clear_wallet_public_keys
 from ..constants import NEWRL_DB
 
 db_path = NEWRL_DB
 
 def clear_db():
-    con = sqlite3.connect(db_path)
+    con = get_connection(db_path)
     cur = con.cursor()
     cur.execute('DROP TABLE IF EXISTS wallets')
     cur.execute('DROP TABLE IF EXISTS tokens')
-    cur.execute('DROP TABLE IF EXISTS balances')
+    drop_balances(cur)
     cur.execute('DROP TABLE IF EXISTS blocks')
     cur.execute('DROP TABLE IF EXISTS transactions')
     cur.execute('DROP TABLE IF EXISTS transfers')
     cur.execute('DROP TABLE IF EXISTS contracts')
+    clear_block_store(cur)
     con.commit()
-    con.close()
+    clear_checkpoints()
+    clear_wallet_public_keys()
+    clear_verdicts()
+    cur.close()
 
 def init_db():
-    con = sqlite3.connect(db_path)
+    con = get_connection(db_path)
     cur = con.cursor()
     cur.execute('''
                     CREATE TABLE IF NOT EXISTS wallets
@@ -51,12 +57,7 @@ def init_db():
                     token_attributes text)
                     ''')
 
-    cur.execute('''
-                    CREATE TABLE IF NOT EXISTS balances
-                    (wallet_address text, 
-                    tokencode text,
-                    balance real, UNIQUE (wallet_address, tokencode))
-                    ''')
+    init_balances(cur)
 
     cur.execute('''
                     CREATE TABLE IF NOT EXISTS blocks
@@ -65,7 +66,8 @@ def init_db():
                     proof integer,
                     previous_hash text,
                     hash text,
-                    transactions_hash text)
+                    transactions_hash text,
+                    state_root text)
                     ''')
 
     cur.execute('''
@@ -79,7 +81,8 @@ def init_db():
                     fee real,
                     description text,
                     valid integer,
-                    specific_data text)
+                    specific_data text,
+                    transaction_hash text)
                     ''')
 
     cur.execute('''
@@ -111,12 +114,62 @@ def init_db():
                     legalparams TEXT)
                     ''')
 
+    init_block_store(cur)
+
     con.commit()
-    con.close()
+    cur.close()
+
+
+def init_balances(cur):
+    """Balances keyed by interned wallet and token ids, in integer minor units"""
+    cur.execute('''
+                    CREATE TABLE IF NOT EXISTS wallet_ids
+                    (id integer PRIMARY KEY,
+                    wallet_address text NOT NULL UNIQUE)
+                    ''')
+
+    cur.execute('''
+                    CREATE TABLE IF NOT EXISTS token_ids
+                    (id integer PRIMARY KEY,
+                    tokencode text NOT NULL UNIQUE)
+                    ''')
+
+    cur.execute('''
+                    CREATE TABLE IF NOT EXISTS balances_store
+                    (wallet_id integer NOT NULL,
+                    token_id integer NOT NULL,
+                    balance integer NOT NULL,
+                    PRIMARY KEY (wallet_id, token_id)) WITHOUT ROWID
+                    ''')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_balances_store_token_id ON balances_store (token_id)')
+
+    # Compatibility view with the columns of the former balances table.
+    # Does nothing on a not yet migrated db, where balances is still a table.
+    cur.execute('''
+                    CREATE VIEW IF NOT EXISTS balances AS
+                    SELECT wallet_ids.wallet_address, token_ids.tokencode, balances_store.balance
+                    FROM balances_store
+                    JOIN wallet_ids ON wallet_ids.id = balances_store.wallet_id
+                    JOIN token_ids ON token_ids.id = balances_store.token_id
+                    ''')
+
+    init_state_tree(cur)
+
+
+def drop_balances(cur):
+    balances = cur.execute("SELECT type FROM sqlite_master WHERE name = 'balances'").fetchone()
+    if balances is not None and balances[0] == 'view':
+        cur.execute('DROP VIEW balances')
+    else:
+        cur.execute('DROP TABLE IF EXISTS balances')
+    cur.execute('DROP TABLE IF EXISTS balances_store')
+    cur.execute('DROP TABLE IF EXISTS wallet_ids')
+    cur.execute('DROP TABLE IF EXISTS token_ids')
+    cur.execute('DROP TABLE IF EXISTS state_tree')
 
 
 def init_trust_db():
-    con = sqlite3.connect(db_path)
+    con = get_connection(db_path)
     cur = con.cursor()
     cur.execute('''
                     CREATE TABLE IF NOT EXISTS kyc
@@ -149,37 +202,15 @@ def init_trust_db():
                     ''')
 
     con.commit()
-    con.close()
+    cur.close()
 
 
 def revert_chain(block_index):
     """Revert chain to given index"""
     print('Reverting chain to index ', block_index)
-    con = sqlite3.connect(NEWRL_DB)
-    cur = con.cursor()
-    cur.execute(f'DELETE FROM blocks WHERE block_index > {block_index}')
-    cur.execute(f'DELETE FROM transactions WHERE block_index > {block_index}')
-    cur.execute('DROP TABLE wallets')
-    cur.execute('DROP TABLE tokens')
-    cur.execute('DROP TABLE balances')
-    con.commit()
-
-    init_db()
-
-    transactions_cursor = cur.execute(f'SELECT transaction_code, block_index, type, timestamp, specific_data FROM transactions WHERE block_index <= {block_index}').fetchall()
-    for transaction in transactions_cursor:
-        transaction_code = transaction[0]
-        block_index = transaction[1]
-        transaction_type = transaction[2]
-        timestamp = transaction[3]
-        specific_data = transaction[4]
-        while isinstance(specific_data, str):
-            specific_data = json.loads(specific_data)
-
-        update_state_from_transaction(cur, transaction_type, specific_data, transaction_code, timestamp)
-
-    con.commit()
-    con.close()
+    if not revert_state(block_index):
+        # State is rebuilt by replaying transaction bodies, which a pruned node no longer has
+        return {'status': 'FAILURE', 'reason': 'Blocks after the nearest checkpoint are pruned. Resync from an archive peer.'}
     return {'status': 'SUCCESS'}
 
 if __name__ == '__main__':
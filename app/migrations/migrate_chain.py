@@ -1,12 +1,12 @@
 import json
-import sqlite3
 import hashlib
 
+from ..codes.db_manager import get_connection
 from ..constants import NEWRL_DB
 
 
 def migrate_chain(chain_file_path):
-    con = sqlite3.connect(NEWRL_DB)
+    con = get_connection(NEWRL_DB)
 
     cur = con.cursor()
 
@@ -47,7 +47,7 @@ def migrate_chain(chain_file_path):
                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', db_transaction_data)
 
     con.commit()
-    con.close()
+    cur.close()
 
 import sys
 
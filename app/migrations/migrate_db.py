@@ -8,7 +8,9 @@ db_path = NEWRL_DB
 
 def run_migrations():
     migrations = os.listdir(DB_MIGRATIONS_PATH)
-    migrations = filter(lambda migration: '.py' in migration, migrations)
+    migrations = filter(lambda migration: migration.endswith('.py'), migrations)
+    # Migrations are numbered and must run in order
+    migrations = sorted(migrations, key=lambda migration: int(migration.split('_')[0]))
     for migration in migrations:
         print(migration)
         migration = migration.replace('.py', '')
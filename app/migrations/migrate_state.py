@@ -1,11 +1,13 @@
 import json
-import sqlite3
 
+from ..codes.db_manager import get_connection
+from ..codes.db_updater import update_wallet_token_balance
+from ..codes.state_view import StateView
 from ..constants import NEWRL_DB
 
 
 def migrate_state(state_file_name):
-  con = sqlite3.connect(NEWRL_DB)
+  con = get_connection(NEWRL_DB)
 
   cur = con.cursor()
 
@@ -32,13 +34,13 @@ def migrate_state(state_file_name):
     (tokencode, tokenname, tokentype, first_owner, custodian, legaldochash, amount_created, value_created, sc_flag, token_attributes)
     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', db_token_data)
 
+  state = StateView(cur)
   for balance in state_data['all_balances']:
-    db_balance_data = (balance['wallet_address'], balance['tokencode'], balance['balance'])
-    cur.execute(f'''INSERT OR REPLACE INTO balances
-        (wallet_address, tokencode, balance) VALUES (?, ?, ?)''', db_balance_data)
+    update_wallet_token_balance(state, balance['wallet_address'], balance['tokencode'], balance['balance'])
+  state.flush()
 
   con.commit()
-  con.close()
+  cur.close()
 
 import sys
 
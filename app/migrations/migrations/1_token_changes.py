@@ -1,11 +1,10 @@
-import sqlite3
-
+from ...codes.db_manager import get_connection
 from ...constants import NEWRL_DB
 
 
 def migrate():
     print('Running migration ' + __file__)
-    con = sqlite3.connect(NEWRL_DB)
+    con = get_connection(NEWRL_DB)
     # con.row_factory = sqlite3.Row
     cur = con.cursor()
     cur.execute('''
@@ -37,7 +36,7 @@ def migrate():
     cur.execute('DROP TABLE tokens')
     cur.execute('ALTER TABLE _tokens RENAME TO tokens')
     con.commit()
-    con.close()
+    cur.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,27 @@
+from ...codes.db_manager import get_connection
+from ...constants import NEWRL_DB
+
+
+def migrate():
+    print('Running migration ' + __file__)
+    con = get_connection(NEWRL_DB)
+    cur = con.cursor()
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_transactions_block_index ON transactions (block_index)')
+    balances_type = cur.execute("SELECT type FROM sqlite_master WHERE name = 'balances'").fetchone()
+    if balances_type is not None and balances_type[0] == 'table':
+        # Superseded by the index on balances_store once migration 4 has run
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_balances_tokencode ON balances (tokencode)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_person_wallet_wallet_id ON person_wallet (wallet_id)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_contracts_address ON contracts (address)')
+
+    # Keep only the latest score per person pair so the unique index can be built
+    cur.execute('''DELETE FROM trust_scores WHERE rowid NOT IN
+                (SELECT MAX(rowid) FROM trust_scores GROUP BY src_person_id, dest_person_id)''')
+    cur.execute('''CREATE UNIQUE INDEX IF NOT EXISTS idx_trust_scores_src_dest
+                ON trust_scores (src_person_id, dest_person_id)''')
+    con.commit()
+    cur.close()
+
+
+if __name__ == '__main__':
+    migrate()
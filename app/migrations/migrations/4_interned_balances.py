@@ -0,0 +1,33 @@
+from ...codes.db_manager import get_connection
+from ...codes.db_updater import to_minor_units
+from ...constants import NEWRL_DB
+from ..init_db import init_balances
+
+
+def migrate():
+    print('Running migration ' + __file__)
+    con = get_connection(NEWRL_DB)
+    cur = con.cursor()
+    balances_type = cur.execute("SELECT type FROM sqlite_master WHERE name = 'balances'").fetchone()
+    if balances_type is None or balances_type[0] != 'table':
+        cur.close()
+        return
+
+    cur.execute('ALTER TABLE balances RENAME TO _balances')
+    init_balances(cur)
+    cur.execute('INSERT OR IGNORE INTO wallet_ids (wallet_address) SELECT DISTINCT wallet_address FROM _balances')
+    cur.execute('INSERT OR IGNORE INTO token_ids (tokencode) SELECT DISTINCT tokencode FROM _balances')
+    # Converted with to_minor_units, as balances written at runtime are, so both give the same state root
+    balances = cur.execute('''SELECT wallet_ids.id, token_ids.id, _balances.balance
+                FROM _balances
+                JOIN wallet_ids ON wallet_ids.wallet_address = _balances.wallet_address
+                JOIN token_ids ON token_ids.tokencode = _balances.tokencode''').fetchall()
+    cur.executemany('INSERT OR REPLACE INTO balances_store (wallet_id, token_id, balance) VALUES (?, ?, ?)',
+                    [(wallet_id, token_id, to_minor_units(balance)) for wallet_id, token_id, balance in balances])
+    cur.execute('DROP TABLE _balances')
+    con.commit()
+    cur.close()
+
+
+if __name__ == '__main__':
+    migrate()
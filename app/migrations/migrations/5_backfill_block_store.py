@@ -0,0 +1,22 @@
+from ...codes.blockchain import store_block
+from ...codes.db_manager import get_connection
+from ...codes.fs.block_store import init_block_store
+from ...constants import NEWRL_DB
+
+
+def migrate():
+    print('Running migration ' + __file__)
+    con = get_connection(NEWRL_DB)
+    cur = con.cursor()
+    init_block_store(cur)
+    missing_blocks = cur.execute('''SELECT block_index FROM blocks
+        WHERE block_index NOT IN (SELECT block_index FROM block_store_index)
+        ORDER BY block_index''').fetchall()
+    for block in missing_blocks:
+        store_block(cur, block[0])
+    con.commit()
+    cur.close()
+
+
+if __name__ == '__main__':
+    migrate()
@@ -0,0 +1,22 @@
+from ...codes.blockchain import rebuild_block_store
+from ...codes.db_manager import get_connection
+from ...codes.db_updater import set_transaction_hashes
+from ...constants import NEWRL_DB
+
+
+def migrate():
+    print('Running migration ' + __file__)
+    con = get_connection(NEWRL_DB)
+    cur = con.cursor()
+    columns = [column[1] for column in cur.execute('PRAGMA table_info(transactions)')]
+    if 'transaction_hash' not in columns:
+        cur.execute('ALTER TABLE transactions ADD COLUMN transaction_hash text')
+    if set_transaction_hashes(cur):
+        # Stored blocks were serialized without the hashes, write them again
+        rebuild_block_store(cur)
+    con.commit()
+    cur.close()
+
+
+if __name__ == '__main__':
+    migrate()
@@ -0,0 +1,26 @@
+from ...codes.db_manager import get_connection
+from ...codes.state_tree import get_state_root, init_state_tree, rebuild_state_tree
+from ...constants import NEWRL_DB
+
+
+def migrate():
+    print('Running migration ' + __file__)
+    con = get_connection(NEWRL_DB)
+    cur = con.cursor()
+    columns = [column[1] for column in cur.execute('PRAGMA table_info(blocks)')]
+    if 'state_root' not in columns:
+        cur.execute('ALTER TABLE blocks ADD COLUMN state_root text')
+    init_state_tree(cur)
+    tree_empty = cur.execute('SELECT COUNT(*) FROM state_tree').fetchone()[0] == 0
+    has_balances = cur.execute('SELECT COUNT(*) FROM balances WHERE balance != 0').fetchone()[0] > 0
+    if tree_empty and has_balances:
+        rebuild_state_tree(cur)
+        # Only the current state is known, older blocks keep a NULL root
+        cur.execute('UPDATE blocks SET state_root = ? WHERE block_index = (SELECT MAX(block_index) FROM blocks)',
+                    (get_state_root(cur).hex(), ))
+    con.commit()
+    cur.close()
+
+
+if __name__ == '__main__':
+    migrate()
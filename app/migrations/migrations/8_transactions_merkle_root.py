@@ -0,0 +1,26 @@
+from ...codes.blockchain import rebuild_block_store
+from ...codes.db_manager import get_connection
+from ...codes.db_updater import get_block_transaction_hashes, set_transactions_root
+from ...codes.merkle import get_merkle_root
+from ...constants import NEWRL_DB
+
+
+def migrate():
+    print('Running migration ' + __file__)
+    con = get_connection(NEWRL_DB)
+    cur = con.cursor()
+    last_block = cur.execute('SELECT block_index, transactions_hash FROM blocks ORDER BY block_index DESC LIMIT 1').fetchone()
+    # The whole chain is migrated in one transaction, so a Merkle root on the last block means it is done
+    if last_block is None or last_block[1] == get_merkle_root(get_block_transaction_hashes(cur, last_block[0])):
+        cur.close()
+        return
+    for block in cur.execute('SELECT block_index FROM blocks ORDER BY block_index').fetchall():
+        set_transactions_root(cur, block[0])
+    # Stored blocks carry the old flat transactions hash
+    rebuild_block_store(cur)
+    con.commit()
+    cur.close()
+
+
+if __name__ == '__main__':
+    migrate()
@@ -1,8 +1,9 @@
 import json
 import logging
 from types import new_class
+from typing import List
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Request, Response
 from fastapi.datastructures import UploadFile
 from fastapi.params import File
 from fastapi import HTTPException
@@ -12,7 +13,7 @@ from starlette.responses import FileResponse
 from app.codes.transactionmanager import Transactionmanager
 
 from .request_models import AddWalletRequest, BalanceRequest, BalanceType, CallSC, CreateTokenRequest, CreateWalletRequest, GetTokenRequest, RunSmartContractRequest, TransferRequest, CreateSCRequest, TscoreRequest
-from app.codes.chainscanner import Chainscanner, download_chain, download_state, get_transaction
+from app.codes.chainscanner import Chainscanner, download_chain, download_state, get_transaction, get_transaction_proof
 from app.codes.kycwallet import add_wallet, generate_wallet_address, get_address_from_public_key, get_digest, generate_wallet
 from app.codes.tokenmanager import create_token_transaction
 from app.codes.transfermanager import Transfermanager
@@ -20,6 +21,9 @@ from app.codes.utils import save_file_and_get_path
 from app.codes import validator
 from app.codes import signmanager
 from app.codes import updater
+from app.codes.db_manager import read_snapshot
+from app.codes.state_tree import get_balance_proof, get_state_root
+from app.constants import BLOCK_HEIGHT_HEADER
 from app.codes.contracts.contract_master import create_contract_address
 
 logging.basicConfig(level=logging.DEBUG)
@@ -42,34 +46,68 @@ def run_updater():
 
 
 @router.get("/get-transaction", tags=[v2_tag])
-def get_transaction_api(transaction_code: str):
+def get_transaction_api(transaction_code: str, response: Response):
     try:
-        return get_transaction(transaction_code)
+        with read_snapshot() as (cur, block_height):
+            response.headers[BLOCK_HEIGHT_HEADER] = str(block_height)
+            return get_transaction(transaction_code, cur)
     except Exception as e:
         logger.exception(e)
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/get-transaction-proof", tags=[v2_tag])
+def get_transaction_proof_api(transaction_code: str, response: Response):
+    """Merkle audit path proving a transaction is included in its block"""
+    with read_snapshot() as (cur, block_height):
+        response.headers[BLOCK_HEIGHT_HEADER] = str(block_height)
+        proof = get_transaction_proof(transaction_code, cur)
+    if proof is None:
+        raise HTTPException(status_code=404, detail='Transaction not found')
+    return proof
+
 @router.get("/download-chain", tags=[v2_tag])
-def download_chain_api():
-    return download_chain()
+def download_chain_api(response: Response):
+    with read_snapshot() as (cur, block_height):
+        response.headers[BLOCK_HEIGHT_HEADER] = str(block_height)
+        return download_chain(cur)
 
 
 @router.get("/download-state", tags=[v2_tag])
-def download_state_api():
-    return download_state()
+def download_state_api(response: Response):
+    with read_snapshot() as (cur, block_height):
+        response.headers[BLOCK_HEIGHT_HEADER] = str(block_height)
+        return download_state(cur)
 
 
 @router.post("/get-balance", tags=[v2_tag])
-def get_balance(req: BalanceRequest):
-    chain_scanner = Chainscanner()
-    if req.balance_type == BalanceType.TOKEN_IN_WALLET:
-        balance = chain_scanner.getbaladdtoken(
-            req.wallet_address, str(req.token_code))
-    elif req.balance_type == BalanceType.ALL_TOKENS_IN_WALLET:
-        balance = chain_scanner.getbalancesbyaddress(req.wallet_address)
-    elif req.balance_type == BalanceType.ALL_WALLETS_FOR_TOKEN:
-        balance = chain_scanner.getbalancesbytoken(str(req.token_code))
-    return {'balance': balance}
+def get_balance(req: BalanceRequest, response: Response):
+    with read_snapshot() as (cur, block_height):
+        response.headers[BLOCK_HEIGHT_HEADER] = str(block_height)
+        chain_scanner = Chainscanner(cur)
+        if req.balance_type == BalanceType.TOKEN_IN_WALLET:
+            balance = chain_scanner.getbaladdtoken(
+                req.wallet_address, str(req.token_code))
+        elif req.balance_type == BalanceType.ALL_TOKENS_IN_WALLET:
+            balance = chain_scanner.getbalancesbyaddress(req.wallet_address)
+        elif req.balance_type == BalanceType.ALL_WALLETS_FOR_TOKEN:
+            balance = chain_scanner.getbalancesbytoken(str(req.token_code))
+    return {'balance': balance, 'block_height': block_height}
+
+@router.get("/get-balance-proof", tags=[v2_tag])
+def get_balance_proof_api(wallet_address: str, token_code: str, response: Response):
+    """Merkle proof of a wallet's token balance against the state root of the last block"""
+    with read_snapshot() as (cur, block_height):
+        response.headers[BLOCK_HEIGHT_HEADER] = str(block_height)
+        balance = cur.execute('SELECT balance FROM balances WHERE wallet_address = ? AND tokencode = ?',
+                              (wallet_address, token_code)).fetchone()
+        return {
+            'block_height': block_height,
+            'state_root': get_state_root(cur).hex(),
+            'wallet_address': wallet_address,
+            'token_code': token_code,
+            'balance': balance[0] if balance else 0,
+            'proof': get_balance_proof(cur, wallet_address, token_code),
+        }
 
 @router.get("/get-address-from-publickey", tags=[v2_tag])
 def get_address_from_public_key_api(public_key: str):
@@ -286,13 +324,35 @@ def sign_transaction(wallet_data: dict, transaction_data: dict):
     singed_transaction_file = signmanager.sign_transaction(wallet_data, transaction_data)
     return singed_transaction_file
 
+@router.post("/validate-transactions", tags=[v2_tag])
+def validate_transactions(transactions_data: List[dict], request: Request, response: Response):
+    """Validate a batch of transaction files, returning a result per transaction in order
+
+    Responds 429 if the mempool budgets refused every transaction that was otherwise valid.
+    """
+    try:
+        print(f'Received {len(transactions_data)} transactions')
+        checks = validator.validate_transactions(transactions_data, request.client.host if request.client else None)
+    except Exception as e:
+        logger.exception(e)
+        raise HTTPException(status_code=500, detail=str(e))
+    retry_after = max((check['retry_after'] for check in checks if 'retry_after' in check), default=None)
+    if retry_after is not None:
+        if not any(check['valid'] for check in checks):
+            raise HTTPException(status_code=429, detail=checks, headers={'Retry-After': str(retry_after)})
+        response.headers['Retry-After'] = str(retry_after)
+    return {"status": "SUCCESS", "response": checks}
+
 @router.post("/validate-transaction", tags=[v2_tag])
-def validate_transaction(transaction_data: dict):
+def validate_transaction(transaction_data: dict, request: Request):
     """Validate a given transaction file if it's included in chain"""
     try:
         print('Received transaction: ', transaction_data)
-        response = validator.validate(transaction_data)
+        response = validator.validate(transaction_data, request.client.host if request.client else None)
     except Exception as e:
         logger.exception(e)
         raise HTTPException(status_code=500, detail=str(e))
+    if 'retry_after' in response:
+        raise HTTPException(status_code=429, detail=response['msg'],
+                            headers={'Retry-After': str(response['retry_after'])})
     return {"status": "SUCCESS", "response": response}
@@ -0,0 +1,120 @@
+import asyncio
+import json
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, status
+from fastapi.exceptions import HTTPException
+from fastapi.responses import StreamingResponse
+
+from app.codes.events import EVENT_TYPES, subscribe, unsubscribe
+from app.constants import EVENT_KEEPALIVE_SECONDS
+
+
+router = APIRouter()
+
+events_tag = 'events'
+
+
+def _parse_list(value):
+    return [item.strip() for item in value.split(',') if item.strip()] if value else None
+
+
+def _check_types(types):
+    unknown = set(types or []) - set(EVENT_TYPES)
+    if unknown:
+        raise ValueError(f'Unknown event types: {sorted(unknown)}')
+    return types
+
+
+def _parse_types(types):
+    try:
+        return _check_types(_parse_list(types))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _parse_filter(message):
+    """(types, addresses) from a WebSocket filter message, raises ValueError for an invalid one"""
+    filters = json.loads(message)
+    if not isinstance(filters, dict):
+        raise ValueError('Filter must be an object')
+    for name in ('types', 'addresses'):
+        value = filters.get(name)
+        if value is not None and (not isinstance(value, list) or not all(isinstance(item, str) for item in value)):
+            raise ValueError(f'{name} must be a list of strings')
+    return _check_types(filters.get('types')), filters.get('addresses')
+
+
+@router.get("/events", tags=[events_tag])
+async def events_api(types: str = '', addresses: str = ''):
+    """Server-Sent Events stream of mempool, block and balance events
+
+    types and addresses are comma separated filters. Balance and mempool events
+    are limited to the given wallet addresses when any are given.
+    """
+    subscription = subscribe(_parse_types(types), _parse_list(addresses))
+
+    async def stream():
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.get(), EVENT_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                if event is None:
+                    yield 'event: overflow\ndata: {}\n\n'
+                    return
+                yield f"event: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+        finally:
+            unsubscribe(subscription)
+
+    return StreamingResponse(stream(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+@router.websocket("/ws/events")
+async def events_websocket(websocket: WebSocket, types: str = '', addresses: str = ''):
+    """WebSocket stream of the same events as /events
+
+    The client can change its filters at any time by sending
+    {"types": [...], "addresses": [...]}. An invalid filter is answered with an
+    error event and leaves the current filters in place. The connection is
+    refused if the types in the query are unknown.
+    """
+    try:
+        types = _check_types(_parse_list(types))
+    except ValueError as e:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(e))
+        return
+    await websocket.accept()
+    subscription = subscribe(types, _parse_list(addresses))
+
+    async def read_filters():
+        while True:
+            message = await websocket.receive_text()
+            try:
+                subscription.set_filter(*_parse_filter(message))
+            except ValueError as e:
+                await websocket.send_json({'type': 'error', 'data': {'detail': str(e)}})
+
+    reader = asyncio.ensure_future(read_filters())
+    try:
+        while not reader.done():
+            getter = asyncio.ensure_future(subscription.get())
+            done, pending = await asyncio.wait([getter, reader], timeout=EVENT_KEEPALIVE_SECONDS,
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if getter not in done:
+                getter.cancel()
+                continue
+            event = getter.result()
+            if event is None:
+                await websocket.send_json({'type': 'overflow', 'data': {}})
+                await websocket.close()
+                break
+            await websocket.send_json({'type': event['type'], 'data': event['data']})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if reader.done() and not reader.cancelled():
+            reader.exception()
+        reader.cancel()
+        unsubscribe(subscription)
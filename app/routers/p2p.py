@@ -1,17 +1,20 @@
 import sys
 import uvicorn
-from fastapi import APIRouter
+from fastapi import APIRouter, Response
 from fastapi.exceptions import HTTPException
 from starlette.requests import Request
 
 from app.codes.chainscanner import download_chain, download_state, get_transaction
 from app.codes.p2p.peers import add_peer, clear_peers, get_peers, update_software
-from app.codes.p2p.sync_chain import get_blocks, get_last_block_index, receive_block, receive_receipt, sync_chain_from_node, sync_chain_from_peers
-from app.codes.p2p.sync_mempool import get_mempool_transactions, list_mempool_transactions, sync_mempool_transactions
-from app.constants import NEWRL_PORT
+from app.codes.p2p.sync_chain import get_blocks, receive_block, receive_receipt, sync_chain_from_node, sync_chain_from_peers
+from app.codes.p2p.sync_mempool import get_mempool_digest, get_mempool_transactions, list_mempool_transactions, sync_mempool_transactions
+from app.codes.fs.mempool_manager import get_mempool
+from app.codes.db_manager import read_snapshot
+from app.codes.pruning import add_prune_headers
+from app.constants import BLOCK_HEIGHT_HEADER, NEWRL_PORT
 from app.migrations.init_db import clear_db, init_db, revert_chain
 from app.codes.p2p.peers import call_api_on_peers
-from .request_models import BlockAdditionRequest, BlockRequest, ReceiptAdditionRequest, TransactionsRequest
+from .request_models import BlockAdditionRequest, BlockRequest, MempoolDigestRequest, ReceiptAdditionRequest, TransactionsRequest
 
 
 router = APIRouter()
@@ -24,11 +27,21 @@ def list_mempool_transactions_api():
 
 @router.post("/get-mempool-transactions", tags=[p2p_tag])
 def get_mempool_transactions_api(req: TransactionsRequest):
-    return get_mempool_transactions(req.transaction_codes)
+    return get_mempool_transactions(req.transaction_codes, req.short_ids, req.salt)
+
+@router.post("/get-mempool-digest", tags=[p2p_tag])
+def get_mempool_digest_api(req: MempoolDigestRequest):
+    return get_mempool_digest(req.salt)
+
+@router.get("/get-mempool-stats", tags=[p2p_tag])
+def get_mempool_stats_api():
+    return get_mempool().get_stats()
 
 @router.post("/get-blocks", tags=[p2p_tag])
-def get_mempool_transactions_api(req: BlockRequest):
-    return get_blocks(req.block_indexes)
+def get_blocks_api(req: BlockRequest, response: Response):
+    with read_snapshot() as (cur, block_height):
+        response.headers[BLOCK_HEIGHT_HEADER] = str(block_height)
+        return get_blocks(req.block_indexes, cur)
 
 @router.post("/receive-block", tags=[p2p_tag])
 def receive_block_api(req: BlockAdditionRequest):
@@ -42,8 +55,11 @@ def receive_receipt_api(req: ReceiptAdditionRequest):
         return {'status': 'FAILURE'}
 
 @router.get("/get-last-block-index", tags=[p2p_tag])
-def get_last_block_index_api():
-    return get_last_block_index()
+def get_last_block_index_api(response: Response):
+    with read_snapshot() as (cur, block_height):
+        response.headers[BLOCK_HEIGHT_HEADER] = str(block_height)
+    add_prune_headers(response)
+    return block_height
 
 @router.post("/sync-mempool-transactions", tags=[p2p_tag])
 def sync_mempool_transactions_api():
@@ -65,20 +81,22 @@ def sync_chain_from_peers_api():
     return sync_chain_from_peers()
 
 @router.get("/get-transaction", tags=[p2p_tag])
-def get_transaction_api(transaction_code: str):
-    return get_transaction(transaction_code)
+def get_transaction_api(transaction_code: str, response: Response):
+    with read_snapshot() as (cur, block_height):
+        response.headers[BLOCK_HEIGHT_HEADER] = str(block_height)
+        return get_transaction(transaction_code, cur)
 
 @router.get("/download-chain", tags=[p2p_tag])
-def download_chain_api():
-    return download_chain()
-
-@router.get("/download-chain", tags=[p2p_tag])
-def download_chain_api():
-    return download_chain()
+def download_chain_api(response: Response):
+    with read_snapshot() as (cur, block_height):
+        response.headers[BLOCK_HEIGHT_HEADER] = str(block_height)
+        return download_chain(cur)
 
 @router.get("/download-state", tags=[p2p_tag])
-def download_state_api():
-    return download_state()
+def download_state_api(response: Response):
+    with read_snapshot() as (cur, block_height):
+        response.headers[BLOCK_HEIGHT_HEADER] = str(block_height)
+        return download_state(cur)
 
 @router.post("/clear-db-test-only", tags=[p2p_tag])
 def clear_db_api():
@@ -88,7 +106,8 @@ def clear_db_api():
     return True
 
 @router.get("/get-peers", tags=[p2p_tag])
-def get_peers_api():
+def get_peers_api(response: Response):
+    add_prune_headers(response)
     return get_peers()
 
 @router.post("/add-peer", tags=[p2p_tag])
@@ -106,10 +125,10 @@ def initiate_peer_api(address: str):
 
 @router.post("/revert-chain", tags=[p2p_tag])
 def revert_chain_api(block_index: int, propogate: bool = False):
-    revert_chain(block_index)
+    result = revert_chain(block_index)
     if propogate:
         call_api_on_peers(f'/revert-chain?block_index={block_index}')
-    return {'status': 'SUCCESS'}
+    return result
 
 @router.post("/update-software", tags=[p2p_tag])
 def update_software_api(propogate: bool = False):
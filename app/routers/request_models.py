@@ -93,6 +93,12 @@ class AddWalletRequest(BaseModel):
 
 class TransactionsRequest(BaseModel):
     transaction_codes: List[str] = []
+    short_ids: List[str] = []
+    salt: str = ''
+
+
+class MempoolDigestRequest(BaseModel):
+    salt: str
 
 
 class BlockRequest(BaseModel):
@@ -1,4 +1,6 @@
 from fastapi import APIRouter
+from fastapi.exceptions import HTTPException
+from app.codes.fs.mempool_manager import MempoolBudgetExceeded
 from app.codes.p2p.transport import receive
 
 router = APIRouter()
@@ -7,4 +9,7 @@ transport_tag = 'transport'
 
 @router.post("/receive", tags=[transport_tag])
 def recieve_api(payload: dict):
-    return receive(payload)
+    try:
+        return receive(payload)
+    except MempoolBudgetExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={'Retry-After': str(e.retry_after)})
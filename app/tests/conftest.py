@@ -2,15 +2,27 @@ import os
 import shutil
 import pytest
 
+from ..codes.db_manager import close_connections
+from ..migrations.init import init_newrl
+
 
 def setup_test_files():
     """Setup test files"""
     print('Setting up test files')
+    close_connections()
     if not os.path.exists('data_test/'):
         os.makedirs('data_test/')
     if not os.path.exists('data_test/newrl.db'):
         os.remove('data_test/newrl.db')
+    for wal_file in ('data_test/newrl.db-wal', 'data_test/newrl.db-shm'):
+        if os.path.exists(wal_file):
+            os.remove(wal_file)
+    for data_dir in ('data_test/blocks/', 'data_test/checkpoints/'):
+        if os.path.exists(data_dir):
+            shutil.rmtree(data_dir)
     shutil.copyfile('data_test/template/newrl.db', 'data_test/newrl.db')
+    # Bring the template db up to the current schema
+    init_newrl()
 
 
 @pytest.fixture(scope="session", autouse=True)
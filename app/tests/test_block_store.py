@@ -0,0 +1,33 @@
+import glob
+import sqlite3
+
+from ..codes.fs import block_store
+
+
+def make_block(block_index):
+    return {'block_index': block_index, 'text': {'transactions': [{'trans_code': 'x' * 40}]}}
+
+
+def test_prune_keeps_active_segment(tmp_path, monkeypatch):
+    folder = str(tmp_path) + '/'
+    # Two blocks to a segment
+    monkeypatch.setattr(block_store, 'BLOCK_SEGMENT_MAX_BYTES', 2 * len(str(make_block(1))) + 10)
+    cur = sqlite3.connect(':memory:').cursor()
+    block_store.init_block_store(cur)
+    for block_index in range(1, 6):
+        block_store.append_block(cur, make_block(block_index), folder)
+    assert len(glob.glob(folder + 'segment_*.dat')) == 3
+
+    # Block 3 shares a segment with block 4, which is retained
+    block_store.drop_segments_before(cur, 3, folder)
+    assert block_store.get_stored_block_indexes(cur) == [4, 5]
+    assert block_store.get_blocks(cur, [1, 2, 3], folder) == {}
+    assert sorted(glob.glob(folder + 'segment_*.dat')) == [folder + 'segment_000001.dat', folder + 'segment_000002.dat']
+
+    # The active segment stays exempt once everything is pruned, and new blocks go on after it
+    block_store.drop_segments_before(cur, 5, folder)
+    assert block_store.get_blocks(cur, [4, 5], folder) == {}
+    assert glob.glob(folder + 'segment_*.dat') == [folder + 'segment_000002.dat']
+    block_store.append_block(cur, make_block(6), folder)
+    assert block_store.get_block(cur, 6, folder) == make_block(6)
+    assert glob.glob(folder + 'segment_*.dat') == [folder + 'segment_000002.dat']
@@ -0,0 +1,133 @@
+import glob
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+from ..codes import checkpoints, transactionmanager
+from ..codes.blockchain import commit_block
+from ..codes.checkpoints import get_checkpoint_heights, revert_state, write_checkpoint
+from ..codes.db_manager import get_connection, get_cursor, read_snapshot
+from ..codes.fs.block_store import get_block, get_stored_block_indexes
+from ..codes.fs.mempool_manager import Mempool
+from ..codes.state_tree import get_state_root
+from ..constants import BLOCK_STORE_PATH
+from .test_verdict_cache import make_transfer
+
+
+@pytest.fixture
+def restore_chain(tmp_path):
+    """Function putting the chain db and block store back as they were before the test"""
+    backup = sqlite3.connect(str(tmp_path / 'backup.db'))
+    get_connection().backup(backup)
+    shutil.copytree(BLOCK_STORE_PATH, tmp_path / 'blocks')
+
+    def restore():
+        backup.backup(get_connection())
+        shutil.rmtree(BLOCK_STORE_PATH)
+        shutil.copytree(tmp_path / 'blocks', BLOCK_STORE_PATH)
+
+    yield restore
+    restore()
+    backup.close()
+
+
+def get_chain_state():
+    cur = get_cursor()
+    state = {
+        'height': cur.execute('SELECT MAX(block_index) FROM blocks').fetchone()[0],
+        'balances': cur.execute('SELECT wallet_address, tokencode, balance FROM balances ORDER BY 1, 2').fetchall(),
+        'wallets': cur.execute('SELECT COUNT(*) FROM wallets').fetchone()[0],
+        'state_root': get_state_root(cur).hex(),
+    }
+    cur.close()
+    return state
+
+
+def test_checkpoint_pinned_to_block(tmp_path):
+    folder = str(tmp_path) + '/'
+    with read_snapshot() as (cur, block_height):
+        wallet_count = cur.execute('SELECT COUNT(*) FROM wallets').fetchone()[0]
+
+    # A later block already committed, the state is no longer that of block_height - 1
+    assert write_checkpoint(block_height - 1, folder) is False
+    assert get_checkpoint_heights(folder) == []
+
+    assert write_checkpoint(block_height, folder) is True
+    assert get_checkpoint_heights(folder) == [block_height]
+    checkpoint = sqlite3.connect(f'{folder}state_{block_height}.db')
+    assert checkpoint.execute('SELECT COUNT(*) FROM wallets').fetchone()[0] == wallet_count
+    checkpoint.close()
+
+
+def test_revert_across_checkpoint(tmp_path, restore_chain):
+    folder = str(tmp_path / 'checkpoints') + '/'
+    no_checkpoints = str(tmp_path / 'none') + '/'
+    height = get_chain_state()['height']
+    checkpoint_height, target = height - 3, height - 1
+
+    # What replaying every block from genesis gives
+    assert revert_state(target, no_checkpoints)
+    expected = get_chain_state()
+    assert expected['height'] == target
+    restore_chain()
+
+    assert revert_state(checkpoint_height, no_checkpoints)
+    assert write_checkpoint(checkpoint_height, folder)
+    restore_chain()
+
+    # Restores the checkpoint and replays the two blocks after it
+    assert revert_state(target, folder)
+    assert get_chain_state() == expected
+    assert get_checkpoint_heights(folder) == [checkpoint_height]
+
+    cur = get_cursor()
+    block_hash = cur.execute('SELECT hash FROM blocks WHERE block_index = ?', (target, )).fetchone()[0]
+    assert get_stored_block_indexes(cur)[-1] == target
+    assert get_block(cur, target)['hash'] == block_hash
+    assert get_block(cur, target + 1) is None
+    # The reverted blocks' bytes are gone from the last segment
+    segment, offset, length = cur.execute(
+        'SELECT segment, offset, length FROM block_store_index WHERE block_index = ?', (target, )).fetchone()
+    cur.close()
+    last_segment = max(glob.glob(f'{BLOCK_STORE_PATH}segment_*.dat'))
+    assert last_segment.endswith(f'{segment:06d}.dat')
+    assert os.path.getsize(last_segment) == offset + length
+
+
+def test_peer_block_clears_pending_debits(tmp_path, monkeypatch, restore_chain):
+    cur = get_cursor()
+    sender, tokencode, balance = cur.execute(
+        'SELECT wallet_address, tokencode, balance FROM balances WHERE balance >= 10 '
+        'ORDER BY wallet_address, tokencode LIMIT 1').fetchone()
+    receiver = cur.execute('SELECT wallet_address FROM wallets WHERE wallet_address != ? LIMIT 1',
+                           (sender, )).fetchone()[0]
+    block_index, block_hash = cur.execute(
+        'SELECT block_index, hash FROM blocks ORDER BY block_index DESC LIMIT 1').fetchone()
+    cur.close()
+    mempool = Mempool(str(tmp_path) + '/')
+    monkeypatch.setattr(checkpoints, 'get_mempool', lambda: mempool)
+    monkeypatch.setattr(transactionmanager, 'get_mempool', lambda: mempool)
+
+    included = make_transfer(sender, receiver, tokencode, balance * 6 // 10)
+    assert mempool.admit(included.get_transaction_complete(), included.econvalidator)
+    assert mempool.get_pending_debit(sender, tokencode) == balance * 6 // 10
+
+    # A peer's block includes it, the local updater never sees it
+    commit_block({
+        'index': block_index + 1,
+        'timestamp': 1645104446000,
+        'proof': 0,
+        'previous_hash': block_hash,
+        'text': {'transactions': [included.transaction], 'signatures': [included.signatures]},
+    }, 'peer_block')
+    assert not mempool.contains(included.transaction['trans_code'])
+    assert mempool.get_pending_debit(sender, tokencode) == 0
+    assert mempool.get_stats()['evictions'] == {}
+
+    # What is left of the balance is spendable again, and no more
+    overspend = make_transfer(sender, receiver, tokencode, balance * 5 // 10)
+    assert mempool.admit(overspend.get_transaction_complete(), overspend.econvalidator) is None
+    spend = make_transfer(sender, receiver, tokencode, balance * 3 // 10)
+    assert mempool.admit(spend.get_transaction_complete(), spend.econvalidator)
@@ -1,8 +1,13 @@
 from fastapi.testclient import TestClient
 
 from ..main import app
-from ..codes.validator import validate_block, validate_receipt_signature
+from ..codes.db_manager import get_connection
+from ..codes.validator import validate_block, validate_receipt_signature, validate_receipt_signatures, \
+    validate_transactions
+from ..codes.signature_verifier import shutdown_verifier
 from ..codes.signmanager import sign_object
+from ..codes.blockchain import Blockchain
+from ..codes.encoding import canonical_hash, get_proof_hasher
 
 client = TestClient(app)
 
@@ -37,6 +42,60 @@ def test_validate_block_receipt():
     assert data['status'] == 'SUCCESS'
 
 
+def test_batch_receipt_signatures():
+    receipts = []
+    for block_index in range(20):
+        receipt_data = {"block_index": block_index, "block_hash": "0000", "vote": 1}
+        receipts.append({
+            "data": receipt_data,
+            "public": test_wallet["public"],
+            "signature": sign_object(test_wallet["private"], receipt_data)
+        })
+    receipts[3]["data"] = {"block_index": 3, "block_hash": "0000", "vote": 0}
+    receipts[7]["signature"] = "not base64"
+
+    try:
+        valid = validate_receipt_signatures(receipts)
+    finally:
+        shutdown_verifier()
+    assert valid == [index not in (3, 7) for index in range(20)]
+
+
+def test_proof_hasher():
+    block = {
+        'index': 2,
+        'timestamp': 1632219815077,
+        'proof': 0,
+        'text': {'transactions': [{'trans_code': 'abc', 'fee': 0.5, 'specific_data': {'b': 1, 'a': 'é'}}]},
+        'previous_hash': '0000abcd',
+    }
+    hash_proof = get_proof_hasher(block)
+    for proof in [1, 42, 123456]:
+        block['proof'] = proof
+        assert hash_proof(proof) == canonical_hash(block)
+
+    block_hash = Blockchain().proof_of_work(block)
+    assert block_hash[:4] == '0000'
+    assert canonical_hash(block) == block_hash
+
+
+def test_bulk_validation_in_open_transaction():
+    con = get_connection()
+    con.execute('CREATE TEMP TABLE bulk_caller (value INTEGER)')
+    con.execute('INSERT INTO bulk_caller VALUES (1)')
+    assert con.in_transaction
+    try:
+        invalid = {'transaction': {'trans_code': 'bulk_invalid', 'type': 5}, 'signatures': []}
+        checks = validate_transactions([invalid])
+        assert checks[0]['valid'] is False
+        # The caller's uncommitted write is left alone
+        assert con.in_transaction
+        assert con.execute('SELECT value FROM bulk_caller').fetchall() == [(1, )]
+    finally:
+        con.rollback()
+        con.execute('DROP TABLE bulk_caller')
+
+
 def test_block_validation_success():
     block_data = {
         "index": 241,
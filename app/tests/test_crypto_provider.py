@@ -0,0 +1,71 @@
+import base64
+import json
+
+import pytest
+
+from ..codes.crypto_provider import CryptoProvider, EcdsaProvider, get_crypto_provider
+
+
+PROVIDER_NAMES = ['ecdsa', 'coincurve']
+
+# Signed with python-ecdsa before providers existed, one with a high and one with a low s
+VECTORS = {
+    'private': 'erMsIsopb9N6MYnDxvWtC+iaNb4PmQTY72D3jM5+lFE=',
+    'public': 'wTxCEIm7oaKrYmmWIaeEcd4B49DsHb+D4VilmzhQZJCEmhT1XMFa/WmWoyBK3SRDuNGc9iOYdRBBCfeE0esH6A==',
+    'message': {'block_index': 241, 'vote': 1},
+    'signatures': [
+        'Bj2ypXzAjX36ukoDN7MphqWe6vYlckEvKCyEoKV5JSOK6MC1Q2U+c/AcrsmE2p5PdPHgvbt2xEGQHRiJKuwjfg==',
+        'hwsYpnLK7LAAmET/XIYiZJRx2Yz07s9CJBevO1Tmhlg8RukDt2dSi06PXHo8YjAg3SYM/30mRbyBtn9/8aGXaQ==',
+    ],
+}
+
+
+def get_provider(name):
+    if name == 'coincurve':
+        pytest.importorskip('coincurve')
+    return get_crypto_provider(name)
+
+
+@pytest.mark.parametrize('name', PROVIDER_NAMES)
+def test_vectors(name):
+    provider = get_provider(name)
+    private_key = base64.b64decode(VECTORS['private'])
+    public_key = base64.b64decode(VECTORS['public'])
+    message = json.dumps(VECTORS['message']).encode()
+
+    assert provider.get_public_key(private_key) == public_key
+    parsed_key = provider.load_public_key(public_key)
+    for signature in VECTORS['signatures']:
+        signature = base64.b64decode(signature)
+        assert provider.verify(parsed_key, signature, message) is True
+        assert provider.verify(parsed_key, signature, message + b' ') is False
+
+
+@pytest.mark.parametrize('signer', PROVIDER_NAMES)
+@pytest.mark.parametrize('verifier', PROVIDER_NAMES)
+def test_cross_provider(signer, verifier):
+    signing_provider = get_provider(signer)
+    verifying_provider = get_provider(verifier)
+    private_key = signing_provider.generate_private_key()
+    public_key = signing_provider.get_public_key(private_key)
+    assert verifying_provider.get_public_key(private_key) == public_key
+
+    message = b'{"trans_code": "abc"}'
+    signature = signing_provider.sign(private_key, message)
+    assert len(signature) == 64
+    parsed_key = verifying_provider.precompute(verifying_provider.load_public_key(public_key))
+    assert verifying_provider.verify(parsed_key, signature, message) is True
+    assert verifying_provider.verify(parsed_key, signature, b'{"trans_code": "abd"}') is False
+    assert verifying_provider.verify(parsed_key, signature[:-1], message) is False
+
+
+def test_incomplete_provider():
+    class SigningOnly(CryptoProvider):
+        def get_public_key(self, private_key_bytes):
+            return EcdsaProvider().get_public_key(private_key_bytes)
+
+        def sign(self, private_key_bytes, message):
+            return EcdsaProvider().sign(private_key_bytes, message)
+
+    with pytest.raises(TypeError):
+        SigningOnly()
@@ -0,0 +1,142 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from ..main import app
+from ..codes import events
+from ..codes.events import Subscription, publish, publish_block_committed, stage_balance_changes, subscribe, \
+    unsubscribe
+from ..routers import events as events_router
+
+client = TestClient(app)
+
+
+def drain(subscription):
+    delivered = []
+    while not subscription.queue.empty():
+        delivered.append(subscription.queue.get_nowait())
+    return delivered
+
+
+def publish_on_subscribe(monkeypatch, *published):
+    """Publish the given (type, data, addresses) events from the event loop as soon as a stream subscribes
+
+    They are published in one go, before the stream can read any of them.
+    """
+    def subscribe_and_publish(types=None, addresses=None):
+        subscription = subscribe(types, addresses)
+        asyncio.get_running_loop().call_soon(lambda: [publish(*event) for event in published])
+        return subscription
+
+    monkeypatch.setattr(events_router, 'subscribe', subscribe_and_publish)
+
+
+def test_filter_matching():
+    async def check():
+        subscription = Subscription(['balance'], ['0xwallet'])
+        assert subscription.matches({'type': 'balance', 'addresses': ['0xwallet', '0xother']})
+        assert not subscription.matches({'type': 'balance', 'addresses': ['0xother']})
+        assert not subscription.matches({'type': 'block', 'addresses': None})
+
+        # Events concerning everyone pass any address filter
+        subscription.set_filter(None, ['0xwallet'])
+        assert subscription.matches({'type': 'block', 'addresses': None})
+        subscription.set_filter(['block'])
+        assert subscription.matches({'type': 'block', 'addresses': None})
+        assert not subscription.matches({'type': 'balance', 'addresses': ['0xwallet']})
+
+    asyncio.run(check())
+
+
+def test_overflow_drops_subscriber(monkeypatch):
+    monkeypatch.setattr(events, 'EVENT_QUEUE_SIZE', 2)
+
+    async def check():
+        subscription = subscribe(['block'])
+        try:
+            for block_index in range(3):
+                publish('block', {'block_index': block_index})
+            await asyncio.sleep(0)
+            assert subscription.overflowed
+            assert [event and event['data'] for event in drain(subscription)] == [
+                {'block_index': 0}, {'block_index': 1}, None]
+
+            # Dropped, nothing more is delivered
+            publish('block', {'block_index': 3})
+            await asyncio.sleep(0)
+            assert drain(subscription) == []
+        finally:
+            unsubscribe(subscription)
+
+    asyncio.run(check())
+
+
+def test_rolled_back_block_emits_no_balances():
+    async def check():
+        subscription = subscribe(['block', 'balance'])
+        try:
+            # Block 2 is rolled back before it commits, block 3 commits with its own changes
+            stage_balance_changes(2, {('0xrolledback', 'NWRL'): 1})
+            stage_balance_changes(3, {('0xcommitted', 'NWRL'): 2})
+            publish_block_committed(3)
+            # Committed later without balance changes of its own
+            publish_block_committed(2)
+            await asyncio.sleep(0)
+            published = [(event['type'], event['data'].get('wallet_address')) for event in drain(subscription)]
+            assert published == [('block', None), ('balance', '0xcommitted'), ('block', None)]
+        finally:
+            unsubscribe(subscription)
+
+    asyncio.run(check())
+
+
+def test_sse_events(monkeypatch):
+    monkeypatch.setattr(events, 'EVENT_QUEUE_SIZE', 2)
+    publish_on_subscribe(
+        monkeypatch,
+        ('balance', {'balance': 1}, ['0xother']),
+        ('mempool_admission', {'transaction_code': 'first'}, ['0xwallet']),
+        ('mempool_removal', {'transaction_code': 'first'}, ['0xwallet']),
+        ('mempool_admission', {'transaction_code': 'second'}, ['0xwallet']),
+    )
+    # The stream ends once the subscriber overflows, which the test client needs to return
+    response = client.get('/events', params={'types': 'mempool_admission,mempool_removal,balance',
+                                             'addresses': '0xwallet'})
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/event-stream')
+    assert response.text == (
+        'event: mempool_admission\ndata: {"transaction_code": "first"}\n\n'
+        'event: mempool_removal\ndata: {"transaction_code": "first"}\n\n'
+        'event: overflow\ndata: {}\n\n'
+    )
+
+    response = client.get('/events', params={'types': 'block,bogus'})
+    assert response.status_code == 400
+
+
+def test_websocket_events(monkeypatch):
+    publish_on_subscribe(
+        monkeypatch,
+        ('balance', {'balance': 1}, ['0xwallet']),
+        ('block', {'block_index': 1}, None),
+    )
+    with client.websocket_connect('/ws/events?types=block') as websocket:
+        assert websocket.receive_json() == {'type': 'block', 'data': {'block_index': 1}}
+
+        websocket.send_json({'types': ['balance'], 'addresses': ['0xwallet']})
+        for message in ['[1]', 'not json', '{"types": ["bogus"]}', '{"addresses": "0xwallet"}']:
+            websocket.send_text(message)
+            assert websocket.receive_json()['type'] == 'error'
+
+        # The bad messages left the connection and the last valid filter in place
+        publish('block', {'block_index': 2})
+        publish('balance', {'balance': 3}, ['0xother'])
+        publish('balance', {'balance': 4}, ['0xwallet'])
+        assert websocket.receive_json() == {'type': 'balance', 'data': {'balance': 4}}
+
+    with pytest.raises(WebSocketDisconnect) as error:
+        with client.websocket_connect('/ws/events?types=bogus') as websocket:
+            websocket.receive_json()
+    assert error.value.code == 1008
@@ -7,6 +7,9 @@ import random
 
 from ..main import app
 from ..codes.contracts.nusd1 import nusd1
+from ..codes.db_updater import calculate_transaction_hash
+from ..codes.merkle import verify_merkle_proof
+from ..codes.state_tree import verify_balance_proof
 
 client = TestClient(app)
 
@@ -71,6 +74,16 @@ def create_wallet():
     wallet_in_state = next(
         x for x in wallets if x['wallet_address'] == wallet['address'])
     assert wallet_in_state
+
+    trans_code = signed_transaction['transaction']['trans_code']
+    response = client.get('/get-transaction', params={'transaction_code': trans_code})
+    assert response.status_code == 200
+    transaction_hash = calculate_transaction_hash(response.json())
+    response = client.get('/get-transaction-proof', params={'transaction_code': trans_code})
+    assert response.status_code == 200
+    proof = response.json()
+    assert proof['transaction_hash'] == transaction_hash
+    assert verify_merkle_proof(transaction_hash, proof['proof'], proof['transactions_hash'])
     return wallet
 
 
@@ -198,6 +211,7 @@ def create_transfer(wallet1, wallet2, token1, token2):
         "wallet_address": wallet1['address']
     })
     assert response.status_code == 200
+    assert int(response.headers['X-Newrl-Block-Height']) == response.json()['block_height'] > 0
     balance = response.json()['balance']
     assert balance == 7888
 
@@ -228,6 +242,16 @@ def create_transfer(wallet1, wallet2, token1, token2):
     balance = response.json()['balance']
     assert balance == 6888
 
+    response = client.get('/get-balance-proof', params={
+        "wallet_address": wallet2['address'],
+        "token_code": token2
+    })
+    assert response.status_code == 200
+    proof = response.json()
+    assert proof['balance'] == 6888
+    assert verify_balance_proof(proof['state_root'], wallet2['address'], token2, 6888, proof['proof'])
+    assert not verify_balance_proof(proof['state_root'], wallet2['address'], token2, 6889, proof['proof'])
+
 def add_trust_score(wallet1, wallet2, tscore):
     response = client.post('/update-trustscore', json={
         "source_address": wallet1['address'],
@@ -269,6 +293,39 @@ def get_token_from_tx(txcode):
     else:
         return False
 
+def bulk_transfer(wallet1, wallet2, token1):
+    """Two one way transfers that each fit the balance but not together, and a duplicate"""
+    signed_transactions = []
+    for qty in [5000, 5001]:
+        response = client.post('/add-transfer', json={
+            "transfer_type": 5,
+            "asset1_code": token1,
+            "asset2_code": "",
+            "wallet1_address": wallet1['address'],
+            "wallet2_address": wallet2['address'],
+            "asset1_qty": qty,
+            "asset2_qty": 0
+        })
+        assert response.status_code == 200
+        response = client.post('/sign-transaction', json={
+            "wallet_data": wallet1,
+            "transaction_data": response.json()
+        })
+        assert response.status_code == 200
+        signed_transactions.append(response.json())
+    signed_transactions.append(signed_transactions[0])
+
+    response = client.post('/validate-transactions', json=signed_transactions)
+    assert response.status_code == 200
+    checks = response.json()['response']
+    assert [check['valid'] for check in checks] == [True, False, False]
+    assert checks[1]['msg'] == 'Economic validation failed'
+    assert checks[2]['msg'] == 'Duplicate transaction in batch'
+
+    response = client.post('/run-updater')
+    assert response.status_code == 200
+
+
 def create_contract(wallet1, tokencode, tokenname):
     response = client.get("/generate-contract-address")
     assert response.status_code == 200
@@ -359,6 +416,7 @@ def test_read_main():
 
     create_transfer(wallet1, wallet2, token1, token2)
     print("transfer done")
+    bulk_transfer(wallet1, wallet2, token1)
 
 #    add_trust_score(test_wallet1, test_wallet2, tscore = 2.1)
 #    add_trust_score(wallet1, wallet2, tscore = 2.1)
@@ -0,0 +1,260 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import pytest
+
+from ..codes import mempool_sweeper
+from ..codes.fs import mempool_manager
+from ..codes.fs.mempool_manager import Mempool, MempoolBudgetExceeded, get_transaction_size
+from ..codes.mempool_sweeper import sweep_mempool
+from ..codes.p2p import sync_mempool
+from ..codes.transactionmanager import Transactionmanager
+from ..codes.validator import validate, validate_transactions
+
+
+def make_transaction(trans_code, fee, sender='0xsender'):
+    return {
+        'transaction': {
+            'trans_code': trans_code,
+            'type': 5,
+            'fee': fee,
+            'specific_data': {
+                'transfer_type': 1,
+                'asset1_code': 'NWRL',
+                'asset2_code': '',
+                'wallet1': sender,
+                'wallet2': '0xreceiver',
+                'asset1_number': 1,
+                'asset2_number': 0,
+            },
+        },
+        'signatures': [{'wallet_address': sender, 'msgsign': 'signature'}],
+    }
+
+
+def test_sender_and_token_index(tmp_path):
+    mempool = Mempool(str(tmp_path) + '/')
+    mempool.add(make_transaction('first', 1.0))
+    mempool.add(make_transaction('second', 1.0))
+    mempool.add(make_transaction('other_sender', 1.0, sender='0xother'))
+    assert sorted(mempool.get_by_sender('0xsender')) == ['first', 'second']
+    assert sorted(mempool.get_by_token('NWRL')) == ['first', 'other_sender', 'second']
+
+    mempool.remove(['first', 'other_sender'])
+    assert mempool.get_by_sender('0xsender') == ['second']
+    assert mempool.get_by_sender('0xother') == []
+    assert mempool.get_by_token('NWRL') == ['second']
+
+
+def test_fee_rate_order(tmp_path):
+    mempool = Mempool(str(tmp_path) + '/')
+    mempool.add(make_transaction('low', 0.1))
+    mempool.add(make_transaction('high', 5.0))
+    mempool.add(make_transaction('free', 0.0))
+    mempool.add(make_transaction('high_later', 5.0))
+    mempool.remove(['free'])
+
+    candidates = mempool.iter_by_fee_rate()
+    assert next(candidates)['transaction']['trans_code'] == 'high'
+    candidates.close()
+
+    order = [transaction['transaction']['trans_code'] for transaction in mempool.iter_by_fee_rate()]
+    assert order == ['high', 'high_later', 'low']
+
+
+def test_capacity_eviction(tmp_path):
+    mempool = Mempool(str(tmp_path) + '/', max_transactions=2)
+    mempool.add(make_transaction('old_low', 0.1))
+    mempool.add(make_transaction('high', 5.0))
+    mempool.add(make_transaction('middle', 1.0))
+    assert mempool.get_transaction_codes() == ['high', 'middle']
+    assert mempool.get_stats()['evictions'] == {'capacity': 1}
+
+
+def test_unsigned_eviction(tmp_path):
+    mempool = Mempool(str(tmp_path) + '/')
+    mempool.add(make_transaction('signed', 1.0))
+    unsigned = make_transaction('unsigned', 9.0)
+    del unsigned['signatures']
+    mempool.add(unsigned)
+    assert mempool.get_unsigned() == ['unsigned']
+    assert mempool.evict(mempool.get_unsigned(), 'unsigned') == ['unsigned']
+    assert mempool.get_transaction_codes() == ['signed']
+    assert mempool.get_stats()['evictions'] == {'unsigned': 1}
+
+
+def test_received_before(tmp_path, monkeypatch):
+    mempool = Mempool(str(tmp_path) + '/')
+    for received, transaction_code in [(1000, 'first'), (2000, 'second'), (3000, 'third')]:
+        monkeypatch.setattr(mempool_manager, 'get_time_ms', lambda: received)
+        mempool.add(make_transaction(transaction_code, 1.0))
+    assert mempool.get_received_before(1000) == []
+    assert mempool.get_received_before(2001) == ['first', 'second']
+    assert mempool.evict(mempool.get_received_before(3000), 'expired') == ['first', 'second']
+    assert mempool.get_transaction_codes() == ['third']
+
+
+def test_readd_keeps_received(tmp_path, monkeypatch):
+    mempool = Mempool(str(tmp_path) + '/')
+    admissions = []
+    monkeypatch.setattr(mempool_manager, 'publish', lambda event_type, data, addresses: admissions.append(data))
+    for received, transaction_code, fee in [(1000, 'first', 1.0), (2000, 'second', 1.0), (3000, 'first', 2.0)]:
+        monkeypatch.setattr(mempool_manager, 'get_time_ms', lambda: received)
+        mempool.add(make_transaction(transaction_code, fee))
+    assert mempool.get('first')['transaction']['fee'] == 2.0
+    assert mempool.get_received_before(1500) == ['first']
+    assert mempool.get_received_before(2500) == ['first', 'second']
+    assert mempool.get_stats()['oldest_received'] == 1000
+    assert [admission['transaction_code'] for admission in admissions] == ['first', 'second']
+
+    mempool.journal.close()
+    reloaded = Mempool(str(tmp_path) + '/')
+    reloaded.load()
+    assert reloaded.get_received_before(1500) == ['first']
+
+
+def test_relayed_transaction_not_renewed(tmp_path, monkeypatch):
+    mempool = Mempool(str(tmp_path) + '/')
+    monkeypatch.setattr(sync_mempool, 'get_mempool', lambda: mempool)
+    monkeypatch.setattr(Transactionmanager, 'verifytransigns', lambda self: True)
+    monkeypatch.setattr(Transactionmanager, 'econvalidator', lambda self: True)
+    for received in [1000, 2000]:
+        monkeypatch.setattr(mempool_manager, 'get_time_ms', lambda: received)
+        sync_mempool.receive_transaction(make_transaction('relayed', 1.0))
+    assert mempool.get_received_before(1500) == ['relayed']
+    assert [record['op'] for record in mempool.journal.replay()] == ['add']
+
+
+def test_sweep(tmp_path, monkeypatch):
+    mempool = Mempool(str(tmp_path) + '/')
+    for received, transaction_code in [(500, 'oldest'), (1500, 'old'), (4000, 'recent'), (6000, 'fresh')]:
+        monkeypatch.setattr(mempool_manager, 'get_time_ms', lambda: received)
+        mempool.add(make_transaction(transaction_code, 1.0))
+    unsigned = make_transaction('unsigned', 1.0)
+    del unsigned['signatures']
+    mempool.add(unsigned)
+
+    con = sqlite3.connect(':memory:')
+    con.execute('CREATE TABLE blocks (block_index INTEGER, timestamp TEXT)')
+
+    @contextmanager
+    def block_snapshot():
+        yield con.cursor(), None
+
+    peers = []
+    monkeypatch.setattr(mempool_sweeper, 'read_snapshot', block_snapshot)
+    monkeypatch.setattr(mempool_sweeper, 'get_peers', lambda: peers)
+    monkeypatch.setattr(mempool_sweeper, 'MEMPOOL_TRANSACTION_TTL_SECONDS', 10)
+    monkeypatch.setattr(mempool_sweeper, 'MEMPOOL_MAX_AGE_BLOCKS', 2)
+    monkeypatch.setattr(mempool_sweeper, 'get_time_ms', lambda: 100000)
+
+    # Past their time to live, but no block was made for them yet
+    assert sweep_mempool(mempool) == {'unsigned': 1, 'capacity': 0}
+    assert mempool.get_transaction_codes() == ['oldest', 'old', 'recent', 'fresh']
+
+    # Older blocks carry a datetime string
+    con.executemany('INSERT INTO blocks VALUES (?, ?)', [
+        (1, '1970-01-01T00:00:01+00:00'), (2, '2000'), (3, '5000')])
+    monkeypatch.setattr(mempool_sweeper, 'get_time_ms', lambda: 5500)
+    assert sweep_mempool(mempool) == {'unsigned': 0, 'expired': 0, 'capacity': 0}
+
+    # Only a node with peers drops what arrived before the block MEMPOOL_MAX_AGE_BLOCKS back
+    peers.append({'address': 'peer'})
+    assert sweep_mempool(mempool) == {'unsigned': 0, 'expired': 0, 'stale': 1, 'capacity': 0}
+    assert mempool.get_transaction_codes() == ['old', 'recent', 'fresh']
+
+    # Expired, except the one received after the last block
+    monkeypatch.setattr(mempool_sweeper, 'get_time_ms', lambda: 20000)
+    assert sweep_mempool(mempool) == {'unsigned': 0, 'expired': 2, 'stale': 0, 'capacity': 0}
+    assert mempool.get_transaction_codes() == ['fresh']
+    assert mempool.get_stats()['evictions'] == {'unsigned': 1, 'stale': 1, 'expired': 2}
+
+
+def test_byte_budgets(tmp_path):
+    transaction_size = get_transaction_size(make_transaction('first', 1.0))
+    mempool = Mempool(str(tmp_path) + '/', max_bytes_per_sender=2 * transaction_size,
+                      max_bytes_per_peer=3 * transaction_size)
+    mempool.add(make_transaction('first', 1.0), '10.0.0.1')
+    mempool.add(make_transaction('secnd', 1.0), '10.0.0.1')
+    with pytest.raises(MempoolBudgetExceeded) as error:
+        mempool.add(make_transaction('third', 1.0), '10.0.0.2')
+    assert error.value.budget == 'sender'
+
+    mempool.add(make_transaction('other', 1.0, sender='0xsendr2'), '10.0.0.1')
+    with pytest.raises(MempoolBudgetExceeded) as error:
+        mempool.add(make_transaction('fifth', 1.0, sender='0xsendr3'), '10.0.0.1')
+    assert error.value.budget == 'peer'
+    assert mempool.get_stats()['peer_bytes'] == {'10.0.0.1': 3 * transaction_size}
+
+    mempool.remove(['first'])
+    mempool.add(make_transaction('fifth', 1.0, sender='0xsendr3'), '10.0.0.1')
+
+
+def test_full_pool_rejection(tmp_path):
+    mempool = Mempool(str(tmp_path) + '/', max_transactions=2)
+    mempool.add(make_transaction('first', 1.0, sender='0xsendr1'))
+    mempool.add(make_transaction('second', 1.0, sender='0xsendr2'))
+    # It would be the first evicted, so it is refused rather than churning the pool
+    with pytest.raises(MempoolBudgetExceeded) as error:
+        mempool.add(make_transaction('low', 0.1, sender='0xsendr3'))
+    assert error.value.budget == 'global'
+    assert mempool.get_transaction_codes() == ['first', 'second']
+    assert mempool.get_stats()['rejections'] == {'global': 1}
+
+
+def test_pending_debits(tmp_path):
+    mempool = Mempool(str(tmp_path) + '/')
+    mempool.add(make_transaction('first', 1.0))
+    mempool.add(make_transaction('second', 1.0))
+    mempool.add(make_transaction('other_sender', 1.0, sender='0xother'))
+    assert mempool.get_pending_debit('0xsender', 'NWRL') == 2
+    assert mempool.get_pending_debit('0xsender', 'NWRL', excluding='first') == 1
+
+    assert mempool.admit(make_transaction('refused', 1.0), lambda: False) is None
+    assert not mempool.contains('refused')
+
+    mempool.remove(['first', 'second'])
+    assert mempool.get_pending_debit('0xsender', 'NWRL') == 0
+    assert ('0xsender', 'NWRL') not in mempool.pending_debits
+
+
+def test_admit_locks_spent_balances_only(tmp_path):
+    mempool = Mempool(str(tmp_path) + '/')
+    same_sender = []
+
+    def check():
+        # A spend from another wallet gets in while this check runs
+        other = threading.Thread(target=mempool.admit,
+                                 args=(make_transaction('other', 1.0, sender='0xother'), lambda: True))
+        other.start()
+        other.join(timeout=5)
+        assert not other.is_alive()
+        # A spend from the same balance waits for this one
+        same = threading.Thread(target=mempool.admit, args=(make_transaction('same', 1.0), lambda: True))
+        same.start()
+        same.join(timeout=0.2)
+        assert same.is_alive()
+        same_sender.append(same)
+        return True
+
+    assert mempool.admit(make_transaction('first', 1.0), check) == 'first'
+    same_sender[0].join(timeout=5)
+    assert mempool.get_transaction_codes() == ['other', 'first', 'same']
+
+
+@pytest.mark.parametrize('fee', ['1', -1, float('nan'), True])
+def test_invalid_fee_rejected(tmp_path, fee):
+    mempool = Mempool(str(tmp_path) + '/')
+    with pytest.raises(ValueError):
+        mempool.add(make_transaction('bad', fee))
+    assert not mempool.contains('bad') and mempool.get_stats()['transactions'] == 0
+    mempool.journal.close()
+    # Nothing was journaled either
+    reloaded = Mempool(str(tmp_path) + '/')
+    reloaded.load()
+    assert reloaded.get_transaction_codes() == []
+
+    assert validate(make_transaction('bad', fee)) == {'valid': False, 'msg': 'Invalid fee'}
+    checks = validate_transactions([make_transaction('bad', fee), make_transaction('bad_too', fee)])
+    assert checks == [{'valid': False, 'msg': 'Invalid fee'}] * 2
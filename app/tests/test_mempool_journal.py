@@ -0,0 +1,54 @@
+import time
+
+from ..codes.fs import mempool_manager
+from ..codes.fs.mempool_manager import Mempool, MempoolJournal
+from .test_mempool import make_transaction
+
+
+def test_journal_synced_after_quiet_period(tmp_path, monkeypatch):
+    monkeypatch.setattr(mempool_manager, 'MEMPOOL_JOURNAL_FSYNC_SECONDS', 0.05)
+    fsynced = []
+    fsync = mempool_manager.os.fsync
+    monkeypatch.setattr(mempool_manager.os, 'fsync', lambda fd: fsynced.append(fd) or fsync(fd))
+
+    journal = MempoolJournal(str(tmp_path / 'journal.log'))
+    journal.append({'op': 'remove', 'transaction_codes': ['a']})
+    assert journal.unsynced_records == 1 and journal.file.fileno() not in fsynced
+
+    # No further record arrives, the timer still syncs the last one
+    deadline = time.monotonic() + 2
+    while journal.unsynced_records and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert journal.unsynced_records == 0
+    # Timers of journals left by other tests may fsync their own files meanwhile
+    assert fsynced.count(journal.file.fileno()) == 1
+    journal.close()
+    assert [record['op'] for record in MempoolJournal(journal.path).replay()] == ['remove']
+
+
+def test_journal_reload(tmp_path):
+    mempool = Mempool(str(tmp_path) + '/')
+    mempool.add(make_transaction('first', 0.1))
+    mempool.add(make_transaction('second', 5.0))
+    mempool.add(make_transaction('third', 1.0))
+    mempool.remove(['second'])
+    mempool.add(make_transaction('second', 2.0))
+    mempool.journal.close()
+
+    reloaded = Mempool(str(tmp_path) + '/')
+    reloaded.load()
+    assert reloaded.get_transaction_codes() == ['first', 'third', 'second']
+    assert reloaded.get('second')['transaction']['fee'] == 2.0
+
+
+def test_journal_reload_skips_bad_records(tmp_path):
+    mempool = Mempool(str(tmp_path) + '/')
+    mempool.add(make_transaction('first', 1.0))
+    # As written by a node that did not check fees before journaling
+    mempool.journal.append({'op': 'add', 'transaction': make_transaction('bad', '1'), 'received': 1})
+    mempool.add(make_transaction('second', 1.0))
+    mempool.journal.close()
+
+    reloaded = Mempool(str(tmp_path) + '/')
+    reloaded.load()
+    assert reloaded.get_transaction_codes() == ['first', 'second']
@@ -1,10 +1,20 @@
+import pytest
 from fastapi.testclient import TestClient
 from ..migrations.init import init_newrl
 
 from ..main import app
+from ..codes import validator
+from ..codes.fs.mempool_manager import Mempool, get_transaction_size
+from ..codes.p2p import sync_mempool
+from ..codes.transactionmanager import Transactionmanager
+from ..constants import TIME_BETWEEN_BLOCKS_SECONDS
+from ..routers import p2p
+from .test_mempool import make_transaction
 
 client = TestClient(app)
 
+PEER_URL = 'http://peer:8182'
+
 init_newrl()
 
 def _receive_block(block_index):
@@ -82,4 +92,117 @@ def test_block_receive():
     current_block_index = int(response.text)
     
     # Block index should've increased by 1
-    assert current_block_index == (previous_block_index + 1)
\ No newline at end of file
+    assert current_block_index == (previous_block_index + 1)
+
+
+@pytest.fixture
+def mempool_peer(tmp_path, monkeypatch):
+    """A local and a peer mempool, with the peer served by this app through requests.post
+
+    Returns (local mempool, peer mempool, codes pushed to the peer).
+    """
+    (tmp_path / 'local').mkdir()
+    (tmp_path / 'peer').mkdir()
+    local_mempool = Mempool(str(tmp_path / 'local') + '/')
+    peer_mempool = Mempool(str(tmp_path / 'peer') + '/')
+    serving = [local_mempool]
+    pushed = []
+
+    def post(url, json=None, timeout=None):
+        path = url[len(PEER_URL):]
+        if path == '/validate-transaction':
+            pushed.append(json['transaction']['trans_code'])
+            return None
+        serving[0] = peer_mempool
+        try:
+            return client.post(path, json=json)
+        finally:
+            serving[0] = local_mempool
+
+    monkeypatch.setattr(sync_mempool, 'get_mempool', lambda: serving[0])
+    monkeypatch.setattr(sync_mempool.requests, 'post', post)
+    monkeypatch.setattr(Transactionmanager, 'verifytransigns', lambda self: True)
+    monkeypatch.setattr(Transactionmanager, 'econvalidator', lambda self: True)
+    return local_mempool, peer_mempool, pushed
+
+
+def test_mempool_reconciliation(mempool_peer):
+    local_mempool, peer_mempool, pushed = mempool_peer
+    for transaction_code in ['shared', 'only_mine']:
+        local_mempool.add(make_transaction(transaction_code, 1.0))
+    for transaction_code in ['shared', 'only_theirs']:
+        peer_mempool.add(make_transaction(transaction_code, 1.0))
+
+    result = sync_mempool.sync_mempool_with_peer(PEER_URL)
+    assert result == {'pulled': ['only_theirs'], 'pushed': ['only_mine']}
+    assert pushed == ['only_mine']
+    assert local_mempool.get_transaction_codes() == ['shared', 'only_mine', 'only_theirs']
+    assert peer_mempool.get_transaction_codes() == ['shared', 'only_theirs']
+
+
+def test_mempool_reconciliation_short_id_collision(mempool_peer, monkeypatch):
+    local_mempool, peer_mempool, pushed = mempool_peer
+    local_mempool.add(make_transaction('x_mine', 1.0))
+    for transaction_code in ['x_theirs', 'y_first', 'y_second']:
+        peer_mempool.add(make_transaction(transaction_code, 1.0))
+
+    # Codes starting with the same letter share a short id
+    get_short_id = sync_mempool.get_short_id
+    monkeypatch.setattr(sync_mempool, 'get_short_id', lambda code, salt: get_short_id(code[0], salt))
+    result = sync_mempool.sync_mempool_with_peer(PEER_URL)
+    # Both transactions behind the pulled short id come over
+    assert result == {'pulled': ['y_first', 'y_second'], 'pushed': []}
+    assert pushed == []
+
+    # x_mine and x_theirs hid each other, a round with another salt finds them
+    monkeypatch.setattr(sync_mempool, 'get_short_id', get_short_id)
+    result = sync_mempool.sync_mempool_with_peer(PEER_URL)
+    assert result == {'pulled': ['x_theirs'], 'pushed': ['x_mine']}
+    assert pushed == ['x_mine']
+
+
+def test_mempool_backpressure(tmp_path, monkeypatch):
+    size = get_transaction_size(make_transaction('tx1', 1.0))
+    mempool = Mempool(str(tmp_path) + '/', max_bytes_per_peer=size)
+    monkeypatch.setattr(validator, 'get_mempool', lambda: mempool)
+    monkeypatch.setattr(p2p, 'get_mempool', lambda: mempool)
+    monkeypatch.setattr(Transactionmanager, 'verifytransigns', lambda self: True)
+    monkeypatch.setattr(validator, 'verify_transactions_signatures', lambda managers: [True] * len(managers))
+    monkeypatch.setattr(Transactionmanager, 'econvalidator', lambda self, cur=None: True)
+    for broadcast in ['propogate_transaction_to_peers', 'propogate_transactions_to_peers', 'send']:
+        monkeypatch.setattr(validator, broadcast, lambda *args: None)
+    retry_after = str(TIME_BETWEEN_BLOCKS_SECONDS)
+
+    response = client.post('/validate-transaction', json=make_transaction('tx1', 1.0))
+    assert response.status_code == 200 and 'Retry-After' not in response.headers
+    # The test client's budget is full
+    response = client.post('/validate-transaction', json=make_transaction('tx2', 1.0))
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == retry_after
+    assert response.json()['detail'] == 'Mempool peer byte budget exceeded'
+
+    response = client.post('/validate-transactions', json=[make_transaction('tx3', 1.0), make_transaction('tx4', 1.0)])
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == retry_after
+    assert [check['valid'] for check in response.json()['detail']] == [False, False]
+
+    # With part of the batch accepted the request succeeds, still telling the client when to retry the rest
+    mempool.max_bytes_per_peer = 2 * size
+    response = client.post('/validate-transactions', json=[make_transaction('tx3', 1.0), make_transaction('tx4', 1.0)])
+    assert response.status_code == 200
+    assert response.headers['Retry-After'] == retry_after
+    checks = response.json()['response']
+    assert checks[0] == {'valid': True, 'msg': 'All well'}
+    assert checks[1] == {'valid': False, 'msg': 'Mempool peer byte budget exceeded',
+                         'retry_after': TIME_BETWEEN_BLOCKS_SECONDS}
+
+    response = client.get('/get-mempool-stats')
+    assert response.status_code == 200
+    stats = response.json()
+    assert stats['transactions'] == 2
+    assert stats['bytes'] == 2 * size
+    assert stats['max_bytes_per_peer'] == 2 * size
+    assert stats['peer_bytes'] == {'testclient': 2 * size}
+    assert stats['largest_sender_bytes'] == 2 * size
+    assert stats['rejections'] == {'peer': 4}
+    assert stats['evictions'] == {}
@@ -0,0 +1,128 @@
+import base64
+
+import pytest
+
+from ..codes import transactionmanager
+from ..codes.checkpoints import on_block_committed
+from ..codes.crypto_provider import get_crypto_provider
+from ..codes.db_manager import get_cursor
+from ..codes.fs.mempool_manager import Mempool
+from ..codes.transactionmanager import Transactionmanager, verify_transactions_signatures
+from ..codes.verdict_cache import apply_state_changes, clear_verdicts, get_state_versions, \
+    is_economics_verdict_valid, set_economics_verdict, stage_state_changes
+from ..constants import STATE_CHECKPOINT_INTERVAL
+
+
+@pytest.fixture(autouse=True)
+def verdicts():
+    clear_verdicts()
+    yield
+    clear_verdicts()
+
+
+def make_transfer(sender, receiver, tokencode, amount):
+    transaction_manager = Transactionmanager()
+    transaction_manager.set_transaction_data({
+        'transaction': {
+            'timestamp': 1645104445000,
+            'trans_code': f'verdict_transfer_{amount}',
+            'type': 5,
+            'currency': 'NWRL',
+            'fee': 0,
+            'descr': '',
+            'valid': 1,
+            'specific_data': {
+                'transfer_type': 5,
+                'asset1_code': tokencode,
+                'asset2_code': '',
+                'wallet1': sender,
+                'wallet2': receiver,
+                'asset1_number': amount,
+                'asset2_number': 0,
+            },
+        },
+        'signatures': [],
+    })
+    return transaction_manager
+
+
+def test_economics_verdict():
+    balances = [('0xverdict', 'NWRL')]
+    set_economics_verdict(b'transfer', balances, get_state_versions(balances), [5])
+    assert is_economics_verdict_valid(b'transfer', lambda wallet, tokencode: 5)
+    assert is_economics_verdict_valid(b'transfer', lambda wallet, tokencode: 4)
+    assert not is_economics_verdict_valid(b'transfer', lambda wallet, tokencode: 6)
+
+    # Only a committed block changing the balance invalidates the verdict
+    stage_state_changes(7, {('0xverdict', 'NWRL'): 10, ('0xother', 'NWRL'): 1})
+    assert is_economics_verdict_valid(b'transfer', lambda wallet, tokencode: 5)
+    apply_state_changes(7)
+    assert not is_economics_verdict_valid(b'transfer', lambda wallet, tokencode: 5)
+
+
+def test_transfer_rechecked_after_block(tmp_path, monkeypatch):
+    cur = get_cursor()
+    sender, tokencode, balance = cur.execute(
+        'SELECT wallet_address, tokencode, balance FROM balances WHERE balance >= 2 '
+        'ORDER BY wallet_address, tokencode LIMIT 1').fetchone()
+    receiver = cur.execute('SELECT wallet_address FROM wallets WHERE wallet_address != ? LIMIT 1',
+                           (sender, )).fetchone()[0]
+    cur.close()
+
+    mempool = Mempool(str(tmp_path) + '/')
+    monkeypatch.setattr(transactionmanager, 'get_mempool', lambda: mempool)
+    checked = []
+    check_economics = Transactionmanager.check_economics
+
+    def counting_check_economics(self, cur=None):
+        checked.append(self.transaction['trans_code'])
+        return check_economics(self, cur)
+
+    monkeypatch.setattr(Transactionmanager, 'check_economics', counting_check_economics)
+
+    transfer = make_transfer(sender, receiver, tokencode, 1)
+    assert mempool.admit(transfer.get_transaction_complete(), transfer.econvalidator) == 'verdict_transfer_1'
+    # Block assembly reuses the verdict reached on admission
+    assert make_transfer(sender, receiver, tokencode, 1).econvalidator()
+    assert len(checked) == 1
+
+    # A block changing another balance leaves the verdict alone
+    block_index = STATE_CHECKPOINT_INTERVAL * 1000 + 1
+    stage_state_changes(block_index, {(receiver, tokencode): 0})
+    on_block_committed(block_index)
+    assert make_transfer(sender, receiver, tokencode, 1).econvalidator()
+    assert len(checked) == 1
+
+    # One changing the balance it spends from has it checked again
+    stage_state_changes(block_index + 1, {(sender, tokencode): balance})
+    on_block_committed(block_index + 1)
+    assert make_transfer(sender, receiver, tokencode, 1).econvalidator()
+    assert len(checked) == 2
+
+
+def test_signatures_verified_once(monkeypatch):
+    provider = get_crypto_provider()
+    private_key = provider.generate_private_key()
+    public_key = base64.b64encode(provider.get_public_key(private_key)).decode()
+    monkeypatch.setattr(transactionmanager, 'get_public_key_from_address', lambda address: public_key)
+    verified = []
+    verify_signatures = transactionmanager.verify_signatures
+
+    def recording_verify_signatures(items):
+        verified.extend(items)
+        return verify_signatures(items)
+
+    monkeypatch.setattr(transactionmanager, 'verify_signatures', recording_verify_signatures)
+
+    transfer = make_transfer('0xsigner', '0xreceiver', 'NWRL', 1)
+    transfer.sign_transaction(private_key, '0xsigner')
+    forged = make_transfer('0xsigner', '0xreceiver', 'NWRL', 2)
+    forged.signatures = list(transfer.signatures)
+    assert verify_transactions_signatures([transfer, forged]) == [True, False]
+    assert len(verified) == 2
+
+    # Checked again from the same data, as block assembly does, only the invalid one is verified
+    again = Transactionmanager()
+    again.set_transaction_data(transfer.get_transaction_complete())
+    assert verify_transactions_signatures([again, forged]) == [True, False]
+    assert len(verified) == 3
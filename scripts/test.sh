@@ -1,8 +1,10 @@
 mkdir data_test/
 rm data_test/mempool/*.json
 rm data_test/tmp/*.json
-rm data_test/newrl.db
-rm data_test/newrl_p2p.db
+rm data_test/newrl.db data_test/newrl.db-wal data_test/newrl.db-shm
+rm data_test/newrl_p2p.db data_test/newrl_p2p.db-wal data_test/newrl_p2p.db-shm
+rm data_test/blocks/*.dat
+rm data_test/checkpoints/*.db
 cp data_test/template/newrl.db data_test/newrl.db
 cp data_test/template/newrl_p2p.db data_test/newrl_p2p.db
 source venv/bin/activate